@@ -0,0 +1,58 @@
+"""
+geo_utils批量函数的性能对比，只做计时，结果一致性校验见geo_check.py
+
+用法：python geo_benchmark.py [--n 200] [--m 50] [--repeat 20] [--seed 0]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(CURRENT_PATH, '..', 'postprocessor', 'utils'))
+
+from cv_utils import geo_utils
+from cv_utils.roi_utils import PolygonRaster
+from geo_check import gen_points, gen_polygon, gen_rectangles, gen_segments
+
+
+def bench(name, scalar, batch, repeat):
+    t_scalar = timeit.timeit(scalar, number=repeat) / repeat
+    t_batch = timeit.timeit(batch, number=repeat) / repeat
+    print('{:<28} scalar={:>9.3f}ms  batch={:>9.3f}ms  speedup={:>6.1f}x'.format(
+        name, t_scalar * 1000, t_batch * 1000, t_scalar / t_batch if t_batch else float('inf')))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=200, help='第一组数量')
+    parser.add_argument('--m', type=int, default=50, help='第二组数量')
+    parser.add_argument('--repeat', type=int, default=20, help='重复次数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    n, m, repeat = args.n, args.m, args.repeat
+    xyxy1, xyxy2 = gen_rectangles(n), gen_rectangles(m)
+    bench('iou {}x{}'.format(n, m),
+          lambda: [[geo_utils.calc_iou(a, b) for b in xyxy2] for a in xyxy1],
+          lambda: geo_utils.calc_iou_matrix(xyxy1, xyxy2), repeat)
+    bench('rectangle_intersect {}x{}'.format(n, m),
+          lambda: [[geo_utils.is_rectangle_intersect(a, b) for b in xyxy2] for a in xyxy1],
+          lambda: geo_utils.is_rectangle_intersect_matrix(xyxy1, xyxy2), repeat)
+    segments1, segments2 = gen_segments(n), gen_segments(m)
+    bench('seg_intersect {}x{}'.format(n, m),
+          lambda: [[geo_utils.is_seg_intersect(a, b) for b in segments2] for a in segments1],
+          lambda: geo_utils.is_seg_intersect_matrix(segments1, segments2), repeat)
+    polygon, points = gen_polygon(8), gen_points(n * m)
+    bench('point_in_polygon {}'.format(n * m),
+          lambda: [geo_utils.is_point_in_polygon(point, polygon) for point in points],
+          lambda: geo_utils.is_points_in_polygon(points, polygon), repeat)
+    raster = PolygonRaster(polygon)
+    bench('polygon_raster {}'.format(n * m),
+          lambda: [geo_utils.is_point_in_polygon(point, polygon) for point in points],
+          lambda: raster.contains_points(points), repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+geo_utils批量函数及多边形栅格与逐个判断的一致性校验，不一致时抛出AssertionError并以非0状态退出，
+不依赖assert语句，python -O下同样有效；性能对比见geo_benchmark.py
+
+用法：python geo_check.py [--rounds 50] [--seed 0]
+"""
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+
+CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(CURRENT_PATH, '..', 'postprocessor', 'utils'))
+
+from cv_utils import geo_utils
+from cv_utils.roi_utils import PolygonRaster
+
+
+def gen_rectangles(n, size=1920):
+    rectangles = []
+    for _ in range(n):
+        x, y = random.randint(0, size), random.randint(0, size)
+        rectangles.append([x, y, x + random.randint(0, 200), y + random.randint(0, 200)])
+    return rectangles
+
+
+def gen_segments(n, size=1920):
+    return [[[random.randint(0, size), random.randint(0, size)], [random.randint(0, size), random.randint(0, size)]]
+            for _ in range(n)]
+
+
+def gen_polygon(k, size=1920):
+    return [[random.randint(0, size), random.randint(0, size)] for _ in range(k)]
+
+
+def gen_points(n, size=1920):
+    # 包含整数坐标和半像素坐标，覆盖边和顶点上的点
+    return [(random.randint(0, size) / random.choice([1, 2]), random.randint(0, size) / random.choice([1, 2]))
+            for _ in range(n)]
+
+
+def ensure(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def check_iou(n, m):
+    xyxy1, xyxy2 = gen_rectangles(n, 300), gen_rectangles(m, 300)
+    expect = np.array([[geo_utils.calc_iou(a, b) for b in xyxy2] for a in xyxy1]).reshape(n, m)
+    ensure(np.array_equal(geo_utils.calc_iou_matrix(xyxy1, xyxy2), expect), 'calc_iou_matrix mismatch')
+
+
+def check_rectangle_intersect(n, m):
+    xyxy1, xyxy2 = gen_rectangles(n, 300), gen_rectangles(m, 300)
+    expect = np.array([[geo_utils.is_rectangle_intersect(a, b) for b in xyxy2] for a in xyxy1]).reshape(n, m)
+    ensure(np.array_equal(geo_utils.is_rectangle_intersect_matrix(xyxy1, xyxy2), expect),
+           'is_rectangle_intersect_matrix mismatch')
+
+
+def check_seg_intersect(n, m):
+    segments1, segments2 = gen_segments(n, 50), gen_segments(m, 50)
+    expect = np.array([[geo_utils.is_seg_intersect(a, b) for b in segments2] for a in segments1]).reshape(n, m)
+    ensure(np.array_equal(geo_utils.is_seg_intersect_matrix(segments1, segments2), expect),
+           'is_seg_intersect_matrix mismatch')
+
+
+def check_point_in_polygon(n, k):
+    polygon, points = gen_polygon(k, 100), gen_points(n, 100)
+    points.extend(tuple(point) for point in polygon)
+    expect = np.array([geo_utils.is_point_in_polygon(point, polygon) for point in points])
+    ensure(np.array_equal(geo_utils.is_points_in_polygon(points, polygon), expect), 'is_points_in_polygon mismatch')
+    raster = PolygonRaster(polygon)
+    ensure(np.array_equal(raster.contains_points(points), expect), 'PolygonRaster.contains_points mismatch')
+    ensure([raster.contains(point) for point in points] == expect.tolist(), 'PolygonRaster.contains mismatch')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=50, help='校验轮数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    for _ in range(args.rounds):
+        check_iou(random.randint(0, 30), random.randint(0, 30))
+        check_rectangle_intersect(random.randint(0, 30), random.randint(0, 30))
+        check_seg_intersect(random.randint(0, 30), random.randint(0, 30))
+        check_point_in_polygon(random.randint(0, 300), random.randint(3, 10))
+    print('parity ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+队列消息格式对比：json（图像为base64 string） vs binary（message_utils二进制消息，图像为原始字节）
+对比消息大小、编码耗时（图像已编码为jpg或为原始数组，只计序列化）和解码耗时（json需base64解码得到jpg字节，binary零拷贝）
+
+用法：python message_benchmark.py [--repeat 50] [--image /path/to/frame.jpg]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+
+CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(CURRENT_PATH, '..', 'postprocessor', 'utils'))
+
+import message_utils
+
+
+def gen_frame(path=None, size=(1920, 1080)):
+    if path:
+        return cv2.imread(path)
+    # 平滑的噪声图像，jpg压缩率接近监控画面
+    rng = np.random.RandomState(0)
+    image = cv2.resize(rng.randint(0, 255, (size[1] // 16, size[0] // 16, 3), dtype=np.uint8), size,
+                       interpolation=cv2.INTER_CUBIC)
+    noise = rng.randint(0, 16, image.shape, dtype=np.uint8)
+    return cv2.add(image, noise)
+
+
+def gen_crops(frame, n, size=224):
+    height, width = frame.shape[:2]
+    rng = np.random.RandomState(1)
+    crops = []
+    for _ in range(n):
+        x, y = rng.randint(0, width - size), rng.randint(0, height - size)
+        crops.append(np.ascontiguousarray(frame[y:y + size, x:x + size]))
+    return crops
+
+
+def jpg(image):
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def gen_message(images, batch=None):
+    reserved_data = {'specified_model': ['cls'], 'unsort': True}
+    if batch is not None:
+        reserved_data['batch'] = batch
+    return {
+        'source_id': 'source',
+        'time': 1700000000 * 1000000,
+        'infer_image': images,
+        'draw_image': None,
+        'reserved_data': reserved_data
+    }
+
+
+def to_json_images(images):
+    # 与_encode_reinfer_image的json格式相同
+    result = []
+    for image in images:
+        if isinstance(image, np.ndarray):
+            result.append({'data': base64.b64encode(image.tobytes()).decode('utf-8'), 'shape': list(image.shape),
+                           'dtype': str(image.dtype)})
+        else:
+            result.append(base64.b64encode(image).decode('utf-8'))
+    return result
+
+
+def decode_json(data):
+    message = json.loads(data)
+    for image in message['infer_image']:
+        base64.b64decode(image['data'] if isinstance(image, dict) else image)
+    return message
+
+
+def decode_binary(data):
+    message = message_utils.loads(data)
+    for image in message['infer_image']:
+        # 访问数据，memoryview和ndarray均引用data的内存
+        len(image)
+    return message
+
+
+def check(images, data):
+    message = message_utils.loads(data)
+    for expect, image in zip(images, message['infer_image']):
+        if isinstance(expect, np.ndarray):
+            assert np.array_equal(expect, image) and not image.flags.writeable, 'ndarray mismatch'
+        else:
+            assert expect == image.tobytes(), 'bytes mismatch'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Redis message format benchmark')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--image', default=None, help='代表性帧，默认为生成的1920x1080图像')
+    args = parser.parse_args()
+    frame = gen_frame(args.image)
+    crops = gen_crops(frame, 8)
+    rectangles = [{'xyxy': [i, i, i + 224, i + 224], 'conf': 0.9, 'label': 'person', 'color': [0, 255, 0], 'ext': {}}
+                  for i in range(8)]
+    cases = [
+        ('frame jpg', [jpg(frame)], None),
+        ('8 crops jpg', [jpg(crop) for crop in crops], rectangles),
+        ('8 crops raw', crops, rectangles),
+        ('16-frame clip jpg', [jpg(crop) for crop in gen_crops(frame, 16)], None)
+    ]
+    print('{:<18} {:>11} {:>11} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'case', 'json_KB', 'binary_KB', 'ratio', 'enc_json', 'enc_bin', 'dec_json', 'dec_bin'))
+    for name, images, batch in cases:
+        json_data = json.dumps(gen_message(to_json_images(images), batch), ensure_ascii=False)
+        binary_data = message_utils.dumps(gen_message(images, batch))
+        check(images, binary_data)
+        assert decode_json(json_data)['reserved_data'] == message_utils.loads(binary_data)['reserved_data']
+        # 兼容旧的json消息
+        assert message_utils.loads(json_data) == json.loads(json_data)
+        timings = [timeit.timeit(function, number=args.repeat) / args.repeat * 1000 for function in (
+            lambda: json.dumps(gen_message(to_json_images(images), batch), ensure_ascii=False),
+            lambda: message_utils.dumps(gen_message(images, batch)),
+            lambda: decode_json(json_data),
+            lambda: decode_binary(binary_data))]
+        print('{:<18} {:>11.1f} {:>11.1f} {:>8.2f} {:>8.3f}ms {:>8.3f}ms {:>8.3f}ms {:>8.3f}ms'.format(
+            name, len(json_data.encode('utf-8')) / 1024, len(binary_data) / 1024,
+            len(binary_data) / len(json_data.encode('utf-8')), *timings))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,463 @@
+"""
+后处理离线录制回放压测，不依赖引擎、Redis、数据库和gv，按算法统计吞吐、延迟和内存分配，可作为回归压测
+
+录制：引擎配置conf.postprocess_record_path（可选conf.postprocess_record_max_records）后运行，
+    各算法postprocess的输入按顺序写入录制文件，见postprocessor/utils/record_utils.py
+合成：python replay_benchmark.py synth --output synth.rec [--algs person_intrusion,motion] [--sources 2]
+    [--frames 300] [--targets 8] [--width 1920] [--height 1080] [--seed 0]
+回放：python replay_benchmark.py replay synth.rec [--algs person_intrusion,motion] [--repeat 3] [--warmup 10]
+    [--no-alloc] [--gallery 1000] [--engine-path /path/to/engine] [--json result.json]
+    [--baseline baseline.json] [--tolerance 0.2]
+
+回放时Redis队列、数据库和特征底库（gv.index_dic）始终使用进程内替身；config、logger、tracker、window优先导入
+--engine-path下的引擎实现，导入失败时使用替身，替身的跟踪和时间窗口为简化实现，结果与引擎不完全一致，只用于压测；
+指定--baseline时，任一算法吞吐低于基线(1 - tolerance)倍或p99延迟高于基线(1 + tolerance)倍则以状态码1退出
+"""
+import argparse
+import collections
+import contextlib
+import enum
+import importlib
+import json
+import logging
+import os
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+import types
+
+import cv2
+import numpy as np
+
+CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
+ALGORITHM_PATH = os.path.join(CURRENT_PATH, '..')
+
+
+class StandInRedisQueue:
+    """
+    Redis队列替身，只保留最近的消息
+    """
+
+    def __init__(self, name, maxsize=300, *args, **kwargs):
+        self.name = name
+        self.messages = collections.deque(maxlen=maxsize)
+        self.count = 0
+
+    def put(self, item):
+        self.messages.append(item)
+        self.count += 1
+        return True
+
+    def get(self, *args, **kwargs):
+        return self.messages.popleft() if self.messages else None
+
+    def qsize(self):
+        return len(self.messages)
+
+
+class StandInGallery:
+    """
+    特征底库替身，首次检索时按特征维度生成随机底库
+    """
+
+    def __init__(self, group_id, size, seed=0):
+        self.group_id = group_id
+        self.size = size
+        self.seed = seed
+        self.index = None
+
+    def __build(self, dim):
+        from postprocessor.utils.index_utils import GalleryIndex
+        rng = np.random.default_rng(self.seed)
+        self.index = GalleryIndex(dim, self.group_id, str(self.group_id), capacity=self.size)
+        for id_, feature in enumerate(rng.standard_normal((self.size, dim), dtype=np.float32)):
+            self.index.add(id_, feature, {'id': id_, 'name': 'gallery_{}'.format(id_)})
+        return self.index
+
+    def search_batch(self, features, similarity=0, k=1):
+        features = np.asarray(features, dtype=np.float32)
+        if self.index is None:
+            self.__build(features.shape[-1])
+        return self.index.search_batch(features, similarity, k)
+
+    def search(self, feature, similarity=0):
+        result = self.search_batch(feature, similarity)[0]
+        return result[0] if result else (None, None)
+
+    def query(self, id_):
+        return self.index.query(id_) if self.index is not None else None
+
+
+class StandInIndexDict(dict):
+    """
+    gv.index_dic替身，任意group_id都返回一个随机底库
+    """
+
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def get(self, group_id, default=None):
+        if group_id not in self:
+            self[group_id] = StandInGallery(group_id, self.size, seed=len(self))
+        return self[group_id]
+
+
+class StandInTracker:
+    """
+    跟踪器替身，按IoU贪心匹配上一帧的目标
+    """
+    track_buffer = 30
+
+    def __init__(self, frame_interval=None, iou=0.3):
+        self.iou = iou
+        # {track_id: [xyxy, 丢失帧数]}
+        self.tracks = {}
+        self.next_id = 0
+
+    @staticmethod
+    def __iou(a, b):
+        w = min(a[2], b[2]) - max(a[0], b[0])
+        h = min(a[3], b[3]) - max(a[1], b[1])
+        if w <= 0 or h <= 0:
+            return 0
+        inter = w * h
+        return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+    def track(self, rectangles):
+        result = {}
+        unmatched = set(self.tracks)
+        for rectangle in rectangles:
+            best, best_iou = None, self.iou
+            for track_id in unmatched:
+                iou = self.__iou(self.tracks[track_id][0], rectangle['xyxy'])
+                if iou >= best_iou:
+                    best, best_iou = track_id, iou
+            if best is None:
+                best = self.next_id
+                self.next_id += 1
+            else:
+                unmatched.discard(best)
+            self.tracks[best] = [rectangle['xyxy'], 0]
+            result[best] = rectangle
+        for track_id in unmatched:
+            self.tracks[track_id][1] += 1
+            if self.tracks[track_id][1] > self.track_buffer:
+                del self.tracks[track_id]
+        return result
+
+
+class StandInRatioWindow:
+    """
+    比例窗口替身，最近length帧中命中的比例达到阈值时返回True
+    """
+
+    def __init__(self, length, threshold):
+        self.threshold = threshold
+        self.hits = collections.deque(maxlen=max(int(length), 1))
+
+    def insert(self, item):
+        self.hits.append(bool(item['data']['hit']))
+        return len(self.hits) == self.hits.maxlen and sum(self.hits) / len(self.hits) >= self.threshold
+
+
+def install_stand_ins(engine_path=None, gallery_size=1000):
+    """
+    安装引擎模块替身，返回使用了替身的模块名称
+    """
+    if engine_path:
+        sys.path.insert(0, engine_path)
+    sys.path.insert(0, ALGORITHM_PATH)
+    stand_ins = []
+
+    def install(name, **attrs):
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+        stand_ins.append(name)
+        return module
+
+    def import_or_install(name, **attrs):
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            return install(name, **attrs)
+
+    import_or_install('config', conf=types.SimpleNamespace(redis_queue_source='replay', redis_host='localhost',
+                                                             redis_port=6379, redis_db=0))
+    import_or_install('logger', LOGGER=logging.getLogger('replay'),
+                      LogLevel=enum.Enum('LogLevel', {level: level for level in
+                                                      ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')}))
+    import_or_install('tracker', Tracker=StandInTracker)
+    try:
+        importlib.import_module('window.ratio_window')
+    except ImportError:
+        window = install('window')
+        window.__path__ = []
+        window.ratio_window = install('window.ratio_window', RatioWindow=StandInRatioWindow)
+    # 外部服务始终使用替身
+    install('redis_queue', RedisQueue=StandInRedisQueue)
+    counting = {}
+
+    @contextlib.contextmanager
+    def get_session():
+        yield None
+
+    def query(db_session, line_id):
+        return True, {'result': counting.get(line_id, '{"count": 0, "increase": 0, "decrease": 0, "delta": 0}')}
+
+    def update(db_session, line_id, **kwargs):
+        counting[line_id] = kwargs.get('result')
+        return True
+
+    db = install('db')
+    db.__path__ = []
+    db.operation = install('db.operation', get_session=get_session)
+    db.cross_line_counting = install('db.cross_line_counting', query=query, update=update)
+    install('gv', index_dic=StandInIndexDict(gallery_size))
+    return stand_ins
+
+
+def gen_boxes(rng, count, width, height):
+    boxes = []
+    for _ in range(count):
+        w, h = rng.randint(width // 30, width // 8), rng.randint(height // 12, height // 4)
+        boxes.append([rng.uniform(0, width - w), rng.uniform(0, height - h), w, h,
+                      rng.uniform(-8, 8), rng.uniform(-4, 4)])
+    return boxes
+
+
+def move_boxes(boxes, width, height):
+    for box in boxes:
+        box[0] = min(max(box[0] + box[4], 0), width - box[2])
+        box[1] = min(max(box[1] + box[5], 0), height - box[3])
+        if box[0] in (0, width - box[2]):
+            box[4] = -box[4]
+        if box[1] in (0, height - box[3]):
+            box[5] = -box[5]
+    return boxes
+
+
+def gen_frame(boxes, width, height, noise):
+    image = noise.copy()
+    for x, y, w, h, _, _ in boxes:
+        cv2.rectangle(image, (int(x), int(y)), (int(x + w), int(y + h)), (255, 255, 255), -1)
+    return image
+
+
+def gen_polygon(width, height):
+    return [[width // 8, height // 8], [width * 7 // 8, height // 8], [width * 7 // 8, height * 7 // 8],
+            [width // 8, height * 7 // 8]]
+
+
+# 合成录制支持的算法：(alg_type, reserved_args, 引擎结果类型)
+SYNTH_ALGS = {
+    'person_intrusion': ('normal', {'strategy': 'bottom'}, 'det'),
+    'person_gathering': ('normal', {'strategy': 'bottom', 'threshold': 3}, 'det'),
+    'person_loitering': ('normal', {'iou': 0.3, 'length': 10, 'threshold': 8}, 'det'),
+    'person_counting': ('cross_line_counting', {'strategy': 'bottom'}, 'det'),
+    'motion': ('normal', {'diff': 25, 'area': 100}, 'image'),
+    'black_screen': ('normal', {'threshold': 20}, 'image')
+}
+
+
+def gen_args(alg_name, t, boxes, image_b64, width, height):
+    alg_type, reserved_args, result_type = SYNTH_ALGS[alg_name]
+    if 'det' == result_type:
+        engine_result = [{'xyxy': [x, y, x + w, y + h], 'conf': 0.9, 'label': 0} for x, y, w, h, _, _ in boxes]
+        model_conf = {'args': {'conf_thres': 0.3}, 'label': {'class2label': {'0': 'person'}}}
+    else:
+        engine_result = image_b64
+        model_conf = {'args': {}, 'label': {'class2label': {}}}
+    lines = []
+    if 'cross_line_counting' == alg_type:
+        lines = [{'id': '{}_line'.format(alg_name), 'name': 'line', 'line': [[0, height // 2], [width, height // 2]],
+                  'direction': 'u-d+', 'action': {}}]
+    return {
+        'time': t,
+        'alert_label': ['person'],
+        'bbox': {'polygons': [{'id': '{}_roi'.format(alg_name), 'name': 'roi', 'polygon': gen_polygon(width, height)}],
+                 'lines': lines},
+        'scale': 1,
+        'frame_interval': 200,
+        'reserved_args': reserved_args,
+        'alg_type': alg_type,
+        'plan': None,
+        'model': {'{}_model'.format(alg_name): {'model_conf': model_conf, 'engine_result': engine_result}}
+    }
+
+
+def synth(args):
+    from postprocessor.utils.image_utils import opencv_to_base64
+    from postprocessor.utils.record_utils import Recorder
+    rng = random.Random(args.seed)
+    np.random.seed(args.seed)
+    alg_names = args.algs.split(',') if args.algs else list(SYNTH_ALGS)
+    noise = cv2.GaussianBlur(np.random.randint(0, 128, (args.height, args.width, 3), dtype=np.uint8), (21, 21), 0)
+    boxes = {source_id: gen_boxes(rng, args.targets, args.width, args.height) for source_id in range(args.sources)}
+    recorder = Recorder(args.output)
+    start = time.time()
+    for frame_no in range(args.frames):
+        t = start + frame_no * 0.2
+        for source_id in range(args.sources):
+            move_boxes(boxes[source_id], args.width, args.height)
+            image_b64 = opencv_to_base64(gen_frame(boxes[source_id], args.width, args.height, noise))
+            for alg_name in alg_names:
+                recorder.record('source_{}'.format(source_id), alg_name,
+                                gen_args(alg_name, t, boxes[source_id], image_b64, args.width, args.height), image_b64)
+    recorder.close()
+    print('Recorded {} records, {} frames to {} ({:.1f} MiB)'.format(
+        recorder.records, recorder.frames, args.output, os.path.getsize(args.output) / (1 << 20)))
+    return 0
+
+
+def load_records(path, alg_names=None):
+    from postprocessor.utils.record_utils import iter_records
+    records = []
+    for source_id, alg_name, args, image in iter_records(path):
+        if alg_names and alg_name not in alg_names:
+            continue
+        # args在后处理中会被修改，保存序列化结果，每次回放前还原
+        records.append((source_id, alg_name, pickle.dumps(args, pickle.HIGHEST_PROTOCOL), image))
+    return records
+
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def replay_once(records, warmup, latencies=None, allocations=None):
+    postprocessor_module = importlib.import_module('postprocessor')
+    # 每轮回放使用新的后处理实例，清空上一轮的帧缓存
+    postprocessor_module.Postprocessor.frame_cache.entries.clear()
+    postprocessors = {}
+    # 预热按(source_id, alg_name)分别计数，每个实例的前warmup条记录都不计入统计
+    counts = collections.Counter()
+    for source_id, alg_name, args_data, image in records:
+        counts[(source_id, alg_name)] += 1
+        warm = counts[(source_id, alg_name)] > warmup
+        postprocessor = postprocessors.get((source_id, alg_name))
+        if postprocessor is None:
+            module = importlib.import_module('postprocessor.{}'.format(alg_name))
+            postprocessor = module.Postprocessor(source_id, alg_name)
+            postprocessors[(source_id, alg_name)] = postprocessor
+        args = pickle.loads(args_data)
+        if isinstance(image, np.ndarray):
+            image = image.copy()
+        if allocations is not None:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            postprocessor.postprocess(args, image)
+            if warm:
+                allocations[alg_name].append(tracemalloc.get_traced_memory()[1] - current)
+            continue
+        start = time.perf_counter()
+        postprocessor.postprocess(args, image)
+        elapsed = time.perf_counter() - start
+        if warm and latencies is not None:
+            latencies[alg_name].append(elapsed)
+    # 后处理实例仍存活时的内存占用，只在统计内存分配时返回
+    return tracemalloc.get_traced_memory()[0] if allocations is not None else None
+
+
+def replay(args):
+    records = load_records(args.record, set(args.algs.split(',')) if args.algs else None)
+    if not records:
+        print('No records to replay')
+        return 1
+    latencies = collections.defaultdict(list)
+    for _ in range(args.repeat):
+        replay_once(records, args.warmup, latencies)
+    allocations = collections.defaultdict(list)
+    retained = None
+    if not args.no_alloc:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        # 回放结束后仍被后处理实例持有的内存，随录制长度持续增长说明状态没有淘汰
+        retained = replay_once(records, args.warmup, allocations=allocations) - before
+        tracemalloc.stop()
+    results = {}
+    for alg_name in sorted(latencies):
+        values = latencies[alg_name]
+        allocs = allocations.get(alg_name, [])
+        results[alg_name] = {
+            'frames': len(values),
+            'fps': len(values) / sum(values) if sum(values) else 0,
+            'p50_ms': percentile(values, 0.5) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'alloc_avg_kib': sum(allocs) / len(allocs) / 1024 if allocs else 0,
+            'alloc_max_kib': max(allocs) / 1024 if allocs else 0
+        }
+    print('{:<28}{:>8}{:>12}{:>10}{:>10}{:>16}{:>16}'.format(
+        'alg_name', 'frames', 'frames/s', 'p50 ms', 'p99 ms', 'alloc avg KiB', 'alloc max KiB'))
+    for alg_name, result in results.items():
+        print('{:<28}{:>8}{:>12.1f}{:>10.3f}{:>10.3f}{:>16.1f}{:>16.1f}'.format(
+            alg_name, result['frames'], result['fps'], result['p50_ms'], result['p99_ms'], result['alloc_avg_kib'],
+            result['alloc_max_kib']))
+    if retained is not None:
+        print('retained after replay: {:.1f} KiB'.format(retained / 1024))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        return check_baseline(results, args.baseline, args.tolerance)
+    return 0
+
+
+def check_baseline(results, path, tolerance):
+    with open(path) as f:
+        baseline = json.load(f)
+    failed = []
+    for alg_name, base in baseline.items():
+        result = results.get(alg_name)
+        if result is None:
+            continue
+        if result['fps'] < base['fps'] * (1 - tolerance):
+            failed.append('{}: frames/s {:.1f} < baseline {:.1f}'.format(alg_name, result['fps'], base['fps']))
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            failed.append('{}: p99 {:.3f} ms > baseline {:.3f} ms'.format(alg_name, result['p99_ms'],
+                                                                          base['p99_ms']))
+    for message in failed:
+        print('REGRESSION {}'.format(message))
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Postprocessor record and replay benchmark')
+    parser.add_argument('--engine-path', default=None, help='引擎代码路径，用于导入config、logger、tracker、window')
+    parser.add_argument('--gallery', type=int, default=1000, help='替身特征底库的大小')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    synth_parser = subparsers.add_parser('synth', help='生成合成录制')
+    synth_parser.add_argument('--output', required=True)
+    synth_parser.add_argument('--algs', default=None, help='逗号分隔，默认为全部支持的算法：{}'.format(
+        ','.join(SYNTH_ALGS)))
+    synth_parser.add_argument('--sources', type=int, default=2)
+    synth_parser.add_argument('--frames', type=int, default=300)
+    synth_parser.add_argument('--targets', type=int, default=8)
+    synth_parser.add_argument('--width', type=int, default=1920)
+    synth_parser.add_argument('--height', type=int, default=1080)
+    synth_parser.add_argument('--seed', type=int, default=0)
+    replay_parser = subparsers.add_parser('replay', help='回放录制')
+    replay_parser.add_argument('record')
+    replay_parser.add_argument('--algs', default=None, help='逗号分隔，默认为录制中的全部算法')
+    replay_parser.add_argument('--repeat', type=int, default=3)
+    replay_parser.add_argument('--warmup', type=int, default=10, help='每轮回放中每个(source_id, alg_name)不计入统计的记录数')
+    replay_parser.add_argument('--no-alloc', action='store_true', help='不统计内存分配')
+    replay_parser.add_argument('--json', default=None, help='结果输出路径，可作为基线')
+    replay_parser.add_argument('--baseline', default=None, help='基线结果路径')
+    replay_parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    stand_ins = install_stand_ins(args.engine_path, args.gallery)
+    print('stand-ins: {}'.format(', '.join(stand_ins)))
+    if 'synth' == args.command:
+        return synth(args)
+    return replay(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+RoiMask掩码统计的一致性校验与性能对比，对比整帧掩码与外接矩形裁剪、积分图的结果和耗时，以及多边形裁剪（crop_poly）
+
+用法：python roi_benchmark.py [--width 1920] [--height 1080] [--rois 4] [--repeat 20] [--seed 0]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+import cv2
+import numpy as np
+
+CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(CURRENT_PATH, '..', 'postprocessor', 'utils'))
+
+from cv_utils.roi_utils import RoiMask
+
+
+def gen_polygon(width, height, rectangle=False):
+    x0, y0 = random.randint(-50, width - 1), random.randint(-50, height - 1)
+    x1, y1 = x0 + random.randint(1, width // 3), y0 + random.randint(1, height // 3)
+    if rectangle:
+        return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.int32)
+    return np.array([[random.randint(x0, x1), random.randint(y0, y1)] for _ in range(random.randint(3, 8))],
+                    dtype=np.int32)
+
+
+def gen_gray(width, height):
+    image = np.random.randint(0, 256, (height, width), dtype=np.uint8)
+    return cv2.GaussianBlur(image, (21, 21), 0)
+
+
+def full_mask(points, shape):
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    cv2.fillPoly(mask, [points], 255)
+    return mask
+
+
+def full_mean(image, mask):
+    pixels = image[np.where(255 == mask)]
+    return np.mean(pixels, axis=0) if len(pixels) else None
+
+
+def full_rects(pre_gray, cur_gray, mask, diff_th=25):
+    delta = cv2.absdiff(cv2.bitwise_and(pre_gray, mask), cv2.bitwise_and(cur_gray, mask))
+    binary_image = cv2.threshold(delta, diff_th, 255, cv2.THRESH_BINARY)[1]
+    contours, _ = cv2.findContours(binary_image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    return [(cv2.contourArea(contour), cv2.boundingRect(contour)) for contour in contours]
+
+
+def full_crop(image, points, reverse=False):
+    mask = np.full(image.shape, 255, dtype=np.uint8) if reverse else np.zeros(image.shape, dtype=np.uint8)
+    cv2.fillPoly(mask, [points], (0, 0, 0) if reverse else (255, 255, 255))
+    x, y, w, h = cv2.boundingRect(points)
+    return cv2.bitwise_and(image, mask)[y:y + h, x:x + w]
+
+
+def roi_rects(pre_gray, cur_gray, roi_mask, diff_th=25):
+    delta = cv2.absdiff(roi_mask.apply(pre_gray), roi_mask.apply(cur_gray))
+    binary_image = cv2.threshold(delta, diff_th, 255, cv2.THRESH_BINARY)[1]
+    contours, _ = roi_mask.find_contours(binary_image)
+    return [(cv2.contourArea(contour), cv2.boundingRect(contour)) for contour in contours]
+
+
+def check(width, height):
+    image, pre_image = gen_gray(width, height), gen_gray(width, height)
+    integral = cv2.integral(image)
+    points = gen_polygon(width, height, random.random() < 0.5)
+    mask, roi_mask = full_mask(points, image.shape), RoiMask(points, image.shape)
+    expect = full_mean(image, mask)
+    for mean in (roi_mask.mean(image), roi_mask.mean(image, integral)):
+        assert (expect is None and mean is None) or mean == expect, 'RoiMask.mean mismatch'
+    assert roi_rects(pre_image, image, roi_mask) == full_rects(pre_image, image, mask), 'RoiMask contours mismatch'
+    # 多边形裁剪，取完全在图像内的多边形，与整帧掩码按位与之后再裁剪一致
+    color = cv2.merge([image, pre_image, image])
+    points = np.clip(points, 0, [width - 1, height - 1]).astype(np.int32)
+    crop_mask = RoiMask(points, color.shape, pad=0)
+    for reverse in (False, True):
+        assert np.array_equal(crop_mask.extract(color, reverse), full_crop(color, points, reverse)), \
+            'RoiMask.extract mismatch'
+
+
+def mean_integral(image, roi_masks):
+    integral = cv2.integral(image)
+    return [roi_mask.mean(image, integral) for roi_mask in roi_masks]
+
+
+def bench(name, full, roi, repeat):
+    t_full = timeit.timeit(full, number=repeat) / repeat
+    t_roi = timeit.timeit(roi, number=repeat) / repeat
+    print('{:<28} full={:>9.3f}ms  roi={:>9.3f}ms  speedup={:>6.1f}x'.format(
+        name, t_full * 1000, t_roi * 1000, t_full / t_roi if t_roi else float('inf')))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920, help='图像宽度')
+    parser.add_argument('--height', type=int, default=1080, help='图像高度')
+    parser.add_argument('--rois', type=int, default=4, help='ROI数量')
+    parser.add_argument('--repeat', type=int, default=20, help='重复次数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    # 一致性校验
+    for _ in range(100):
+        check(random.randint(20, 400), random.randint(20, 400))
+    print('parity ok')
+    # 性能对比
+    width, height, repeat = args.width, args.height, args.repeat
+    image, pre_image = gen_gray(width, height), gen_gray(width, height)
+    color = cv2.merge([image, pre_image, image])
+    for rectangle in (False, True):
+        polygons = [gen_polygon(width, height, rectangle) for _ in range(args.rois)]
+        masks = [full_mask(points, image.shape) for points in polygons]
+        roi_masks = [RoiMask(points, image.shape) for points in polygons]
+        kind = 'rectangle' if rectangle else 'polygon'
+        bench('mean {} x{}'.format(kind, args.rois),
+              lambda: [full_mean(image, mask) for mask in masks],
+              lambda: [roi_mask.mean(image) for roi_mask in roi_masks], repeat)
+        if rectangle:
+            bench('mean {} x{} integral'.format(kind, args.rois),
+                  lambda: [full_mean(image, mask) for mask in masks],
+                  lambda: mean_integral(image, roi_masks), repeat)
+        bench('motion {} x{}'.format(kind, args.rois),
+              lambda: [full_rects(pre_image, image, mask) for mask in masks],
+              lambda: [roi_rects(pre_image, image, roi_mask) for roi_mask in roi_masks], repeat)
+        crop_masks = [RoiMask(points, color.shape, pad=0) for points in polygons]
+        bench('crop {} x{}'.format(kind, args.rois),
+              lambda: [full_crop(color, points) for points in polygons],
+              lambda: [crop_mask.extract(color) for crop_mask in crop_masks], repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+后处理启动耗时对比，每次测量在新的子进程中进行：
+    eager：导入全部算法模块
+    lazy-cold：注册表无缓存，解析全部模块元数据后只导入配置的算法
+    lazy：注册表缓存命中，只导入配置的算法
+
+用法：python startup_benchmark.py [--algs person_intrusion,motion] [--repeat 5] [--engine-path /path/to/engine]
+
+引擎模块（config、logger、redis_queue、gv等）的替身见replay_benchmark.py；页面缓存会掩盖存储的读取耗时，
+慢速存储上的差异需在清空页面缓存（echo 3 > /proc/sys/vm/drop_caches）后测量；
+cv2、numpy等公共依赖所有算法都需要，单独计为deps_ms，注册表只能节省算法模块及其独有依赖（如shapely）的导入耗时，
+进程总耗时中公共依赖和解释器启动占大部分，差异可能小于测量波动，以import_ms为准
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
+POSTPROCESSOR_PATH = os.path.join(CURRENT_PATH, '..', 'postprocessor')
+MODES = ('eager', 'lazy-cold', 'lazy')
+
+
+def list_algorithms():
+    return sorted(name[:-3] for name in os.listdir(POSTPROCESSOR_PATH)
+                  if name.endswith('.py') and not name.startswith('_'))
+
+
+def child(args):
+    deps_start = time.perf_counter()
+    sys.path.insert(0, CURRENT_PATH)
+    from replay_benchmark import install_stand_ins
+    install_stand_ins(args.engine_path)
+    # 替身和cv2、numpy等公共依赖的导入单独计时
+    start = time.perf_counter()
+    deps_time = start - deps_start
+    scan_time, parsed, errors = 0, 0, []
+    if 'eager' == args.child:
+        # 按文件名导入全部算法模块
+        alg_names = list_algorithms()
+        for alg_name in alg_names:
+            try:
+                importlib.import_module('postprocessor.{}'.format(alg_name))
+            except Exception:
+                errors.append(alg_name)
+        loaded = len(alg_names) - len(errors)
+    else:
+        from postprocessor.utils.registry_utils import PostprocessorRegistry
+        registry = PostprocessorRegistry('postprocessor', cache_path=args.cache)
+        scan_start = time.perf_counter()
+        registry.scan()
+        scan_time = time.perf_counter() - scan_start
+        errors = sorted(registry.preload(args.algs.split(',')))
+        parsed, loaded = registry.parsed, len(registry.classes)
+    print(json.dumps({
+        'time': time.perf_counter() - start,
+        'deps': deps_time,
+        'scan': scan_time,
+        'parsed': parsed,
+        'loaded': loaded,
+        'errors': errors,
+        'modules': len(sys.modules)
+    }))
+    return 0
+
+
+def run(mode, args):
+    if 'lazy-cold' == mode and os.path.exists(args.cache):
+        os.remove(args.cache)
+    command = [sys.executable, os.path.realpath(__file__), '--child', mode, '--algs', args.algs,
+               '--cache', args.cache]
+    if args.engine_path:
+        command += ['--engine-path', args.engine_path]
+    start = time.perf_counter()
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Postprocessor startup benchmark')
+    parser.add_argument('--algs', default='person_intrusion,motion', help='逗号分隔，模拟盒子上配置的算法')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--engine-path', default=None, help='引擎代码路径，用于导入config、logger、tracker、window')
+    parser.add_argument('--cache', default=None, help='注册表缓存文件路径，默认为临时文件')
+    parser.add_argument('--child', default=None, choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+    if args.cache is None:
+        args.cache = os.path.join(tempfile.gettempdir(), 'postprocessor_registry_benchmark.json')
+    print('algorithms: {}, configured: {}'.format(len(list_algorithms()), args.algs))
+    print('{:<10} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8} {:>8}'.format(
+        'mode', 'process_ms', 'deps_ms', 'import_ms', 'scan_ms', 'parsed', 'loaded', 'modules'))
+    for mode in MODES:
+        if 'lazy' == mode:
+            # 生成缓存
+            run('lazy-cold', args)
+        results = [run(mode, args) for _ in range(args.repeat)]
+        last = results[-1]
+        print('{:<10} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.2f} {:>8} {:>8} {:>8}'.format(
+            mode, statistics.median(result['process'] for result in results) * 1000,
+            statistics.median(result['deps'] for result in results) * 1000,
+            statistics.median(result['time'] for result in results) * 1000,
+            statistics.median(result['scan'] for result in results) * 1000,
+            last['parsed'], last['loaded'], last['modules']))
+        if last['errors']:
+            print('  import failed: {}'.format(', '.join(last['errors'])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
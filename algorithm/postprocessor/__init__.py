@@ -1,23 +1,159 @@
 import copy
+import heapq
 import os
 import random
 import sys
+import time
 
-import db.cross_line_counting
+import numpy as np
 from config import conf
-from db.operation import get_session
 from logger import LOGGER
 from redis_queue import RedisQueue
-from .utils import json_utils
-from .utils.cv_utils.geo_utils import is_point_in_polygon, is_seg_intersect
-from .utils.time_utils import get_weekday, get_day_second
+from .utils import json_utils, message_utils
+from .utils.clip_utils import ClipBuffer
+from .utils.counting_utils import CrossLineCountingStore
+from .utils.cv_utils.classify_cache_utils import ClassifyCache, dhash
+from .utils.cv_utils.color_utils import rgb_reverse
+from .utils.cv_utils.crop_utils import CropBuffer, crop_rectangle
+from .utils.cv_utils.geo_utils import is_seg_intersect, is_seg_intersect_matrix
+from .utils.cv_utils.motion_utils import MotionGate
+from .utils.cv_utils.roi_utils import PolygonRaster
+from .utils.frame_utils import Frame, FrameCache, is_frame_handle
+from .utils.image_utils import bytes_to_base64, opencv_to_base64, opencv_to_bytes
+from .utils.metrics_utils import MetricsRegistry, SIZE_BUCKETS
+from .utils.record_utils import Recorder
+from .utils.time_utils import WeeklyPlan
+from .utils.track_utils import TrackTable
 
 CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(CURRENT_PATH)
 
 
+class ReinferCoordinator:
+    """
+    二次推理协调器，跟踪已发送但尚未返回全部结果的二次推理任务
+    超时通过按截止时间排序的最小堆淘汰，完成判定依赖剩余结果计数，均无需遍历全部任务；
+    早于最近一次完成帧的任务视为迟到，计入统计后照常返回，结果和告警不丢失
+    """
+
+    def __init__(self, source_id, alg_name, timeout):
+        self.source_id = source_id
+        self.alg_name = alg_name
+        self.timeout = timeout
+        # {time: {'count': 预期结果数, 'remaining': 剩余结果数, 'result': [], ...}}
+        self.jobs = {}
+        # [(deadline, time), ...]，任务完成后不从堆中删除，出堆时再判断
+        self.heap = []
+        self.now = None
+        self.last_time = None
+        # 统计
+        self.submitted = 0
+        self.completed = 0
+        self.expired = 0
+        self.late = 0
+
+    def submit(self, time, count, **kwargs):
+        """
+        登记二次推理任务
+        Args:
+            time: 帧时间戳
+            count: 预期结果数
+            **kwargs: 随任务保存的数据，任务完成后原样返回
+        Returns: 任务
+        """
+        job = dict(kwargs, count=count, remaining=count, result=[])
+        self.jobs[time] = job
+        heapq.heappush(self.heap, (time + self.timeout, time))
+        self.submitted += 1
+        return job
+
+    def complete(self, time, results):
+        """
+        合并二次推理结果
+        Args:
+            time: 帧时间戳
+            results: 本次返回的结果列表，每个元素计为一个结果
+        Returns: 全部结果返回时返回任务，迟到的任务带有late标记，否则返回None
+        """
+        job = self.jobs.get(time)
+        if job is None:
+            self.late += 1
+            LOGGER.warning('Not found reinfer result, source_id={}, alg_name={}, time={}'.format(
+                self.source_id, self.alg_name, time))
+            return None
+        job['result'].extend(results)
+        job['remaining'] -= len(results)
+        if job['remaining'] > 0:
+            return None
+        del self.jobs[time]
+        if self.last_time is not None and time < self.last_time:
+            self.late += 1
+            job['late'] = True
+            LOGGER.warning('Reinfer result late, source_id={}, alg_name={}, time={}, last_time={}'.format(
+                self.source_id, self.alg_name, time, self.last_time))
+        else:
+            self.last_time = time
+        self.completed += 1
+        return job
+
+    def expire(self, now):
+        """
+        淘汰超时任务
+        Args:
+            now: 当前帧时间戳
+        Returns: 超时任务数
+        """
+        if self.now is None or now > self.now:
+            self.now = now
+        count = 0
+        while self.heap and self.heap[0][0] < self.now:
+            deadline, time = heapq.heappop(self.heap)
+            if self.jobs.pop(time, None) is None:
+                continue
+            count += 1
+            LOGGER.warning('Reinfer result expired, source_id={}, alg_name={}, time={}, timeout={}'.format(
+                self.source_id, self.alg_name, time, self.timeout))
+        self.expired += count
+        return count
+
+    def stats(self):
+        """
+        统计信息
+        Returns: dict
+        """
+        return {
+            'pending': len(self.jobs),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'expired': self.expired,
+            'late': self.late
+        }
+
+
 class Postprocessor:
     rq_source = RedisQueue(conf.redis_queue_source, 300, conf.redis_host, conf.redis_port, conf.redis_db)
+    counting_store = CrossLineCountingStore(getattr(conf, 'cross_line_counting_refresh_interval', 5))
+    frame_cache = FrameCache()
+    # 录制后处理输入，用于离线回放压测，见benchmark/replay_benchmark.py
+    recorder = Recorder(conf.postprocess_record_path, getattr(conf, 'postprocess_record_max_records', None)) \
+        if getattr(conf, 'postprocess_record_path', None) else None
+    # 二次推理图像的发送格式，jpg：jpg编码，raw：原始uint8数组，需引擎支持
+    reinfer_image_format = getattr(conf, 'reinfer_image_format', 'jpg')
+    reinfer_jpeg_quality = getattr(conf, 'reinfer_jpeg_quality', None)
+    # 队列消息的序列化格式，json：图像为base64 string，binary：二进制消息，图像为原始字节，见message_utils，需引擎支持
+    redis_message_format = getattr(conf, 'redis_message_format', 'json')
+    # 时序片段的发送方式，full：每次发送完整片段，delta：只发送上次提交之后新增的帧，需引擎按片段id拼接
+    reinfer_clip_format = getattr(conf, 'reinfer_clip_format', 'full')
+    # 裁剪图像的发送方式，False：每张裁剪图像一条消息，引擎逐张返回结果，True：同一帧合并为一条消息，需引擎支持批量返回
+    reinfer_batch = getattr(conf, 'reinfer_batch', False)
+    # 分阶段耗时指标，按(source_id, alg_name)聚合，定期写入文件或通过HTTP拉取
+    metrics = MetricsRegistry(getattr(conf, 'postprocess_metrics_enabled', True),
+                              getattr(conf, 'postprocess_metrics_path', None),
+                              getattr(conf, 'postprocess_metrics_interval', 60),
+                              getattr(conf, 'postprocess_metrics_port', None))
+    # 运动门控总开关，默认关闭；门控需要解码每一帧，只在跳过的工作（如二次推理）比解码更耗时的算法中通过motion_gate_args启用，
+    # reserved_args中的motion_gate可覆盖参数或关闭
+    motion_gate_enabled = getattr(conf, 'motion_gate_enabled', False)
 
     def __init__(self, source_id, alg_name):
         self.source_id = source_id
@@ -37,6 +173,11 @@ class Postprocessor:
             (0, 255, 255), (255, 0, 255), (255, 255, 0), (0, 165, 255), (128, 0, 128), (128, 0, 0), (0, 128, 0)
         }
         self.label2color = {}
+        # 模型名称 -> {类别: label}
+        self.label_lut = {}
+        # 多边形顶点 -> PolygonRaster
+        self.polygon_rasters = {}
+        self.max_polygon_rasters = 64
         # 参数
         self.time = None
         self.alert_label = None
@@ -46,19 +187,31 @@ class Postprocessor:
         self.reserved_args = None
         self.alg_type = None
         self.reserved_data = None
+        # 二次推理
+        self.reinfer_coordinator = None
+        # 模型名称 -> CropBuffer，模型未配置输入尺寸时为None
+        self.crop_buffers = {}
+        # 二次分类结果缓存参数，None表示不启用，{}表示使用ClassifyCache默认参数
+        self.classify_cache_args = None
+        self.classify_cache = None
+        # 运动门控参数，None表示不启用，{}表示使用MotionGate默认参数
+        self.motion_gate_args = None
+        self.motion_gate = None
+        # 启用运动门控时最近一次处理成功的结果，门控跳过的帧返回该结果，持续告警不因门控中断
+        self.gate_result = None
         # 结果
         self.draw_image = None
-        self.result = {
-            'hit': False,
-            'data': {
-                'bbox': {
-                    'rectangles': [],
-                    'polygons': {},
-                    'lines': {}
-                },
-                'custom': {}
-            }
-        }
+        self.frame = None
+        self.frame_cache_subscribed = False
+        # 当前帧获取派生图像（解码、灰度、模糊等）的耗时
+        self.decode_time = 0
+        # 计划时间，(是否在计划内, 生效时间戳, 下一次状态切换时间戳)
+        self.plan = None
+        self.weekly_plan = None
+        self.plan_state = None
+        # 配置不变时复用的多边形和线段，(配置, 生成结果)
+        self.polygon_sections = None
+        self.line_sections = None
 
     @staticmethod
     def _is_in_plan(timestamp, plan=None):
@@ -71,19 +224,26 @@ class Postprocessor:
         """
         if plan is None:
             return True
-        weekday = get_weekday(timestamp)
-        if weekday is None:
-            return False
-        day_second = get_day_second(timestamp)
-        if day_second is None:
-            return False
-        weekday_plan = plan.get(weekday)
-        if weekday_plan is None:
-            return False
-        for time_slice in weekday_plan:
-            if time_slice[0] <= day_second < time_slice[1]:
-                return True
-        return False
+        return WeeklyPlan(plan).state(timestamp)[0]
+
+    def _check_plan(self, timestamp, plan=None):
+        """
+        是否在计划时间内，计划编译一次，查询结果缓存到下一次状态切换，期间的帧无需任何计算，无需重写
+        Args:
+            timestamp: 时间戳
+            plan: 计划时间
+        Returns: True or False
+        """
+        if plan is None:
+            return True
+        if plan is not self.plan and plan != self.plan:
+            self.weekly_plan = WeeklyPlan(plan)
+            self.plan_state = None
+        self.plan = plan
+        if self.plan_state is None or not self.plan_state[1] <= timestamp < self.plan_state[2]:
+            in_plan, next_transition = self.weekly_plan.state(timestamp)
+            self.plan_state = (in_plan, timestamp, next_transition)
+        return self.plan_state[0]
 
     @staticmethod
     def _get_label(label_conf, label: int):
@@ -99,6 +259,107 @@ class Postprocessor:
             return None
         return label_conf.get('label_map', {}).get(label, label)
 
+    def _get_cached_image(self, variant='bgr', *params, data=None, name='draw'):
+        """
+        获取当前帧的派生图像，同一视频源的所有算法共享，同一帧只计算一次，无需重写
+        Args:
+            variant: 派生类型，bgr：解码图像，gray：灰度图，blur：高斯模糊灰度图，resize：缩放图，integral：灰度积分图，
+                见FrameCache.get
+            *params: 派生参数
+            data: 图像数据，默认为绘制图像
+            name: 图像名称，默认为绘制图像draw，推理图像使用模型名称
+        Returns: 只读opencv ndarray or None
+        """
+        if data is None:
+            data = self.draw_image
+        if data is None:
+            return None
+        if not self.frame_cache_subscribed:
+            self.frame_cache.subscribe(self.source_id, self.alg_name)
+            self.frame_cache_subscribed = True
+        start = time.perf_counter()
+        image = self.frame_cache.get(self.source_id, self.time, name, data, variant, *params)
+        self.decode_time += time.perf_counter() - start
+        return image
+
+    def _get_image(self):
+        """
+        获取当前绘制图像的opencv ndarray，同一帧只解码一次，无需重写
+        Returns: 只读opencv ndarray or None
+        """
+        return self._get_cached_image('bgr')
+
+    def _get_motion_gate_polygons(self):
+        """
+        运动门控判断的ROI，默认为配置的多边形，ROI不在bbox中配置时重写
+        Returns: 多边形顶点列表，为空时按整帧判断
+        """
+        return [polygon['polygon'] for polygon in self.bbox.get('polygons', [])]
+
+    def _check_motion_gate(self):
+        """
+        运动门控，在缩小的灰度图上判断ROI相对最近一次处理的帧是否变化，无需重写
+        Returns: True：需要处理，False：场景静止，跳过本帧
+        """
+        if self.motion_gate is None:
+            args = dict(self.motion_gate_args)
+            override = self.reserved_args.get('motion_gate')
+            if override is False:
+                self.motion_gate_args = None
+                return True
+            if isinstance(override, dict):
+                args.update(override)
+            self.motion_gate = MotionGate(**args)
+        gray = self._get_cached_image('gray')
+        if gray is None:
+            return True
+        scale = self.motion_gate.get_scale(gray.shape)
+        small = self._get_cached_image('resize', 'gray', scale) if scale < 1 else gray
+        return self.motion_gate.check(small, self.time, self._get_motion_gate_polygons(), scale)
+
+    def _gen_track_table(self, max_retain, history_size=None, on_create=None):
+        """
+        生成跟踪目标状态表，目标连续丢失超过max_retain帧后淘汰，淘汰时调用_on_track_expire，无需重写
+        Args:
+            max_retain: 目标允许连续丢失的最大帧数
+            history_size: 每个目标历史目标的最大数量，None表示不保存历史目标
+            on_create: 目标创建时的回调，on_create(track)，用于初始化目标状态
+        Returns: TrackTable
+        """
+        return TrackTable(max_retain, history_size, on_create=on_create, on_expire=self._on_track_expire)
+
+    def _on_track_expire(self, track):
+        """
+        跟踪目标淘汰时的回调，默认记录日志，可重写
+        Args:
+            track: Track
+        """
+        pre_target = list(track.history) if track.history is not None else track.pre_target
+        LOGGER.info('Target lost, source_id={}, alg_name={}, track_id={}, pre_target={}'.format(
+            self.source_id, self.alg_name, track.track_id, pre_target))
+
+    def _search_index(self, features, similarity):
+        """
+        在底库self.index中批量检索特征，底库支持search_batch时一帧内的特征一次矩阵乘法完成，否则逐个检索，无需重写
+        Args:
+            features: 特征向量列表
+            similarity: 相似度阈值
+        Returns: [(info, score)]，与features一一对应，未命中时为(None, None)
+        """
+        index = getattr(self, 'index', None)
+        if index is None or not features:
+            return [(None, None)] * len(features)
+        if hasattr(index, 'search_batch'):
+            matches = [result[0] if result else (None, None)
+                       for result in index.search_batch(np.array(features, dtype=np.float32), similarity)]
+        else:
+            matches = [index.search(np.array(feature, dtype=np.float32), similarity) for feature in features]
+        results = []
+        for id_, score in matches:
+            info = index.query(id_) if id_ is not None else None
+            results.append((info, score) if info else (None, None))
+        return results
+
     def _gen_random_color(self, seed=1):
         """
         生成随机颜色，无需重写
@@ -162,6 +423,45 @@ class Postprocessor:
         elif 'right' == strategy:
             return rectangle[2], (rectangle[1] + rectangle[3]) / 2
 
+    @staticmethod
+    def _get_points(xyxy, strategy):
+        """
+        批量获取矩形框的点，无需重写
+        Args:
+            xyxy: 矩形框，(N, 4) ndarray
+            strategy: 取点策略，同_get_point
+        Returns: 点坐标，(N, 2) ndarray
+        """
+        if strategy not in ['center', 'bottom', 'top', 'left', 'right']:
+            strategy = 'center'
+        x = (xyxy[:, 0] + xyxy[:, 2]) / 2
+        y = (xyxy[:, 1] + xyxy[:, 3]) / 2
+        if 'bottom' == strategy:
+            y = xyxy[:, 3]
+        elif 'top' == strategy:
+            y = xyxy[:, 1]
+        elif 'left' == strategy:
+            x = xyxy[:, 0]
+        elif 'right' == strategy:
+            x = xyxy[:, 2]
+        return np.stack([x, y], axis=1)
+
+    def _get_polygon_raster(self, polygon):
+        """
+        获取多边形栅格，按顶点缓存，同一多边形只栅格化一次，无需重写
+        Args:
+            polygon: 多边形顶点
+        Returns: PolygonRaster
+        """
+        key = tuple(tuple(point) for point in polygon)
+        raster = self.polygon_rasters.get(key)
+        if raster is None:
+            if len(self.polygon_rasters) >= self.max_polygon_rasters:
+                self.polygon_rasters.clear()
+            raster = PolygonRaster(polygon)
+            self.polygon_rasters[key] = raster
+        return raster
+
     def _is_rectangle_in_polygon(self, rectangle, polygon, strategy):
         """
         判断矩形框是否在多边形内，无需重写
@@ -172,9 +472,25 @@ class Postprocessor:
         Returns: True or False
         """
         point = self._get_point(rectangle, strategy)
-        return is_point_in_polygon(point, polygon)
+        return self._get_polygon_raster(polygon).contains(point)
+
+    def _cross_line_matrix(self, rectangles1, rectangles2, lines, strategy='center'):
+        """
+        批量判断目标的移动轨迹与线段是否相交，无需重写
+        Args:
+            rectangles1: 上一次矩形框列表
+            rectangles2: 当前矩形框列表，与rectangles1一一对应
+            lines: 线段列表
+            strategy: 取点策略，center: 中心点，bottom: 下边沿中心点，top: 上边沿中心点，left: 左边沿中心点，right: 右边沿中心点
+        Returns: bool ndarray，(len(rectangles1), len(lines))
+        """
+        if not rectangles1 or not lines:
+            return np.zeros((len(rectangles1), len(lines)), dtype=bool)
+        points1 = self._get_points(np.asarray(rectangles1, dtype=np.float64).reshape(-1, 4), strategy)
+        points2 = self._get_points(np.asarray(rectangles2, dtype=np.float64).reshape(-1, 4), strategy)
+        return is_seg_intersect_matrix(np.stack([points1, points2], axis=1), lines)
 
-    def _cross_line_counting(self, rectangle1, rectangle2, line, direction, strategy='center'):
+    def _cross_line_counting(self, rectangle1, rectangle2, line, direction, strategy='center', intersect=None):
         """
         跨线计数，无需重写
         Args:
@@ -183,6 +499,7 @@ class Postprocessor:
             line: 线段
             direction: 方向，l-r+: 左减右增，l+r-: 左增右减，u+d-: 上增下减，u-d+: 上减下增，r+: 右增，l+: 左增，u+: 上增，d+: 下增
             strategy: 取点策略，center: 中心点，bottom: 下边沿中心点，top: 上边沿中心点，left: 左边沿中心点，right: 右边沿中心点
+            intersect: 移动轨迹与线段是否相交，None时现场计算，可由_cross_line_matrix批量计算后传入
         Returns: 计数结果
         """
         if direction not in ['l-r+', 'l+r-', 'u+d-', 'u-d+', 'r+', 'l+', 'u+', 'd+']:
@@ -190,7 +507,9 @@ class Postprocessor:
             return None
         point1 = self._get_point(rectangle1, strategy)
         point2 = self._get_point(rectangle2, strategy)
-        if is_seg_intersect((point1, point2), line):
+        if intersect is None:
+            intersect = is_seg_intersect((point1, point2), line)
+        if intersect:
             if 'l-r+' == direction:
                 if point2[0] > point1[0]:
                     return {'increase': 1}
@@ -245,6 +564,16 @@ class Postprocessor:
                 result1['delta'] -= result2['decrease']
         return True
 
+    def _update_cross_line_counting_result(self, line_id, result_):
+        """
+        合并跨线计数结果，无需重写
+        Args:
+            line_id: 线段id
+            result_: 当前计数结果
+        Returns: True or False
+        """
+        return self.counting_store.update(line_id, self._merge_cross_line_counting_result, result_)
+
     @staticmethod
     def _set_ext(obj: dict, *args, **kwargs):
         """
@@ -278,6 +607,24 @@ class Postprocessor:
             return obj.get('ext', {}).get(key)
         return obj.get('ext', {}).pop(key, None)
 
+    @staticmethod
+    def _gen_result():
+        """
+        生成空的结果，每帧直接构造，无需深拷贝模板，无需重写
+        Returns: 结果
+        """
+        return {
+            'hit': False,
+            'data': {
+                'bbox': {
+                    'rectangles': [],
+                    'polygons': {},
+                    'lines': {}
+                },
+                'custom': {}
+            }
+        }
+
     def _gen_rectangle(self, xyxy, color, label, conf_, **kwargs):
         """
         生成矩形框，无需重写
@@ -289,14 +636,19 @@ class Postprocessor:
             **kwargs: 扩展参数
         Returns: 矩形框
         """
-        rectangle = {
+        # kwargs本身是新建的dict，直接作为扩展字段，一次构造完成
+        return {
             'xyxy': xyxy,
             'color': color,
             'label': label,
-            'conf': conf_
+            'conf': conf_,
+            'ext': kwargs
         }
-        self._set_ext(rectangle, **kwargs)
-        return rectangle
+
+    @staticmethod
+    def __copy_sections(sections):
+        # 逐个复制多边形/线段及其扩展字段，坐标等只读数据共享
+        return {id_: dict(section, ext=dict(section['ext'])) for id_, section in sections.items()}
 
     def _gen_polygons(self, data=None):
         """
@@ -304,17 +656,20 @@ class Postprocessor:
         Returns: 多边形
         """
         polygons = self.bbox.get('polygons', []) if data is None else data.get('polygons', [])
+        # 配置不变时复用已生成的多边形，每帧只复制
+        if data is None and self.polygon_sections is not None and self.polygon_sections[0] is polygons:
+            return self.__copy_sections(self.polygon_sections[1])
         polygons_ = {}
         for polygon in polygons:
             polygons_[polygon['id']] = {
                 'name': polygon['name'],
                 'polygon': polygon['polygon'],
-                'color': self.marker_color
+                'color': self.marker_color,
+                'ext': {'result': None} if 'counting' == self.alg_type else {}
             }
-            self._set_ext(polygons_[polygon['id']])
-        if 'counting' == self.alg_type:
-            for polygon in polygons:
-                self._set_ext(polygons_[polygon['id']], result=None)
+        if data is None:
+            self.polygon_sections = (polygons, polygons_)
+            return self.__copy_sections(polygons_)
         return polygons_
 
     def _gen_lines(self, data=None):
@@ -323,27 +678,35 @@ class Postprocessor:
         Returns: 线段
         """
         lines = self.bbox.get('lines', []) if data is None else data.get('lines', [])
-        lines_ = {}
-        for line in lines:
-            lines_[line['id']] = {
-                'name': line['name'],
-                'line': line['line'],
-                'color': self.marker_color
-            }
-            self._set_ext(lines_[line['id']])
+        # 配置不变时复用已生成的线段，每帧只复制
+        if data is None and self.line_sections is not None and self.line_sections[0] is lines:
+            lines_ = self.__copy_sections(self.line_sections[1])
+        else:
+            lines_ = {}
+            for line in lines:
+                lines_[line['id']] = {
+                    'name': line['name'],
+                    'line': line['line'],
+                    'color': self.marker_color,
+                    'ext': {}
+                }
+                if 'cross_line_counting' == self.alg_type:
+                    lines_[line['id']]['ext'].update(direction=line['direction'], action=line['action'])
+            if data is None:
+                if 'cross_line_counting' == self.alg_type:
+                    # 线段配置变化，重新从数据库读取计数结果
+                    self.counting_store.invalidate(list(lines_.keys()))
+                self.line_sections = (lines, lines_)
+                lines_ = self.__copy_sections(lines_)
         if 'cross_line_counting' == self.alg_type:
-            with get_session() as db_session:
-                for line in lines:
-                    status, row = db.cross_line_counting.query(db_session, line['id'])
-                    if status and row:
-                        self._set_ext(
-                            lines_[line['id']],
-                            direction=line['direction'],
-                            action=line['action'],
-                            result=json_utils.loads(row['result'])
-                        )
-                    else:
-                        del lines_[line['id']]
+            # 计数结果缓存在counting_store中，定期从数据库刷新
+            results = self.counting_store.load(list(lines_.keys()), self)
+            for line_id in list(lines_.keys()):
+                result = results.get(line_id)
+                if result is not None:
+                    lines_[line_id]['ext']['result'] = result
+                else:
+                    del lines_[line_id]
         return lines_
 
     def _scale(self, xyxy):
@@ -393,6 +756,347 @@ class Postprocessor:
                 return False
         return True
 
+    @staticmethod
+    def _is_columnar(engine_result):
+        """
+        是否为列式结果，{'xyxy': (N, 4), 'conf': (N,), 'label': (N,)}，无需重写
+        Args:
+            engine_result: 引擎结果
+        Returns: True or False
+        """
+        return isinstance(engine_result, dict)
+
+    def _get_label_lut(self, model_name, label_conf):
+        """
+        获取类别到label的映射表，按模型缓存，无需重写
+        Args:
+            model_name: 模型名称
+            label_conf: label配置
+        Returns: {类别: label}
+        """
+        label_lut = self.label_lut.get(model_name)
+        if label_lut is None:
+            label_lut = {}
+            for class_ in label_conf['class2label'].keys():
+                try:
+                    class_ = int(class_)
+                except ValueError:
+                    continue
+                label = self._get_label(label_conf, class_)
+                if label:
+                    label_lut[class_] = label
+            self.label_lut[model_name] = label_lut
+        return label_lut
+
+    def _filter_columnar(self, model_name, model_conf, engine_result, roi=True, strategy='center'):
+        """
+        列式结果的向量化过滤，置信度、label、坐标缩放和多边形过滤均为整列运算，无需重写
+        Args:
+            model_name: 模型名称
+            model_conf: 模型配置
+            engine_result: 列式结果，{'xyxy': (N, 4), 'conf': (N,), 'label': (N,)}
+            roi: 是否过滤掉不在多边形内的目标
+            strategy: 取点策略，同_filter_by_roi
+        Returns: [(xyxy, label, conf_), ...]，xyxy为缩放后的坐标
+        """
+        xyxy = np.asarray(engine_result['xyxy'], dtype=np.float64).reshape(-1, 4)
+        conf = np.asarray(engine_result['conf'], dtype=np.float64).reshape(-1)
+        class_ = np.asarray(engine_result['label'], dtype=np.int64).reshape(-1)
+        label_lut = self._get_label_lut(model_name, model_conf['label'])
+        # 过滤掉置信度低于阈值的目标
+        mask = conf >= model_conf['args']['conf_thres']
+        # 过滤掉不在label列表中的目标
+        mask &= np.isin(class_, list(label_lut.keys()))
+        index = np.flatnonzero(mask)
+        # 坐标缩放
+        xyxy = (xyxy[index] * self.scale).astype(np.int64)
+        # 过滤掉不在多边形内的目标
+        polygons = self.bbox.get('polygons', []) if roi else []
+        if polygons and len(index):
+            points = self._get_points(xyxy, strategy)
+            mask = np.zeros(len(index), dtype=bool)
+            for polygon in polygons:
+                mask[~mask] = self._get_polygon_raster(polygon['polygon']).contains_points(points[~mask])
+            index = index[mask]
+            xyxy = xyxy[mask]
+        return list(zip(xyxy.tolist(), [label_lut[c] for c in class_[index].tolist()], conf[index].tolist()))
+
+    def _get_reinfer_coordinator(self):
+        """
+        获取二次推理协调器，首次调用时按抽帧间隔的2倍设置超时时间，无需重写
+        Returns: ReinferCoordinator
+        """
+        if self.reinfer_coordinator is None:
+            timeout = (self.frame_interval / 1000) * 2
+            self.reinfer_coordinator = ReinferCoordinator(self.source_id, self.alg_name, timeout)
+            LOGGER.info('source_id={}, alg_name={}, timeout={}'.format(self.source_id, self.alg_name, timeout))
+        return self.reinfer_coordinator
+
+    def _reinfer_submit(self, count, **kwargs):
+        """
+        登记当前帧的二次推理任务，draw_image随任务保存，帧句柄指向的共享内存会被引擎复用，保存解码后图像的副本，无需重写
+        Args:
+            count: 预期结果数
+            **kwargs: 随任务保存的数据
+        Returns: 预期结果数
+        """
+        if count > 0:
+            draw_image = self.draw_image
+            if is_frame_handle(draw_image):
+                image = self.frame.image
+                draw_image = image.copy() if image is not None else None
+            self._get_reinfer_coordinator().submit(self.time, count, draw_image=draw_image,
+                                                   submit_clock=time.perf_counter(), **kwargs)
+        return count
+
+    def _reinfer_complete(self, results):
+        """
+        合并当前帧的二次推理结果，无需重写
+        Args:
+            results: 本次返回的结果列表，批量二次推理通常为self._get_batch_result(targets)
+        Returns: 全部结果返回时返回任务，包含draw_image、result及登记时保存的数据，否则返回None
+        """
+        if self.reinfer_coordinator is None:
+            LOGGER.warning('Not found reinfer result, time={}'.format(self.time))
+            return None
+        index = self.reserved_data.get('batch_index')
+        if index is not None:
+            # 逐张发送时结果可能乱序返回，按发送顺序排列
+            results = [(index, result) for result in results]
+        late = self.reinfer_coordinator.late
+        job = self.reinfer_coordinator.complete(self.time, results)
+        if self.reinfer_coordinator.late > late:
+            self.metrics.inc(self.source_id, self.alg_name, 'reinfer_late')
+        if job is not None and index is not None:
+            job['result'] = [result for _, result in sorted(job['result'], key=lambda item: item[0])]
+        if job is not None:
+            wait = time.perf_counter() - job['submit_clock']
+            self.metrics.observe(self.source_id, self.alg_name, 'reinfer_wait', wait)
+        return job
+
+    @staticmethod
+    def _gen_crop_buffer(model_conf):
+        """
+        根据模型配置生成裁剪缓冲区，model_conf['args']['input_size']为int或[width, height]，
+        model_conf['args']['letterbox']为是否保持宽高比缩放，无需重写
+        Args:
+            model_conf: 模型配置
+        Returns: CropBuffer，未配置输入尺寸时返回None
+        """
+        args = model_conf.get('args', {})
+        input_size = args.get('input_size')
+        if not input_size:
+            return None
+        if isinstance(input_size, int):
+            input_size = (input_size, input_size)
+        return CropBuffer(input_size, args.get('letterbox', False))
+
+    def _crop_reinfer_images(self, model_name, image, xyxys):
+        """
+        裁剪二次推理图像，颜色通道反转；二次推理模型配置了输入尺寸时，裁剪、缩放和颜色转换一次完成，
+        写入预分配的缓冲区，否则等价于crop_rectangle + rgb_reverse，无需重写
+        Args:
+            model_name: 二次推理模型名称，模型配置在首次收到该模型的结果后可用
+            image: 整帧图像
+            xyxys: 裁剪区域列表
+        Returns: 裁剪图像列表，与xyxys一一对应，使用缓冲区时图像在下一次调用时被覆盖，需在本帧内发送
+        """
+        crop_buffer = self.crop_buffers.get(model_name)
+        if crop_buffer is None:
+            return [rgb_reverse(crop_rectangle(image, xyxy)) for xyxy in xyxys]
+        return crop_buffer.prepare(image, xyxys)
+
+    def _encode_reinfer_image(self, image):
+        """
+        按reinfer_image_format编码二次推理图像，无需重写
+        Args:
+            image: opencv ndarray
+        Returns: base64 string、原始数组dict or None，二进制消息格式下为jpg字节或ndarray
+        """
+        if image is None:
+            return None
+        if 'binary' == self.redis_message_format:
+            if 'raw' == self.reinfer_image_format:
+                return np.ascontiguousarray(image)
+            return opencv_to_bytes(image, self.reinfer_jpeg_quality)
+        if 'raw' == self.reinfer_image_format:
+            image = np.ascontiguousarray(image)
+            return {'data': bytes_to_base64(image.tobytes()), 'shape': list(image.shape), 'dtype': str(image.dtype)}
+        return opencv_to_base64(image, self.reinfer_jpeg_quality)
+
+    def _put_source(self, source_data):
+        """
+        发送二次推理消息，按redis_message_format序列化，无需重写
+        Args:
+            source_data: 消息，dict
+        """
+        if 'binary' == self.redis_message_format:
+            self.rq_source.put(message_utils.dumps(source_data))
+        else:
+            self.rq_source.put(json_utils.dumps(source_data))
+
+    def _reinfer_batch(self, model_name, images, batch, **kwargs):
+        """
+        批量二次推理，无需重写
+        reinfer_batch为True时同一帧的所有裁剪图像合并为一条消息发送，引擎按相同顺序一次性返回全部结果；
+        否则每张裁剪图像一条消息，引擎逐张返回，结果在__postprocess中转为只含一张图像的批量结果，算法无需区分
+        Args:
+            model_name: 二次推理模型名称
+            images: 裁剪图像列表，opencv ndarray，按reinfer_image_format编码发送
+            batch: 与images一一对应的附加数据，随结果原样带回，可通过self.reserved_data['batch']获取
+            **kwargs: 随任务保存的数据，见_reinfer_submit
+        Returns: 发送的图像数量
+        """
+        if not images:
+            return 0
+        start = time.perf_counter()
+        if self.reinfer_batch:
+            source_data = {
+                'source_id': self.source_id,
+                'time': self.time * 1000000,
+                'infer_image': [self._encode_reinfer_image(image) for image in images],
+                'draw_image': None,
+                'reserved_data': {
+                    'specified_model': [model_name],
+                    'batch': batch,
+                    'unsort': True
+                }
+            }
+            self._put_source(source_data)
+        else:
+            for i, (image, data) in enumerate(zip(images, batch)):
+                source_data = {
+                    'source_id': self.source_id,
+                    'time': self.time * 1000000,
+                    'infer_image': self._encode_reinfer_image(image),
+                    'draw_image': None,
+                    'reserved_data': {
+                        'specified_model': [model_name],
+                        'batch': [data],
+                        'batch_index': i,
+                        'unsort': True
+                    }
+                }
+                self._put_source(source_data)
+        self.metrics.observe(self.source_id, self.alg_name, 'reinfer_encode', time.perf_counter() - start)
+        return self._reinfer_submit(len(images), **kwargs)
+
+    def _gen_clip_buffer(self, size, stride=1):
+        """
+        生成时序片段缓冲区，帧加入时按reinfer_image_format编码一次，无需重写
+        Args:
+            size: 片段帧数
+            stride: 提交间隔帧数
+        Returns: ClipBuffer
+        """
+        return ClipBuffer(size, stride, self._encode_reinfer_image, '{}/{}'.format(self.source_id, self.alg_name))
+
+    def _reinfer_clip(self, model_name, clip_buffer, **kwargs):
+        """
+        发送时序片段二次推理并登记任务，片段内的帧已在加入时编码，按reinfer_clip_format发送完整片段或增量，无需重写
+        Args:
+            model_name: 二次推理模型名称
+            clip_buffer: ClipBuffer
+            **kwargs: 随任务保存的数据，见_reinfer_submit
+        Returns: 预期结果数
+        """
+        start = time.perf_counter()
+        reserved_data = {
+            'specified_model': [model_name],
+            'unsort': True
+        }
+        if 'delta' == self.reinfer_clip_format:
+            seq, infer_image = clip_buffer.delta()
+            reserved_data['clip'] = {'id': clip_buffer.clip_id, 'seq': seq, 'size': clip_buffer.size}
+        else:
+            infer_image = clip_buffer.clip()
+        source_data = {
+            'source_id': self.source_id,
+            'time': self.time * 1000000,
+            'infer_image': infer_image,
+            'draw_image': None,
+            'reserved_data': reserved_data
+        }
+        self._put_source(source_data)
+        self.metrics.observe(self.source_id, self.alg_name, 'reinfer_encode', time.perf_counter() - start)
+        return self._reinfer_submit(1, **kwargs)
+
+    def __get_classify_cache(self):
+        if self.classify_cache is None and self.classify_cache_args is not None:
+            args = dict(self.classify_cache_args)
+            override = self.reserved_args.get('classify_cache')
+            if override is False:
+                self.classify_cache_args = None
+                return None
+            if isinstance(override, dict):
+                args.update(override)
+            self.classify_cache = ClassifyCache(**args)
+        return self.classify_cache
+
+    def _reinfer_classify(self, model_name, image, rectangles, **kwargs):
+        """
+        批量二次分类，启用分类缓存（self.classify_cache_args）时，目标框未移动、外观未变化且未过期的目标复用缓存的结果，
+        只发送其余目标，无需重写
+        Args:
+            model_name: 二次分类模型名称
+            image: 用于裁剪的opencv ndarray
+            rectangles: 目标矩形框列表，随结果带回
+            **kwargs: 随任务保存的数据，见_reinfer_submit
+        Returns: (发送的图像数量, 全部命中缓存时与二次推理任务格式相同的结果，否则为None)，
+            二次推理结果需通过_complete_classify获取
+        """
+        xyxys = [rectangle['xyxy'] for rectangle in rectangles]
+        cache = self.__get_classify_cache()
+        if cache is None or not rectangles:
+            return self._reinfer_batch(model_name, self._crop_reinfer_images(model_name, image, xyxys), rectangles,
+                                       **kwargs), None
+        gray = self._get_cached_image('gray')
+        hashes = [dhash(gray, xyxy) for xyxy in xyxys]
+        cached = cache.lookup(xyxys, hashes, self.time)
+        indices = [i for i, result in enumerate(cached) if result is None]
+        if not indices:
+            return 0, dict(kwargs, draw_image=self.draw_image, result=list(zip(cached, rectangles)))
+        cropped_images = self._crop_reinfer_images(model_name, image, [xyxys[i] for i in indices])
+        count = self._reinfer_batch(model_name, cropped_images, [rectangles[i] for i in indices],
+                                    classify_cached=list(zip(cached, rectangles)), classify_indices=indices,
+                                    classify_hashes=[hashes[i] for i in indices], **kwargs)
+        return count, None
+
+    def _complete_classify(self, targets):
+        """
+        合并当前帧的二次分类结果，与缓存命中的结果按原顺序合并，并写入分类缓存，无需重写
+        Args:
+            targets: 过滤后的结果，每个元素对应一张裁剪图像
+        Returns: 全部结果返回时返回任务，result为[(targets_, rectangle), ...]，否则返回None
+        """
+        job = self._reinfer_complete(self._get_batch_result(targets))
+        if job is None or 'classify_cached' not in job:
+            return job
+        result = job.pop('classify_cached')
+        indices = job.pop('classify_indices')
+        hashes = job.pop('classify_hashes')
+        indices = indices[:len(job['result'])]
+        for i, pair in zip(indices, job['result']):
+            result[i] = pair
+        self.classify_cache.update([result[i][1]['xyxy'] for i in indices], hashes,
+                                   [result[i][0] for i in indices], self.time)
+        job['result'] = result
+        return job
+
+    def _get_batch_result(self, targets):
+        """
+        将批量二次推理的结果与附加数据一一配对，无需重写
+        Args:
+            targets: 过滤后的结果，每个元素对应一张裁剪图像
+        Returns: [(targets_, data), ...]
+        """
+        batch = self.reserved_data.get('batch', [])
+        if len(targets) != len(batch):
+            LOGGER.error('Batch result size mismatch, source_id={}, alg_name={}, expect {}, but get {}'.format(
+                self.source_id, self.alg_name, len(batch), len(targets)))
+            return []
+        return list(zip(targets, batch))
+
     def _process(self, result, filter_result):
         """
         处理过滤之后的结果，并生成最终结果，按需重写
@@ -426,6 +1130,10 @@ class Postprocessor:
         targets = []
         model_conf = model_data['model_conf']
         engine_result = model_data['engine_result']
+        if self._is_columnar(engine_result):
+            for xyxy, label, conf_ in self._filter_columnar(model_name, model_conf, engine_result):
+                targets.append(self._gen_rectangle(xyxy, self._get_color(model_conf['label'], label), label, conf_))
+            return targets
         for engine_result_ in engine_result:
             # 过滤掉置信度低于阈值的目标
             if not self._filter_by_conf(model_conf, engine_result_['conf']):
@@ -444,38 +1152,104 @@ class Postprocessor:
                 xyxy, self._get_color(model_conf['label'], label), label, engine_result_['conf']))
         return targets
 
+    def __postprocess(self, args, result):
+        if self.alert_label is None:
+            self.alert_label = args['alert_label']
+        if self.bbox is None:
+            self.bbox = args['bbox']
+        if self.scale is None:
+            self.scale = args['scale']
+        if self.frame_interval is None:
+            self.frame_interval = args['frame_interval']
+        if self.reserved_args is None:
+            self.reserved_args = args['reserved_args']
+        if self.alg_type is None:
+            self.alg_type = args['alg_type']
+        self.reserved_data = args.get('reserved_data', {})
+        if 'batch_index' in self.reserved_data:
+            # 逐张发送的二次推理结果，转为只含一张图像的批量结果
+            args = dict(args, model={model_name: dict(model_data, engine_result=[model_data['engine_result']])
+                                     for model_name, model_data in args['model'].items()})
+        if self.reinfer_coordinator is not None:
+            expired = self.reinfer_coordinator.expire(self.time)
+            if expired:
+                self.metrics.inc(self.source_id, self.alg_name, 'reinfer_expired', expired)
+        # 二次推理结果不做门控
+        if self.motion_gate_enabled and self.motion_gate_args is not None and not self.reserved_data:
+            start = time.perf_counter()
+            passed = self._check_motion_gate()
+            self.metrics.observe(self.source_id, self.alg_name, 'motion_gate', time.perf_counter() - start)
+            if not passed:
+                self.metrics.inc(self.source_id, self.alg_name, 'gated_frames')
+                if self.gate_result is None:
+                    return False
+                result.update(copy.deepcopy(self.gate_result))
+                return True
+        filter_result = {}
+        for model_name, model_data in args['model'].items():
+            if model_name not in self.crop_buffers:
+                self.crop_buffers[model_name] = self._gen_crop_buffer(model_data['model_conf'])
+            start = time.perf_counter()
+            filter_result[model_name] = self._filter(model_name, model_data)
+            self.metrics.observe(self.source_id, self.alg_name, 'filter:' + model_name, time.perf_counter() - start)
+        start = time.perf_counter()
+        status = self._process(result, filter_result)
+        self.metrics.observe(self.source_id, self.alg_name, 'process', time.perf_counter() - start)
+        if status and self.motion_gate_args is not None:
+            self.gate_result = copy.deepcopy(result)
+        return status
+
+    def __observe_frame(self, result, start):
+        self.metrics.observe(self.source_id, self.alg_name, 'total', time.perf_counter() - start)
+        self.metrics.inc(self.source_id, self.alg_name, 'frames')
+        if self.decode_time:
+            self.metrics.observe(self.source_id, self.alg_name, 'decode', self.decode_time)
+        bbox = result.get('data', {}).get('bbox', {})
+        size = sum(len(bbox.get(key, ())) for key in ('rectangles', 'polygons', 'lines'))
+        self.metrics.observe(self.source_id, self.alg_name, 'result_targets', size, SIZE_BUCKETS)
+        return True
+
+    def __record(self, args, draw_image):
+        try:
+            # 帧句柄指向的共享内存会被引擎复用，录制解码后的图像
+            image = self.frame.image if is_frame_handle(draw_image) else draw_image
+            return self.recorder.record(self.source_id, self.alg_name, args, image)
+        except:
+            LOGGER.exception('__record')
+        return False
+
     def postprocess(self, args, draw_image):
         """
         后处理，无需重写
         Args:
             args: 后处理参数
-            draw_image: 用于绘制的图像数据，base64编码
+            draw_image: 用于绘制的图像数据，base64编码、jpg字节（如二进制消息解码得到的memoryview）、
+                帧句柄（共享内存或内存映射文件描述符）或opencv ndarray，原样返回，由调用方在最终输出时编码
         Returns: True or False, 合并后的最终结果
         """
         status = False
-        result = copy.deepcopy(self.result)
+        result = self._gen_result()
         self.draw_image = draw_image
+        self.frame = Frame(draw_image)
+        self.decode_time = 0
+        if self.recorder is not None:
+            self.__record(args, draw_image)
+        start = time.perf_counter()
         try:
             self.time = args['time']
-            if self.alert_label is None:
-                self.alert_label = args['alert_label']
-            if self.bbox is None:
-                self.bbox = args['bbox']
-            if self.scale is None:
-                self.scale = args['scale']
-            if self.frame_interval is None:
-                self.frame_interval = args['frame_interval']
-            if self.reserved_args is None:
-                self.reserved_args = args['reserved_args']
-            if self.alg_type is None:
-                self.alg_type = args['alg_type']
-            self.reserved_data = args.get('reserved_data', {})
-            if self._is_in_plan(self.time, args['plan']):
-                filter_result = {}
-                for model_name, model_data in args['model'].items():
-                    filter_result[model_name] = self._filter(model_name, model_data)
-                status = self._process(result, filter_result)
+            # 计划外的帧在任何解码和过滤之前直接跳过
+            in_plan = self._check_plan(self.time, args['plan'])
+            self.metrics.observe(self.source_id, self.alg_name, 'plan', time.perf_counter() - start)
+            if in_plan:
+                status = self.__postprocess(args, result)
+            else:
+                self.metrics.inc(self.source_id, self.alg_name, 'skipped_frames')
         except:
             LOGGER.exception('postprocess')
             LOGGER.error('Postprocess failed, source_id={}, alg_name={}'.format(self.source_id, self.alg_name))
+            self.metrics.inc(self.source_id, self.alg_name, 'errors')
+        if self.frame_cache_subscribed:
+            self.frame_cache.release(self.source_id, self.time, self.alg_name)
+        if self.metrics.enabled:
+            self.__observe_frame(result, start)
         return status, result, self.draw_image
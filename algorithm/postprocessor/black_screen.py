@@ -1,9 +1,8 @@
-import cv2
 import numpy as np
 
 from postprocessor import Postprocessor as BasePostprocessor
 from .utils import json_utils
-from .utils.image_utils import base64_to_opencv
+from .utils.cv_utils.roi_utils import RoiMask
 
 
 class Postprocessor(BasePostprocessor):
@@ -12,25 +11,31 @@ class Postprocessor(BasePostprocessor):
         self.threshold = None
         self.mask = {}
 
+    def __get_mask(self, polygon, shape):
+        polygon_key = json_utils.dumps(polygon)
+        mask = self.mask.get(polygon_key)
+        if mask is None or (mask.height, mask.width) != shape[:2]:
+            np_points = np.array(polygon, dtype=np.int32)
+            np_points = (np_points // self.scale).astype(np.int32)
+            mask = RoiMask(np_points, shape)
+            self.mask[polygon_key] = mask
+        return mask
+
     def _process(self, result, filter_result):
         hit = False
         if self.threshold is None:
             self.threshold = self.reserved_args['threshold']
         polygons = self._gen_polygons()
-        model_name, infer_image = next(iter(filter_result.items()))
-        infer_image = base64_to_opencv(infer_image)
-        infer_image = cv2.cvtColor(infer_image, cv2.COLOR_BGR2GRAY)
-        for polygon in polygons.values():
-            polygon_key = json_utils.dumps(polygon['polygon'])
-            mask = self.mask.get(polygon_key)
-            if mask is None:
-                mask = np.zeros(infer_image.shape[:2], dtype=np.uint8)
-                np_points = np.array(polygon['polygon'], dtype=np.int32)
-                np_points = (np_points // self.scale).astype(np.int32)
-                cv2.fillPoly(mask, [np_points], 255)
-                self.mask[polygon_key] = mask
-            polygon_pixels = infer_image[np.where(255 == mask)]
-            if int(np.mean(polygon_pixels, axis=0)) <= self.threshold:
+        model_name, data = next(iter(filter_result.items()))
+        infer_image = self._get_cached_image('gray', data=data, name=model_name)
+        masks = [self.__get_mask(polygon['polygon'], infer_image.shape) for polygon in polygons.values()]
+        # 多个矩形ROI共享同一张积分图，每个ROI的均值只需查表4次
+        integral = None
+        if sum(mask.rectangle is not None for mask in masks) > 1:
+            integral = self._get_cached_image('integral', data=data, name=model_name)
+        for polygon, mask in zip(polygons.values(), masks):
+            mean = mask.mean(infer_image, integral)
+            if mean is not None and int(mean) <= self.threshold:
                 hit = True
                 polygon['color'] = self.alert_color
         result['hit'] = hit
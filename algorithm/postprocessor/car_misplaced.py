@@ -14,19 +14,12 @@ class Postprocessor(BasePostprocessor):
         self.threshold = None
         self.tracker = None
         self.max_retain = 0
-        self.targets = {}
+        self.targets = None
         self.check_interval = 1
 
-    def __check_lost_target(self, tracker_result):
-        for track_id in list(self.targets.keys()):
-            if track_id not in tracker_result:
-                self.targets[track_id]['lost'] += 1
-            else:
-                self.targets[track_id]['lost'] = 0
-            if self.targets[track_id]['lost'] > self.max_retain:
-                LOGGER.info('Target lost, source_id={}, alg_name={}, track_id={}, pre_target={}'.format(
-                    self.source_id, self.alg_name, track_id, self.targets[track_id]['pre_target']))
-                del self.targets[track_id]
+    def __init_target(self, track):
+        track.window = RatioWindow(self.length, self.threshold)
+        track.time = self.time
         return True
 
     def _process(self, result, filter_result):
@@ -48,38 +41,32 @@ class Postprocessor(BasePostprocessor):
         if self.tracker is None:
             self.tracker = Tracker(self.frame_interval)
             self.max_retain = self.tracker.track_buffer + 1
+            self.targets = self._gen_track_table(self.max_retain, on_create=self.__init_target)
             LOGGER.info('Init tracker, source_id={}, alg_name={}, track_buffer={}'.format(
                 self.source_id, self.alg_name, self.tracker.track_buffer))
         model_name, rectangles = next(iter(filter_result.items()))
         # 目标跟踪
         tracker_result = self.tracker.track(rectangles)
         # 检查丢失目标
-        self.__check_lost_target(tracker_result)
+        self.targets.step(tracker_result.keys())
         for track_id, rectangle in tracker_result.items():
             target = self.targets.get(track_id)
             if target is None:
-                target = {
-                    'window': RatioWindow(self.length, self.threshold),
-                    'lost': 0,
-                    'hit': False,
-                    'pre_target': None,
-                    'time': self.time
-                }
-                self.targets[track_id] = target
+                target = self.targets.create(track_id)
             for polygon in polygons.values():
                 self._set_ext(polygon, in_polygon=False)
                 if self._is_rectangle_in_polygon(rectangle['xyxy'], polygon['polygon'], self.strategy):
                     self._set_ext(polygon, in_polygon=True)
-                    if target['pre_target'] is not None and self.time - target['time'] > self.check_interval:
-                        if calc_iou(target['pre_target']['xyxy'], rectangle['xyxy']) > self.iou:
-                            target['hit'] = True
+                    if target.pre_target is not None and self.time - target.time > self.check_interval:
+                        if calc_iou(target.pre_target['xyxy'], rectangle['xyxy']) > self.iou:
+                            target.hit = True
                         else:
-                            target['hit'] = False
+                            target.hit = False
                         break
-            if target['pre_target'] is None or self.time - target['time'] > self.check_interval:
-                target['time'] = self.time
-                target['pre_target'] = rectangle
-            if target['window'].insert({'time': self.time, 'data': {'hit': target['hit']}}):
+            if target.pre_target is None or self.time - target.time > self.check_interval:
+                target.time = self.time
+                target.pre_target = rectangle
+            if target.window.insert({'time': self.time, 'data': {'hit': target.hit}}):
                 hit = True
                 rectangle['color'] = self.alert_color
                 for polygon in polygons.values():
@@ -6,10 +6,8 @@ import gv
 from logger import LOGGER
 from postprocessor import Postprocessor as BasePostprocessor
 from window.ratio_window import RatioWindow
-from .utils import json_utils
 from .utils.cv_utils.color_utils import rgb_reverse
-from .utils.cv_utils.crop_utils import crop_poly
-from .utils.image_utils import base64_to_opencv, opencv_to_base64
+from .utils.cv_utils.crop_utils import crop_polys
 
 
 class Postprocessor(BasePostprocessor):
@@ -19,14 +17,16 @@ class Postprocessor(BasePostprocessor):
         self.index = None
         self.group_type = None
         self.similarity = None
-        self.timeout = None
-        self.reinfer_result = {}
         # 目标最小像素值
         self.min_len = 10
         self.pre_gray = None
         self.threshold = None
         self.length = None
         self.windows = {}
+        # ROI掩码缓存，{多边形顶点: RoiMask}
+        self.crop_masks = {}
+        # ROI内画面静止时跳过二次推理
+        self.motion_gate_args = {}
 
     @staticmethod
     def __is_rectangle_polygon_intersect(xyxy, polygon):
@@ -41,40 +41,16 @@ class Postprocessor(BasePostprocessor):
         rect = box(xyxy[0], xyxy[1], xyxy[2], xyxy[3])
         return polygon.intersects(rect)
 
-    def __reinfer(self, rois):
-        draw_image = base64_to_opencv(self.draw_image)
-        gray_image = cv2.cvtColor(draw_image, cv2.COLOR_BGR2GRAY)
-        count = 0
-        for roi in rois:
-            cropped_image = crop_poly(draw_image, roi['coord'])
-            cropped_image = rgb_reverse(cropped_image)
-            source_data = {
-                'source_id': self.source_id,
-                'time': self.time * 1000000,
-                'infer_image': opencv_to_base64(cropped_image),
-                'draw_image': None,
-                'reserved_data': {
-                    'specified_model': [self.model_name],
-                    'roi': roi,
-                    'unsort': True
-                }
-            }
-            self.rq_source.put(json_utils.dumps(source_data))
-            count += 1
-        self.reinfer_result[self.time] = {
-            'count': count,
-            'draw_image': self.draw_image,
-            'gray_image': gray_image,
-            'result': []
-        }
-        return True
+    def _get_motion_gate_polygons(self):
+        return [roi['coord'] for roi in self.reserved_args.get('roi') or []]
 
-    def __check_expire(self):
-        for time in list(self.reinfer_result.keys()):
-            if time < self.time - self.timeout:
-                LOGGER.warning('Reinfer result expired, source_id={}, alg_name={}, time={}, timeout={}'.format(
-                    self.source_id, self.alg_name, time, self.timeout))
-                del self.reinfer_result[time]
+    def __reinfer(self, rois):
+        draw_image = self._get_image()
+        gray_image = self._get_cached_image('gray')
+        # ROI固定不变，掩码只生成一次，每帧只在各ROI的外接矩形内裁剪
+        cropped_images = [rgb_reverse(cropped_image) for cropped_image in
+                          crop_polys(draw_image, [roi['coord'] for roi in rois], cache=self.crop_masks)]
+        self._reinfer_batch(self.model_name, cropped_images, rois, gray_image=gray_image)
         return True
 
     def __process_blacklist(self, feature):
@@ -139,9 +115,6 @@ class Postprocessor(BasePostprocessor):
                 self.threshold = 1
             LOGGER.info('source_id={}, alg_name={}, length={}, threshold={}'.format(
                 self.source_id, self.alg_name, self.length, self.threshold))
-        if self.timeout is None:
-            self.timeout = (self.frame_interval / 1000) * 2
-            LOGGER.info('source_id={}, alg_name={}, timeout={}'.format(self.source_id, self.alg_name, self.timeout))
         rois = self.reserved_args.get('roi')
         if not rois:
             return False
@@ -161,15 +134,10 @@ class Postprocessor(BasePostprocessor):
         if not self.reserved_data:
             self.__reinfer(rois)
             return False
-        self.__check_expire()
         model_name, targets = next(iter(filter_result.items()))
-        if self.reinfer_result.get(self.time) is None:
-            LOGGER.warning('Not found reinfer result, time={}'.format(self.time))
-            return False
-        self.reinfer_result[self.time]['result'].append((targets, self.reserved_data['roi']))
-        if len(self.reinfer_result[self.time]['result']) < self.reinfer_result[self.time]['count']:
+        reinfer_result_ = self._reinfer_complete(self._get_batch_result(targets))
+        if reinfer_result_ is None:
             return False
-        reinfer_result_ = self.reinfer_result.pop(self.time)
         self.draw_image = reinfer_result_['draw_image']
         gray_image = reinfer_result_['gray_image']
         self.__check_move(gray_image, polygons)
@@ -203,7 +171,8 @@ class Postprocessor(BasePostprocessor):
         if not self.reserved_data:
             return targets
         engine_result = model_data['engine_result']
-        targets.append({
-            'feature': engine_result
-        })
+        for engine_result_ in engine_result:
+            targets.append([{
+                'feature': engine_result_
+            }])
         return targets
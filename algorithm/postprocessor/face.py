@@ -1,5 +1,3 @@
-import numpy as np
-
 import gv
 from logger import LOGGER
 from postprocessor import Postprocessor as BasePostprocessor
@@ -13,28 +11,22 @@ class Postprocessor(BasePostprocessor):
         self.similarity = None
         self.quality_thresh = None
 
-    def __process_blacklist(self, feature, rectangle):
-        id_, score = self.index.search(feature, self.similarity) if self.index is not None else (None, None)
-        if id_ is not None:
-            face_info = self.index.query(id_)
-            if face_info:
-                rectangle['color'] = self.alert_color
-                rectangle['label'] = face_info['name']
-                rectangle['conf'] = min(max(score + 0.3, 0.4), 0.95)
-                self._set_ext(rectangle, face=face_info)
-                return True
+    def __process_blacklist(self, face_info, score, rectangle):
+        if face_info:
+            rectangle['color'] = self.alert_color
+            rectangle['label'] = face_info['name']
+            rectangle['conf'] = min(max(score + 0.3, 0.4), 0.95)
+            self._set_ext(rectangle, face=face_info)
+            return True
         rectangle['color'] = self.non_alert_color
         return False
 
-    def __process_whitelist(self, feature, rectangle):
-        id_, score = self.index.search(feature, self.similarity) if self.index is not None else (None, None)
-        if id_ is not None:
-            face_info = self.index.query(id_)
-            if face_info:
-                rectangle['color'] = self.non_alert_color
-                rectangle['label'] = face_info['name']
-                rectangle['conf'] = min(max(score + 0.3, 0.4), 0.95)
-                return False
+    def __process_whitelist(self, face_info, score, rectangle):
+        if face_info:
+            rectangle['color'] = self.non_alert_color
+            rectangle['label'] = face_info['name']
+            rectangle['conf'] = min(max(score + 0.3, 0.4), 0.95)
+            return False
         rectangle['color'] = self.alert_color
         return True
 
@@ -48,19 +40,23 @@ class Postprocessor(BasePostprocessor):
             self.similarity = max(self.reserved_args['similarity'] - 0.3, 0)
         polygons = self._gen_polygons()
         model_name, rectangles = next(iter(filter_result.items()))
+        # 一帧内的人脸特征批量检索
+        features, feature_rectangles = [], []
         for rectangle in rectangles:
             feature = self._get_ext(rectangle, 'feature', pop=True)
             if feature is not None:
-                np_feature = np.array(feature, dtype=np.float32)
-                if 'blacklist' == self.group_type:
-                    hit_ = self.__process_blacklist(np_feature, rectangle)
-                elif 'whitelist' == self.group_type:
-                    hit_ = self.__process_whitelist(np_feature, rectangle)
-                else:
-                    LOGGER.error('Unknown group_type: {}'.format(self.group_type))
-                    continue
-                if hit_:
-                    hit = hit_
+                features.append(feature)
+                feature_rectangles.append(rectangle)
+        for (face_info, score), rectangle in zip(self._search_index(features, self.similarity), feature_rectangles):
+            if 'blacklist' == self.group_type:
+                hit_ = self.__process_blacklist(face_info, score, rectangle)
+            elif 'whitelist' == self.group_type:
+                hit_ = self.__process_whitelist(face_info, score, rectangle)
+            else:
+                LOGGER.error('Unknown group_type: {}'.format(self.group_type))
+                continue
+            if hit_:
+                hit = hit_
         result['hit'] = hit
         result['data']['bbox']['rectangles'].extend(rectangles)
         result['data']['bbox']['polygons'].update(polygons)
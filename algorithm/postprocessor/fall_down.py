@@ -1,9 +1,5 @@
 from logger import LOGGER
 from postprocessor import Postprocessor as BasePostprocessor
-from .utils import json_utils
-from .utils.cv_utils.color_utils import rgb_reverse
-from .utils.cv_utils.crop_utils import crop_rectangle
-from .utils.image_utils import base64_to_opencv, opencv_to_base64
 
 
 class Postprocessor(BasePostprocessor):
@@ -12,87 +8,53 @@ class Postprocessor(BasePostprocessor):
         self.det_model_name = 'fall_down'
         self.cls_model_name = 'fall_down_classify'
         self.distance = 10
-        self.timeout = None
-        self.reinfer_result = {}
         self.fall_down_label = 0
+        # 静止目标复用二次分类结果
+        self.classify_cache_args = {}
 
     def __reinfer(self, filter_result):
         rectangles = filter_result.get(self.det_model_name)
         if rectangles is None:
             LOGGER.error('Fall down model result is None!')
-            return False
-        draw_image = base64_to_opencv(self.draw_image)
+            return 0, None, []
+        draw_image = self._get_image()
         image_shape = draw_image.shape
-        count = 0
         normal_rectangles = []
+        alert_rectangles = []
         for rectangle in rectangles:
             if rectangle['label'] not in self.alert_label:
                 normal_rectangles.append(rectangle)
                 continue
             xyxy = rectangle['xyxy']
-            cropped_image = crop_rectangle(draw_image, xyxy)
-            cropped_image = rgb_reverse(cropped_image)
             if (xyxy[0] < self.distance) \
                     or (xyxy[3] > image_shape[0] - self.distance) \
                     or (xyxy[2] > image_shape[1] - self.distance):
                 continue
-            source_data = {
-                'source_id': self.source_id,
-                'time': self.time * 1000000,
-                'infer_image': opencv_to_base64(cropped_image),
-                'draw_image': None,
-                'reserved_data': {
-                    'specified_model': [self.cls_model_name],
-                    'rectangle': rectangle,
-                    'unsort': True
-                }
-            }
-            self.rq_source.put(json_utils.dumps(source_data))
-            count += 1
-        if count > 0:
-            self.reinfer_result[self.time] = {
-                'count': count,
-                'draw_image': self.draw_image,
-                'normal_rectangles': normal_rectangles,
-                'result': []
-            }
-        return count, normal_rectangles
-
-    def __check_expire(self):
-        for time in list(self.reinfer_result.keys()):
-            if time < self.time - self.timeout:
-                LOGGER.warning('Reinfer result expired, source_id={}, alg_name={}, time={}, timeout={}'.format(
-                    self.source_id, self.alg_name, time, self.timeout))
-                del self.reinfer_result[time]
-        return True
+            alert_rectangles.append(rectangle)
+        count, reinfer_result_ = self._reinfer_classify(
+            self.cls_model_name, draw_image, alert_rectangles, normal_rectangles=normal_rectangles)
+        return count, reinfer_result_, normal_rectangles
 
     def _process(self, result, filter_result):
         hit = False
-        if self.timeout is None:
-            self.timeout = (self.frame_interval / 1000) * 2
-            LOGGER.info('source_id={}, alg_name={}, timeout={}'.format(self.source_id, self.alg_name, self.timeout))
         polygons = self._gen_polygons()
         if not self.reserved_data:
-            count, normal_rectangles = self.__reinfer(filter_result)
-            if not count:
-                self.__check_expire()
-                result['hit'] = False
-                result['data']['bbox']['rectangles'].extend(normal_rectangles)
-                result['data']['bbox']['polygons'].update(polygons)
-                return True
-            return False
-        self.__check_expire()
-        model_name, rectangles = next(iter(filter_result.items()))
-        if model_name != self.cls_model_name:
-            LOGGER.error('Get wrong model result, expect {}, but get {}'.format(self.cls_model_name, model_name))
-            return False
-        if self.reinfer_result.get(self.time) is None:
-            LOGGER.warning('Not found reinfer result, time={}'.format(self.time))
-            return False
-        self.reinfer_result[self.time]['result'].append((rectangles, self.reserved_data['rectangle']))
-        if len(self.reinfer_result[self.time]['result']) < self.reinfer_result[self.time]['count']:
-            return False
-        reinfer_result_ = self.reinfer_result.pop(self.time)
+            count, reinfer_result_, normal_rectangles = self.__reinfer(filter_result)
+            if reinfer_result_ is None:
+                if not count:
+                    result['hit'] = False
+                    result['data']['bbox']['rectangles'].extend(normal_rectangles)
+                    result['data']['bbox']['polygons'].update(polygons)
+                    return True
+                return False
+        else:
+            model_name, rectangles = next(iter(filter_result.items()))
+            if model_name != self.cls_model_name:
+                LOGGER.error('Get wrong model result, expect {}, but get {}'.format(self.cls_model_name, model_name))
+                return False
+            reinfer_result_ = self._complete_classify(rectangles)
+            if reinfer_result_ is None:
+                return False
         self.draw_image = reinfer_result_['draw_image']
         rectangles = reinfer_result_['normal_rectangles']
         for targets, rectangle in reinfer_result_['result']:
@@ -133,7 +95,7 @@ class Postprocessor(BasePostprocessor):
                 targets.append(self._gen_rectangle(
                     xyxy, self._get_color(model_conf['label'], label), label, engine_result_['conf']))
         elif model_name == self.cls_model_name:
-            score = engine_result['output'][self.fall_down_label]
-            if score >= model_conf['args']['conf_thres']:
-                targets.append(engine_result)
+            for engine_result_ in engine_result:
+                score = engine_result_['output'][self.fall_down_label]
+                targets.append([engine_result_] if score >= model_conf['args']['conf_thres'] else [])
         return targets
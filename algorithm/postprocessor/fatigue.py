@@ -14,7 +14,7 @@ class Postprocessor(BasePostprocessor):
         self.sensitivity = None
         self.tracker = None
         self.max_retain = 0
-        self.targets = {}
+        self.targets = None
         self.model_name = 'face_landmark'
         self.left_eye_index = [35, 36, 37, 39, 41, 42]
         self.right_eye_index = [89, 90, 91, 93, 95, 96]
@@ -36,16 +36,8 @@ class Postprocessor(BasePostprocessor):
             conf_=None
         )
 
-    def __check_lost_target(self, tracker_result):
-        for track_id in list(self.targets.keys()):
-            if track_id not in tracker_result:
-                self.targets[track_id]['lost'] += 1
-            else:
-                self.targets[track_id]['lost'] = 0
-            if self.targets[track_id]['lost'] > self.max_retain:
-                LOGGER.info('Target lost, source_id={}, alg_name={}, track_id={}'.format(
-                    self.source_id, self.alg_name, track_id))
-                del self.targets[track_id]
+    def __init_target(self, track):
+        track.window = RatioWindow(self.length, self.threshold)
         return True
 
     def _process(self, result, filter_result):
@@ -67,6 +59,7 @@ class Postprocessor(BasePostprocessor):
         if self.tracker is None:
             self.tracker = Tracker(self.frame_interval)
             self.max_retain = self.tracker.track_buffer + 1
+            self.targets = self._gen_track_table(self.max_retain, on_create=self.__init_target)
             LOGGER.info('Init tracker, source_id={}, alg_name={}, track_buffer={}'.format(
                 self.source_id, self.alg_name, self.tracker.track_buffer))
         face_landmark_rectangles = filter_result.get(self.model_name)
@@ -76,16 +69,11 @@ class Postprocessor(BasePostprocessor):
         # 目标跟踪
         tracker_result = self.tracker.track(face_landmark_rectangles)
         # 检查丢失目标
-        self.__check_lost_target(tracker_result)
+        self.targets.step(tracker_result.keys())
         for track_id, rectangle in tracker_result.items():
             target = self.targets.get(track_id)
             if target is None:
-                target = {
-                    'window': RatioWindow(self.length, self.threshold),
-                    'lost': 0,
-                    'hit': False
-                }
-                self.targets[track_id] = target
+                self.targets.create(track_id)
                 continue
             hit_flag = False
             lm = self._get_ext(rectangle, 'landmark', pop=True)
@@ -101,15 +89,15 @@ class Postprocessor(BasePostprocessor):
             era_right = (abs(lm[90][1] - lm[95][1]) + abs(lm[91][1] - lm[96][1])) / (abs(lm[93][0] - lm[89][0]) * 2)
             if (era_left + era_right) / 2 < self.sensitivity:
                 hit_flag = True
-                target['hit'] = True
+                target.hit = True
                 rectangle['color'] = self.alert_color
             result['data']['bbox']['rectangles'].append(self.__get_eye_rectangle(left_eye_box, hit_flag))
             result['data']['bbox']['rectangles'].append(self.__get_eye_rectangle(right_eye_box, hit_flag))
-            if target['window'].insert({'time': self.time, 'data': {'hit': target['hit']}}):
+            if target.window.insert({'time': self.time, 'data': {'hit': target.hit}}):
                 hit = True
                 rectangle['color'] = self.alert_color
                 rectangle['label'] = self.alert_label[0]
-                target['window'] = RatioWindow(self.length, self.threshold)
+                target.window = RatioWindow(self.length, self.threshold)
             else:
                 rectangle['color'] = self.non_alert_color
         result['hit'] = hit
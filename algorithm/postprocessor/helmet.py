@@ -1,10 +1,6 @@
 from logger import LOGGER
 from postprocessor import Postprocessor as BasePostprocessor
-from .utils import json_utils
-from .utils.cv_utils.color_utils import rgb_reverse
-from .utils.cv_utils.crop_utils import crop_rectangle
 from .utils.cv_utils.geo_utils import is_point_in_rectangle
-from .utils.image_utils import base64_to_opencv, opencv_to_base64
 
 
 class Postprocessor(BasePostprocessor):
@@ -13,8 +9,6 @@ class Postprocessor(BasePostprocessor):
         self.helmet_model_name = 'helmet'
         self.person_model_name = 'person'
         self.cls_model_name = 'helmet_classify'
-        self.timeout = None
-        self.reinfer_result = {}
         self.helmet_label = 0
 
     @staticmethod
@@ -47,36 +41,19 @@ class Postprocessor(BasePostprocessor):
         if person_rectangles is None:
             LOGGER.error('Person model result is None!')
             return False
-        draw_image = base64_to_opencv(self.draw_image)
+        draw_image = self._get_image()
         img_h, img_w = draw_image.shape[:2]
-        count = 0
+        bboxes = []
+        alert_rectangles = []
         for helmet_rectangle in helmet_rectangles:
             if helmet_rectangle['label'] not in self.alert_label:
                 continue
             xyxy = helmet_rectangle['xyxy']
-            bbox = self.__expand_box(xyxy, 5, 5, img_w, img_h)
-            cropped_image = crop_rectangle(draw_image, bbox)
-            cropped_image = rgb_reverse(cropped_image)
-            source_data = {
-                'source_id': self.source_id,
-                'time': self.time * 1000000,
-                'infer_image': opencv_to_base64(cropped_image),
-                'draw_image': None,
-                'reserved_data': {
-                    'specified_model': [self.cls_model_name],
-                    'rectangle': helmet_rectangle,
-                    'unsort': True
-                }
-            }
-            self.rq_source.put(json_utils.dumps(source_data))
-            count += 1
-        if count > 0:
-            self.reinfer_result[self.time] = {
-                'count': count,
-                'draw_image': self.draw_image,
-                'person_rectangles': person_rectangles,
-                'result': []
-            }
+            bboxes.append(self.__expand_box(xyxy, 5, 5, img_w, img_h))
+            alert_rectangles.append(helmet_rectangle)
+        cropped_images = self._crop_reinfer_images(self.cls_model_name, draw_image, bboxes)
+        count = self._reinfer_batch(
+            self.cls_model_name, cropped_images, alert_rectangles, person_rectangles=person_rectangles)
         return count, person_rectangles
 
     @staticmethod
@@ -98,41 +75,24 @@ class Postprocessor(BasePostprocessor):
         s_cross = (down_min - up_max) * (right_min - left_max)
         return s_cross / s1
 
-    def __check_expire(self):
-        for time in list(self.reinfer_result.keys()):
-            if time < self.time - self.timeout:
-                LOGGER.warning('Reinfer result expired, source_id={}, alg_name={}, time={}, timeout={}'.format(
-                    self.source_id, self.alg_name, time, self.timeout))
-                del self.reinfer_result[time]
-        return True
-
     def _process(self, result, filter_result):
         hit = False
-        if self.timeout is None:
-            self.timeout = (self.frame_interval / 1000) * 2
-            LOGGER.info('source_id={}, alg_name={}, timeout={}'.format(self.source_id, self.alg_name, self.timeout))
         polygons = self._gen_polygons()
         if not self.reserved_data:
             count, person_results = self.__reinfer(filter_result)
             if not count:
-                self.__check_expire()
                 result['hit'] = hit
                 result['data']['bbox']['rectangles'].extend(person_results)
                 result['data']['bbox']['polygons'].update(polygons)
                 return True
             return False
-        self.__check_expire()
         model_name, rectangles = next(iter(filter_result.items()))
         if model_name != self.cls_model_name:
             LOGGER.error('Get wrong model result, expect {}, but get {}'.format(self.cls_model_name, model_name))
             return False
-        if self.reinfer_result.get(self.time) is None:
-            LOGGER.warning('Not found reinfer result, time={}'.format(self.time))
-            return False
-        self.reinfer_result[self.time]['result'].append((rectangles, self.reserved_data['rectangle']))
-        if len(self.reinfer_result[self.time]['result']) < self.reinfer_result[self.time]['count']:
+        reinfer_result_ = self._reinfer_complete(self._get_batch_result(rectangles))
+        if reinfer_result_ is None:
             return False
-        reinfer_result_ = self.reinfer_result.pop(self.time)
         self.draw_image = reinfer_result_['draw_image']
         person_rectangles = reinfer_result_['person_rectangles']
         for targets, helmet_rectangle in reinfer_result_['result']:
@@ -182,7 +142,7 @@ class Postprocessor(BasePostprocessor):
                 # 生成矩形框
                 targets.append(self._gen_rectangle(xyxy, self.non_alert_color, label, engine_result_['conf']))
         elif model_name == self.cls_model_name:
-            score = engine_result['output'][self.helmet_label]
-            if score >= model_conf['args']['conf_thres']:
-                targets.append(engine_result)
+            for engine_result_ in engine_result:
+                score = engine_result_['output'][self.helmet_label]
+                targets.append([engine_result_] if score >= model_conf['args']['conf_thres'] else [])
         return targets
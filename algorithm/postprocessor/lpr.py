@@ -2,89 +2,161 @@ import numpy as np
 
 from logger import LOGGER
 from postprocessor import Postprocessor as BasePostprocessor
-from .utils import json_utils
+from tracker import Tracker
 from .utils.cv_utils.color_utils import rgb_reverse
-from .utils.image_utils import base64_to_opencv, opencv_to_base64
+from .utils.cv_utils.crop_utils import crop_rectangle
+from .utils.image_utils import opencv_to_base64, opencv_to_bytes
+from .utils.plate_utils import PlateVoter, is_valid_plate
 
 
 class Postprocessor(BasePostprocessor):
     def __init__(self, source_id, alg_name):
         super().__init__(source_id, alg_name)
         self.model_name = 'lpr'
-        self.timeout = None
-        self.reinfer_result = {}
+        # 一级模型为车辆检测模型时跟踪车辆，只对新目标和识别结果尚未稳定的目标请求车牌识别，识别结果逐字符投票
+        self.track = None
+        self.tracker = None
+        self.targets = None
+        self.min_reads = None
+        self.min_ratio = None
+        self.max_requests = None
 
     def __reinfer(self):
-        draw_image = base64_to_opencv(self.draw_image)
+        draw_image = self._get_image()
         draw_image = rgb_reverse(draw_image)
+        # 整帧识别始终使用jpg
+        if 'binary' == self.redis_message_format:
+            infer_image = opencv_to_bytes(draw_image)
+        else:
+            infer_image = opencv_to_base64(draw_image)
         source_data = {
             'source_id': self.source_id,
             'time': self.time * 1000000,
-            'infer_image': opencv_to_base64(draw_image),
+            'infer_image': infer_image,
             'draw_image': None,
             'reserved_data': {
                 'specified_model': [self.model_name],
                 'unsort': True
             }
         }
-        self.rq_source.put(json_utils.dumps(source_data))
-        self.reinfer_result[self.time] = {
-            'count': 1,
-            'draw_image': self.draw_image,
-            'result': []
-        }
-        return True
+        self._put_source(source_data)
+        return self._reinfer_submit(1)
+
+    def __init_target(self, target):
+        target.votes = PlateVoter(self.min_reads, self.min_ratio, self.max_requests)
+
+    def __track(self, rectangles):
+        if self.tracker is None:
+            self.tracker = Tracker(self.frame_interval)
+            self.targets = self._gen_track_table(self.tracker.track_buffer + 1, on_create=self.__init_target)
+            LOGGER.info('Init tracker, source_id={}, alg_name={}, track_buffer={}'.format(
+                self.source_id, self.alg_name, self.tracker.track_buffer))
+        tracker_result = self.tracker.track(rectangles)
+        self.targets.step(tracker_result.keys())
+        for track_id in tracker_result:
+            if track_id not in self.targets:
+                self.targets.create(track_id)
+        return tracker_result
+
+    def __reinfer_vehicles(self, tracker_result):
+        draw_image = self._get_image()
+        cropped_images = []
+        batch = []
+        for track_id, rectangle in tracker_result.items():
+            voter = self.targets.get(track_id).votes
+            if not voter.need_read():
+                continue
+            cropped_image = crop_rectangle(draw_image, rectangle['xyxy'])
+            if cropped_image is None or not cropped_image.size:
+                continue
+            voter.requests += 1
+            cropped_images.append(rgb_reverse(cropped_image))
+            batch.append(track_id)
+        vehicles = [(track_id, rectangle['xyxy']) for track_id, rectangle in tracker_result.items()]
+        return self._reinfer_batch(self.model_name, cropped_images, batch, vehicles=vehicles)
 
-    def __check_expire(self):
-        for time in list(self.reinfer_result.keys()):
-            if time < self.time - self.timeout:
-                LOGGER.warning('Reinfer result expired, source_id={}, alg_name={}, time={}, timeout={}'.format(
-                    self.source_id, self.alg_name, time, self.timeout))
-                del self.reinfer_result[time]
-        return True
+    def __vote(self, reinfer_result):
+        for lpr_rectangles, track_id in reinfer_result:
+            target = self.targets.get(track_id)
+            if target is None or not lpr_rectangles:
+                continue
+            # 一辆车只取置信度最高的车牌
+            lpr_rectangle = max(lpr_rectangles, key=lambda x: x['conf'])
+            target.votes.add(self._get_ext(lpr_rectangle, 'plate_code'), self._get_ext(lpr_rectangle, 'plate_type'),
+                              self._get_ext(lpr_rectangle, 'rec_conf'))
+            # 车牌相对车辆左上角的位置，车辆移动时随之平移
+            target.pre_target = {'xyxy': lpr_rectangle['xyxy'], 'conf': lpr_rectangle['conf']}
+
+    def __gen_vehicle_plates(self, vehicles):
+        lpr_rectangles = []
+        for track_id, xyxy in vehicles:
+            target = self.targets.get(track_id)
+            plate = target.votes.result() if target is not None else None
+            if plate is None or not is_valid_plate(plate[0], plate[1]):
+                continue
+            plate_xyxy = target.pre_target['xyxy']
+            lpr_rectangles.append(self._gen_rectangle(
+                [xyxy[0] + plate_xyxy[0], xyxy[1] + plate_xyxy[1], xyxy[0] + plate_xyxy[2], xyxy[1] + plate_xyxy[3]],
+                self.non_alert_color, '{} {}'.format(plate[0], plate[1]), target.pre_target['conf'],
+                plate_code=plate[0], plate_type=plate[1], track_id=track_id))
+        return lpr_rectangles
+
+    def __gen_plates(self, targets):
+        lpr_rectangles = []
+        for lpr_rectangle in targets:
+            if not is_valid_plate(lpr_rectangle['ext']['plate_code'], lpr_rectangle['ext']['plate_type']):
+                continue
+            label = '{} {}'.format(
+                self._get_ext(lpr_rectangle, 'plate_code'), self._get_ext(lpr_rectangle, 'plate_type'))
+            lpr_rectangle['label'] = label
+            lpr_rectangle['color'] = self.non_alert_color
+            lpr_rectangles.append(lpr_rectangle)
+        return lpr_rectangles
 
     def _process(self, result, filter_result):
-        hit = False
-        if self.timeout is None:
-            self.timeout = (self.frame_interval / 1000) * 2
-            LOGGER.info('source_id={}, alg_name={}, timeout={}'.format(self.source_id, self.alg_name, self.timeout))
+        if self.track is None:
+            self.track = self.reserved_args.get('track', True)
+        if self.min_reads is None:
+            self.min_reads = self.reserved_args.get('min_reads', 3)
+        if self.min_ratio is None:
+            self.min_ratio = self.reserved_args.get('min_ratio', 0.6)
+        if self.max_requests is None:
+            self.max_requests = self.reserved_args.get('max_requests', 10)
         if not self.reserved_data:
-            self.__reinfer()
-            return False
-        self.__check_expire()
+            vehicle_result = [targets for model_name, targets in filter_result.items() if model_name != self.model_name]
+            if not self.track or not vehicle_result:
+                self.__reinfer()
+                return False
+            tracker_result = self.__track(vehicle_result[0])
+            if self.__reinfer_vehicles(tracker_result):
+                return False
+            # 没有需要识别的车辆，直接使用已识别的车牌
+            lpr_rectangles = self.__gen_vehicle_plates(
+                [(track_id, rectangle['xyxy']) for track_id, rectangle in tracker_result.items()])
+        else:
+            model_name, targets = next(iter(filter_result.items()))
+            if 'batch' in self.reserved_data:
+                reinfer_result_ = self._reinfer_complete(self._get_batch_result(targets))
+                if reinfer_result_ is None:
+                    return False
+                self.__vote(reinfer_result_['result'])
+                lpr_rectangles = self.__gen_vehicle_plates(reinfer_result_['vehicles'])
+            else:
+                reinfer_result_ = self._reinfer_complete([targets])
+                if reinfer_result_ is None:
+                    return False
+                lpr_rectangles = []
+                for targets_ in reinfer_result_['result']:
+                    lpr_rectangles.extend(self.__gen_plates(targets_))
+            self.draw_image = reinfer_result_['draw_image']
         polygons = self._gen_polygons()
-        model_name, targets = next(iter(filter_result.items()))
-        if self.reinfer_result.get(self.time) is None:
-            LOGGER.warning('Not found reinfer result, time={}'.format(self.time))
-            return False
-        self.reinfer_result[self.time]['result'].append(targets)
-        if len(self.reinfer_result[self.time]['result']) < self.reinfer_result[self.time]['count']:
-            return False
-        reinfer_result_ = self.reinfer_result.pop(self.time)
-        self.draw_image = reinfer_result_['draw_image']
-        for targets in reinfer_result_['result']:
-            for lpr_rectangle in targets:
-                if lpr_rectangle['ext']['plate_type'] in ['蓝牌', '黄牌'] and len(
-                        lpr_rectangle['ext']['plate_code']) != 7:
-                    continue
-                if lpr_rectangle['ext']['plate_type'] == '绿牌' and len(lpr_rectangle['ext']['plate_code']) != 8:
-                    continue
-                hit = True
-                label = '{} {}'.format(
-                    self._get_ext(lpr_rectangle, 'plate_code'), self._get_ext(lpr_rectangle, 'plate_type'))
-                lpr_rectangle['label'] = label
-                lpr_rectangle['color'] = self.non_alert_color
-                result['data']['bbox']['rectangles'].append(lpr_rectangle)
-        result['hit'] = hit
+        result['hit'] = bool(lpr_rectangles)
+        result['data']['bbox']['rectangles'].extend(lpr_rectangles)
         result['data']['bbox']['polygons'].update(polygons)
         return result
 
-    def _filter(self, model_name, model_data):
+    def __filter_plates(self, model_conf, engine_result, roi=True):
         targets = []
-        if not self.reserved_data:
-            return targets
-        model_conf = model_data['model_conf']
-        engine_result = model_data['engine_result']
         for engine_result_ in engine_result:
             # 过滤掉置信度低于阈值的目标
             rec_conf = engine_result_['rec_conf']
@@ -94,10 +166,42 @@ class Postprocessor(BasePostprocessor):
             # 坐标缩放
             xyxy = engine_result_['xyxy']
             # 过滤掉不在多边形内的目标
-            if not self._filter_by_roi(xyxy):
+            if roi and not self._filter_by_roi(xyxy):
                 continue
             # 生成矩形框
+            kwargs = {} if roi else {'rec_conf': rec_conf}
             targets.append(self._gen_rectangle(
                 xyxy, self.non_alert_color, None, engine_result_['det_conf'],
-                plate_code=engine_result_['plate_code'], plate_type=engine_result_['plate_type']))
+                plate_code=engine_result_['plate_code'], plate_type=engine_result_['plate_type'], **kwargs))
         return targets
+
+    def _filter(self, model_name, model_data):
+        targets = []
+        model_conf = model_data['model_conf']
+        engine_result = model_data['engine_result']
+        if not self.reserved_data:
+            if model_name == self.model_name:
+                return targets
+            # 车辆检测
+            for engine_result_ in engine_result:
+                # 过滤掉置信度低于阈值的目标
+                if not self._filter_by_conf(model_conf, engine_result_['conf']):
+                    continue
+                # 过滤掉不在label列表中的目标
+                label = self._filter_by_label(model_conf, engine_result_['label'])
+                if not label:
+                    continue
+                # 坐标缩放
+                xyxy = self._scale(engine_result_['xyxy'])
+                # 过滤掉不在多边形内的目标
+                if not self._filter_by_roi(xyxy):
+                    continue
+                # 生成矩形框
+                targets.append(self._gen_rectangle(xyxy, self.non_alert_color, label, engine_result_['conf']))
+            return targets
+        if 'batch' in self.reserved_data:
+            # 批量二次推理，每张车辆裁剪图像对应一组车牌，坐标为裁剪图像内的坐标
+            for engine_result_ in engine_result:
+                targets.append(self.__filter_plates(model_conf, engine_result_, roi=False))
+            return targets
+        return self.__filter_plates(model_conf, engine_result)
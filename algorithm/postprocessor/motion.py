@@ -3,7 +3,7 @@ import numpy as np
 
 from postprocessor import Postprocessor as BasePostprocessor
 from .utils import json_utils
-from .utils.image_utils import base64_to_opencv
+from .utils.cv_utils.roi_utils import RoiMask
 
 
 class Postprocessor(BasePostprocessor):
@@ -16,11 +16,15 @@ class Postprocessor(BasePostprocessor):
         self.targets = {}
         self.check_interval = 1
 
-    def __check_motion(self, rectangles, pre_gray, cur_gray):
+    def __check_motion(self, rectangles, pre_gray, cur_gray, mask=None):
         hit = False
         delta = cv2.absdiff(pre_gray, cur_gray)
         binary_image = cv2.threshold(delta, self.diff_th, 255, cv2.THRESH_BINARY)[1]
-        contours, hierarchy = cv2.findContours(binary_image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        if mask is not None:
+            # 只在ROI外接矩形内计算，轮廓坐标转换为整帧坐标
+            contours, hierarchy = mask.find_contours(binary_image)
+        else:
+            contours, hierarchy = cv2.findContours(binary_image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
         for contour in contours:
             if cv2.contourArea(contour) >= self.area_th:
                 hit = True
@@ -37,10 +41,10 @@ class Postprocessor(BasePostprocessor):
         polygons = self._gen_polygons()
         rectangles = []
         model_name, infer_image = next(iter(filter_result.items()))
-        infer_image = base64_to_opencv(infer_image)
+        # 同一帧只模糊一次，各多边形共享
+        blur_image = self._get_cached_image('blur', 21, data=infer_image, name=model_name)
         if not polygons:
-            gray_image = cv2.cvtColor(infer_image, cv2.COLOR_BGR2GRAY)
-            gray_image = cv2.GaussianBlur(gray_image, (21, 21), 0)
+            gray_image = blur_image
             if not self.targets:
                 self.targets = {
                     'pre_target': gray_image,
@@ -52,25 +56,20 @@ class Postprocessor(BasePostprocessor):
                 self.targets['time'] = self.time
                 self.targets['pre_target'] = gray_image
         for polygon in polygons.values():
-            # gray_image如果放在外面，会影响告警
-            gray_image = cv2.cvtColor(infer_image, cv2.COLOR_BGR2GRAY)
-            gray_image = cv2.GaussianBlur(gray_image, (21, 21), 0)
             polygon_str = json_utils.dumps(polygon['polygon'])
             target = self.targets.get(polygon_str)
             if not target:
-                mask = np.zeros((infer_image.shape[0], infer_image.shape[1]), dtype=np.uint8)
-                mask = cv2.fillPoly(
-                    mask, [(np.array(polygon['polygon']) // self.scale).astype(np.int32).reshape((-1, 1, 2))], 255)
+                mask = RoiMask((np.array(polygon['polygon']) // self.scale).astype(np.int32), blur_image.shape)
                 self.targets[polygon_str] = {
-                    'pre_target': gray_image,
+                    'pre_target': mask.apply(blur_image),
                     'time': self.time,
                     'mask': mask
                 }
                 continue
-            gray_image = cv2.bitwise_and(gray_image, target['mask'])
+            # 缓存的模糊灰度图为只读，裁剪到ROI外接矩形并与mask按位与之后生成新的图像，不会影响其他多边形
+            gray_image = target['mask'].apply(blur_image)
             pre_gray_image = target['pre_target']
-            pre_gray_image = cv2.bitwise_and(pre_gray_image, target['mask'])
-            hit, rectangle = self.__check_motion(rectangles, pre_gray_image, gray_image)
+            hit, rectangle = self.__check_motion(rectangles, pre_gray_image, gray_image, target['mask'])
             rectangles.extend(rectangle)
             if hit:
                 polygon['color'] = self.alert_color
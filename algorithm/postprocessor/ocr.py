@@ -1,7 +1,6 @@
 import numpy as np
 
 from postprocessor import Postprocessor as BasePostprocessor
-from .utils.cv_utils.geo_utils import is_point_in_polygon
 
 
 class Postprocessor(BasePostprocessor):
@@ -54,7 +53,7 @@ class Postprocessor(BasePostprocessor):
             polygons = self.bbox.get('polygons', [])
             if polygons:
                 for polygon in polygons:
-                    if is_point_in_polygon((center_x, center_y), polygon['polygon']):
+                    if self._get_polygon_raster(polygon['polygon']).contains((center_x, center_y)):
                         break
                 else:
                     continue
@@ -27,6 +27,10 @@ class Postprocessor(BasePostprocessor):
         targets = []
         model_conf = model_data['model_conf']
         engine_result = model_data['engine_result']
+        if self._is_columnar(engine_result):
+            for xyxy, label, conf_ in self._filter_columnar(model_name, model_conf, engine_result, roi=False):
+                targets.append(self._gen_rectangle(xyxy, self.non_alert_color, label, conf_))
+            return targets
         for engine_result_ in engine_result:
             # 过滤掉置信度低于阈值的目标
             if not self._filter_by_conf(model_conf, engine_result_['conf']):
@@ -1,12 +1,10 @@
+import numpy as np
+
 from logger import LOGGER
 from postprocessor import Postprocessor as BasePostprocessor
 from tracker import Tracker
 from window.ratio_window import RatioWindow
-from .utils import json_utils
-from .utils.cv_utils.color_utils import rgb_reverse
-from .utils.cv_utils.crop_utils import crop_rectangle
-from .utils.cv_utils.geo_utils import calc_iou
-from .utils.image_utils import base64_to_opencv, opencv_to_base64
+from .utils.cv_utils.geo_utils import calc_iou_batch
 
 
 class Postprocessor(BasePostprocessor):
@@ -20,24 +18,25 @@ class Postprocessor(BasePostprocessor):
         self.threshold = None
         self.tracker = None
         self.max_retain = 0
-        self.targets = {}
+        self.targets = None
         self.check_interval = 1
         self.pre_n = 5
-        self.reinfer_result = {}
-        self.timeout = None
         self.sleep_label = 0
 
-    def __check_lost_target(self, tracker_result):
-        for track_id in list(self.targets.keys()):
-            if track_id not in tracker_result:
-                self.targets[track_id]['lost'] += 1
-            else:
-                self.targets[track_id]['lost'] = 0
-            if self.targets[track_id]['lost'] > self.max_retain:
-                LOGGER.info('Target lost, source_id={}, alg_name={}, track_id={}, pre_target={}'.format(
-                    self.source_id, self.alg_name, track_id, self.targets[track_id]['pre_targets']))
-                del self.targets[track_id]
-        return True
+    def __match_pre_targets(self, tracker_result):
+        # 批量计算历史目标已满的目标与各自历史目标的IOU，返回IOU大于阈值的历史目标数
+        track_ids = []
+        for track_id in tracker_result.keys():
+            target = self.targets.get(track_id)
+            if target is not None and len(target.history) == self.pre_n:
+                track_ids.append(track_id)
+        if not track_ids:
+            return {}
+        xyxy = np.array([tracker_result[track_id]['xyxy'] for track_id in track_ids])
+        pre_xyxy = np.array([[x['xyxy'] for x in self.targets.get(track_id).history] for track_id in track_ids])
+        pre_xyxy = pre_xyxy.reshape(len(track_ids), self.pre_n, 4)
+        match_num = (calc_iou_batch(xyxy[:, None, :], pre_xyxy) > self.iou).sum(axis=1)
+        return dict(zip(track_ids, match_num.tolist()))
 
     def __reinfer(self, filter_result, polygons):
         person_rectangles = filter_result.get(self.det_model_name)
@@ -47,71 +46,40 @@ class Postprocessor(BasePostprocessor):
         # 目标跟踪
         tracker_result = self.tracker.track(person_rectangles)
         # 检查丢失目标
-        self.__check_lost_target(tracker_result)
-        count = 0
+        self.targets.step(tracker_result.keys())
+        match_num = self.__match_pre_targets(tracker_result)
         rectangles = []
+        sleep_rectangles = []
         for track_id, rectangle in tracker_result.items():
             target = self.targets.get(track_id)
             if target is None:
-                target = {
-                    'window': RatioWindow(self.length, self.threshold),
-                    'lost': 0,
-                    'hit': False,
-                    'pre_targets': [],
-                    'time': self.time
-                }
-                self.targets[track_id] = target
+                target = self.targets.create(track_id)
             for polygon in polygons.values():
                 if self._is_rectangle_in_polygon(rectangle['xyxy'], polygon['polygon'], self.strategy):
-                    if len(target['pre_targets']) == self.pre_n and self.time - target['time'] > self.check_interval:
-                        match_num = 0
-                        for pre_target in target['pre_targets']:
-                            if calc_iou(pre_target['xyxy'], rectangle['xyxy']) > self.iou:
-                                match_num += 1
-                        if match_num == self.pre_n:
-                            target['hit'] = True
+                    if len(target.history) == self.pre_n and self.time - target.time > self.check_interval:
+                        if match_num[track_id] == self.pre_n:
+                            target.hit = True
                         else:
-                            target['hit'] = False
+                            target.hit = False
                     break
-            if len(target['pre_targets']) < self.pre_n or self.time - target['time'] > self.check_interval:
-                target['time'] = self.time
-                target['pre_targets'].append(rectangle)
-            if len(target['pre_targets']) > self.pre_n:
-                target['pre_targets'].pop(0)
-            if target['window'].insert({'time': self.time, 'data': {'hit': target['hit']}}):
-                target['window'] = RatioWindow(self.length, self.threshold)
-                draw_image = base64_to_opencv(self.draw_image)
-                cropped_image = crop_rectangle(draw_image, rectangle['xyxy'])
-                cropped_image = rgb_reverse(cropped_image)
-                source_data = {
-                    'source_id': self.source_id,
-                    'time': self.time * 1000000,
-                    'infer_image': opencv_to_base64(cropped_image),
-                    'draw_image': None,
-                    'reserved_data': {
-                        'specified_model': [self.cls_model_name],
-                        'rectangle': rectangle,
-                        'unsort': True
-                    }
-                }
-                self.rq_source.put(json_utils.dumps(source_data))
-                count += 1
+            if len(target.history) < self.pre_n or self.time - target.time > self.check_interval:
+                target.time = self.time
+                target.history.append(rectangle)
+            if target.window.insert({'time': self.time, 'data': {'hit': target.hit}}):
+                target.window = RatioWindow(self.length, self.threshold)
+                sleep_rectangles.append(rectangle)
             else:
                 rectangles.append(rectangle)
-            if count > 0:
-                self.reinfer_result[self.time] = {
-                    'count': count,
-                    'draw_image': self.draw_image,
-                    'result': []
-                }
+        cropped_images = []
+        if sleep_rectangles:
+            cropped_images = self._crop_reinfer_images(
+                self.cls_model_name, self._get_image(), [rectangle['xyxy'] for rectangle in sleep_rectangles])
+        count = self._reinfer_batch(self.cls_model_name, cropped_images, sleep_rectangles)
         return count, rectangles
 
-    def __check_expire(self):
-        for time in list(self.reinfer_result.keys()):
-            if time < self.time - self.timeout:
-                LOGGER.warning('Reinfer result expired, source_id={}, alg_name={}, time={}, timeout={}'.format(
-                    self.source_id, self.alg_name, time, self.timeout))
-                del self.reinfer_result[time]
+    def __init_target(self, track):
+        track.window = RatioWindow(self.length, self.threshold)
+        track.time = self.time
         return True
 
     def _process(self, result, filter_result):
@@ -121,9 +89,6 @@ class Postprocessor(BasePostprocessor):
         if self.length is None:
             self.length = self.reserved_args['length']
             self.pre_n = min(self.length, self.pre_n)
-        if self.timeout is None:
-            self.timeout = (self.frame_interval / 1000) * 2
-            LOGGER.info('source_id={}, alg_name={}, timeout={}'.format(self.source_id, self.alg_name, self.timeout))
         if self.threshold is None:
             if self.length != 0:
                 self.threshold = self.reserved_args['threshold'] / self.length
@@ -136,6 +101,7 @@ class Postprocessor(BasePostprocessor):
         if self.tracker is None:
             self.tracker = Tracker(self.frame_interval)
             self.max_retain = self.tracker.track_buffer + 1
+            self.targets = self._gen_track_table(self.max_retain, self.pre_n, self.__init_target)
             LOGGER.info('Init tracker, source_id={}, alg_name={}, track_buffer={}'.format(
                 self.source_id, self.alg_name, self.tracker.track_buffer))
         polygons = self._gen_polygons()
@@ -143,24 +109,18 @@ class Postprocessor(BasePostprocessor):
         if not self.reserved_data:
             count, person_rectangles = self.__reinfer(filter_result, polygons)
             if not count:
-                self.__check_expire()
                 result['hit'] = False
                 result['data']['bbox']['rectangles'].extend(person_rectangles)
                 result['data']['bbox']['polygons'].update(polygons)
                 return True
             return False
-        self.__check_expire()
         model_name, targets = next(iter(filter_result.items()))
         if model_name != self.cls_model_name:
             LOGGER.error('Get wrong model result, expect {}, but get {}'.format(self.cls_model_name, model_name))
             return False
-        if self.reinfer_result.get(self.time) is None:
-            LOGGER.warning('Not found reinfer result, time={}'.format(self.time))
-            return False
-        self.reinfer_result[self.time]['result'].append((targets, self.reserved_data['rectangle']))
-        if len(self.reinfer_result[self.time]['result']) < self.reinfer_result[self.time]['count']:
+        reinfer_result_ = self._reinfer_complete(self._get_batch_result(targets))
+        if reinfer_result_ is None:
             return False
-        reinfer_result_ = self.reinfer_result.pop(self.time)
         self.draw_image = reinfer_result_['draw_image']
         for targets, rectangle in reinfer_result_['result']:
             if not targets:
@@ -201,7 +161,7 @@ class Postprocessor(BasePostprocessor):
                 targets.append(self._gen_rectangle(
                     xyxy, self._get_color(model_conf['label'], label), label, engine_result_['conf']))
         elif model_name == self.cls_model_name:
-            score = engine_result['output'][self.sleep_label]
-            if score >= model_conf['args']['conf_thres']:
-                targets.append(engine_result)
+            for engine_result_ in engine_result:
+                score = engine_result_['output'][self.sleep_label]
+                targets.append([engine_result_] if score >= model_conf['args']['conf_thres'] else [])
         return targets
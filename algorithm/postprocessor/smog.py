@@ -1,10 +1,8 @@
+import numpy as np
+
 from logger import LOGGER
 from postprocessor import Postprocessor as BasePostprocessor
-from .utils import json_utils
-from .utils.cv_utils.color_utils import rgb_reverse
-from .utils.cv_utils.crop_utils import crop_rectangle
-from .utils.cv_utils.geo_utils import calc_iou
-from .utils.image_utils import base64_to_opencv, opencv_to_base64
+from .utils.cv_utils.geo_utils import calc_iou_matrix
 
 
 class Postprocessor(BasePostprocessor):
@@ -13,99 +11,56 @@ class Postprocessor(BasePostprocessor):
         self.det_model_name = 'smog'
         self.cls_model_name = 'smog_classify'
         self.iou = None
-        self.timeout = None
         self.pre_n = 3
         self.pre_targets = []
-        self.reinfer_result = {}
+        # 静止目标复用二次分类结果
+        self.classify_cache_args = {}
         self.smog_label = 0
 
     def __reinfer(self, filter_result):
         smog_rectangles = filter_result.get(self.det_model_name)
         if smog_rectangles is None:
             LOGGER.error('Smog model result is None!')
-            return False
+            return 0, None
         smog_rectangles = sorted(smog_rectangles, key=lambda x: x['conf'], reverse=True)
-        draw_image = base64_to_opencv(self.draw_image)
-        count = 0
-        for smog_rectangle in smog_rectangles:
-            xyxy = smog_rectangle['xyxy']
-            cropped_image = crop_rectangle(draw_image, xyxy)
-            cropped_image = rgb_reverse(cropped_image)
-            source_data = {
-                'source_id': self.source_id,
-                'time': self.time * 1000000,
-                'infer_image': opencv_to_base64(cropped_image),
-                'draw_image': None,
-                'reserved_data': {
-                    'specified_model': [self.cls_model_name],
-                    'rectangle': smog_rectangle,
-                    'unsort': True
-                }
-            }
-            self.rq_source.put(json_utils.dumps(source_data))
-            count += 1
-        if count > 0:
-            self.reinfer_result[self.time] = {
-                'count': count,
-                'draw_image': self.draw_image,
-                'result': []
-            }
-        return count
-
-    def __check_expire(self):
-        for time in list(self.reinfer_result.keys()):
-            if time < self.time - self.timeout:
-                LOGGER.warning('Reinfer result expired, source_id={}, alg_name={}, time={}, timeout={}'.format(
-                    self.source_id, self.alg_name, time, self.timeout))
-                del self.reinfer_result[time]
-        return True
+        draw_image = self._get_image()
+        return self._reinfer_classify(self.cls_model_name, draw_image, smog_rectangles)
 
     def _process(self, result, filter_result):
         hit = False
         if self.iou is None:
             self.iou = self.reserved_args['iou']
-        if self.timeout is None:
-            self.timeout = (self.frame_interval / 1000) * 2
-            LOGGER.info('source_id={}, alg_name={}, timeout={}'.format(self.source_id, self.alg_name, self.timeout))
         polygons = self._gen_polygons()
         if not self.reserved_data:
-            count = self.__reinfer(filter_result)
-            if not count:
-                self.__check_expire()
-                result['hit'] = False
-                result['data']['bbox']['polygons'].update(polygons)
-                return True
-            return False
-        self.__check_expire()
-        model_name, rectangles = next(iter(filter_result.items()))
-        if model_name != self.cls_model_name:
-            LOGGER.error('Get wrong model result, expect {}, but get {}'.format(self.cls_model_name, model_name))
-            return False
-        if self.reinfer_result.get(self.time) is None:
-            LOGGER.warning('Not found reinfer result, time={}'.format(self.time))
-            return False
-        self.reinfer_result[self.time]['result'].append((rectangles, self.reserved_data['rectangle']))
-        if len(self.reinfer_result[self.time]['result']) < self.reinfer_result[self.time]['count']:
-            return False
-        reinfer_result_ = self.reinfer_result.pop(self.time)
+            count, reinfer_result_ = self.__reinfer(filter_result)
+            if reinfer_result_ is None:
+                if not count:
+                    result['hit'] = False
+                    result['data']['bbox']['polygons'].update(polygons)
+                    return True
+                return False
+        else:
+            model_name, rectangles = next(iter(filter_result.items()))
+            if model_name != self.cls_model_name:
+                LOGGER.error('Get wrong model result, expect {}, but get {}'.format(self.cls_model_name, model_name))
+                return False
+            reinfer_result_ = self._complete_classify(rectangles)
+            if reinfer_result_ is None:
+                return False
         self.draw_image = reinfer_result_['draw_image']
-        smog_rectangles = []
-        for targets, rectangle in reinfer_result_['result']:
-            if not targets:
-                continue
-            diff_num = 0
+        smog_rectangles = [rectangle for targets, rectangle in reinfer_result_['result'] if targets]
+        if smog_rectangles and len(self.pre_targets) == self.pre_n:
+            xyxy = [x['xyxy'] for x in smog_rectangles]
+            diff = np.zeros(len(xyxy), dtype=bool)
             for pre_targets_ in self.pre_targets:
-                max_iou = 0
-                for pre_target in pre_targets_:
-                    iou = calc_iou(pre_target['xyxy'], rectangle['xyxy'])
-                    max_iou = max(max_iou, iou)
-                    if max_iou > 0 and max_iou <= self.iou:
-                        diff_num += 1
-                        break
-            if diff_num and len(self.pre_targets) == self.pre_n:
+                # 按历史目标顺序，第一个相交的历史目标IOU不超过阈值，则认为目标发生了变化
+                iou = calc_iou_matrix(xyxy, [x['xyxy'] for x in pre_targets_])
+                positive = iou > 0
+                first = positive.argmax(axis=1)
+                diff |= positive.any(axis=1) & (iou[np.arange(len(xyxy)), first] <= self.iou)
+            for i in np.flatnonzero(diff).tolist():
                 hit = True
-                rectangle['color'] = self.alert_color
-            smog_rectangles.append(rectangle)
+                smog_rectangles[i]['color'] = self.alert_color
         if len(smog_rectangles):
             self.pre_targets.append(smog_rectangles)
         if len(self.pre_targets) > self.pre_n:
@@ -139,7 +94,7 @@ class Postprocessor(BasePostprocessor):
                 targets.append(self._gen_rectangle(
                     xyxy, self._get_color(model_conf['label'], label), label, engine_result_['conf']))
         elif model_name == self.cls_model_name:
-            score = engine_result['output'][self.smog_label]
-            if score >= model_conf['args']['conf_thres']:
-                targets.append(engine_result)
+            for engine_result_ in engine_result:
+                score = engine_result_['output'][self.smog_label]
+                targets.append([engine_result_] if score >= model_conf['args']['conf_thres'] else [])
         return targets
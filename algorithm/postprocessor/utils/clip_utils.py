@@ -0,0 +1,72 @@
+import collections
+
+
+class ClipBuffer:
+    """
+    时序片段缓冲区，用于视频分类等以连续多帧为输入的二次推理；每帧在加入时编码一次，编码结果保存在定长环形缓冲区中，
+    窗口滑动时不再重复编码；每stride帧提交一次片段，可发送完整片段，或只发送上次提交之后新增的帧（增量），
+    由引擎按片段id拼接
+    """
+
+    def __init__(self, size, stride=1, encode=None, clip_id=None):
+        """
+        Args:
+            size: 片段帧数
+            stride: 提交间隔帧数，窗口填满后每stride帧提交一次
+            encode: 帧编码函数，None表示保存原始帧
+            clip_id: 片段id，增量发送时引擎按片段id拼接
+        """
+        self.size = size
+        self.stride = max(int(stride), 1)
+        self.encode = encode
+        self.clip_id = clip_id
+        self.frames = collections.deque(maxlen=size)
+        # 已加入的帧数，即下一帧的序号
+        self.seq = 0
+        # 最近一次提交时的帧数
+        self.submitted_seq = 0
+        # 统计
+        self.encoded = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def append(self, frame):
+        """
+        加入一帧，编码后保存，超过片段帧数时自动丢弃最旧的帧
+        Args:
+            frame: 帧数据
+        Returns: True：片段已满且到达提交间隔，False：不提交
+        """
+        if self.encode is not None:
+            frame = self.encode(frame)
+            self.encoded += 1
+        self.frames.append(frame)
+        self.seq += 1
+        return len(self.frames) == self.size and 0 == (self.seq - self.size) % self.stride
+
+    def clip(self):
+        """
+        完整片段，按时间从旧到新，并记为已提交
+        Returns: 帧列表
+        """
+        self.submitted_seq = self.seq
+        return list(self.frames)
+
+    def delta(self):
+        """
+        上次提交之后新增的帧，并记为已提交；新增帧数超过片段帧数时只返回最近的片段帧数
+        Returns: (首帧序号, 帧列表)，首帧序号为0或帧列表为完整片段时引擎应重建片段
+        """
+        count = min(self.seq - self.submitted_seq, len(self.frames))
+        self.submitted_seq = self.seq
+        frames = list(self.frames)[len(self.frames) - count:]
+        return self.seq - count, frames
+
+    def clear(self):
+        """
+        清空缓冲区，之后的帧重新计序
+        """
+        self.frames.clear()
+        self.seq = 0
+        self.submitted_seq = 0
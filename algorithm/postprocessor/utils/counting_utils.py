@@ -0,0 +1,106 @@
+import threading
+import time
+import weakref
+
+import db.cross_line_counting
+from db.operation import get_session
+from logger import LOGGER
+from . import json_utils
+
+
+class CrossLineCountingStore:
+    """
+    跨线计数结果的内存缓存，计数在内存中累加，随后处理结果输出，由引擎写回数据库；
+    缓存超过刷新周期后从数据库重新读取，读取到的结果（引擎写回的结果或人工重置的结果）覆盖内存中的结果，
+    数据库中已删除的线段，以及没有存活的算法实例持有且超过两个刷新周期未被访问的线段从缓存中淘汰
+    """
+
+    def __init__(self, refresh_interval=5):
+        """
+        Args:
+            refresh_interval: 刷新周期，单位：秒
+        """
+        self.refresh_interval = refresh_interval
+        # {line_id: [result, 读取时间]}
+        self.results = {}
+        # {算法实例: 持有的line_id集合}，实例销毁后自动移除
+        self.owners = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def __evict(self, now):
+        """
+        淘汰没有存活的算法实例持有，且超过两个刷新周期未被重新读取的线段
+        Args:
+            now: 当前时间
+        """
+        held = set()
+        for line_ids in list(self.owners.values()):
+            held.update(line_ids)
+        expired = [line_id for line_id, (_, load_time) in self.results.items()
+                   if line_id not in held and now - load_time > self.refresh_interval * 2]
+        for line_id in expired:
+            del self.results[line_id]
+
+    def load(self, line_ids, owner=None):
+        """
+        加载计数结果，内存中未过期的直接复用，其余在同一个数据库会话中读取
+        Args:
+            line_ids: line_id列表
+            owner: 持有这些线段的算法实例，实例存活期间线段不会被淘汰，同一实例再次加载时替换持有的线段
+        Returns: {line_id: result}，数据库中不存在的line_id不返回
+        """
+        now = time.monotonic()
+        with self.lock:
+            if owner is not None:
+                self.owners[owner] = set(line_ids)
+            missing = [line_id for line_id in line_ids if line_id not in self.results or
+                       now - self.results[line_id][1] > self.refresh_interval]
+        if missing:
+            loaded = {}
+            try:
+                with get_session() as db_session:
+                    for line_id in missing:
+                        status, row = db.cross_line_counting.query(db_session, line_id)
+                        if status:
+                            loaded[line_id] = json_utils.loads(row['result']) if row else None
+            except:
+                LOGGER.exception('load')
+            with self.lock:
+                for line_id, result in loaded.items():
+                    if result is not None:
+                        self.results[line_id] = [result, now]
+                    else:
+                        # 数据库中已删除
+                        self.results.pop(line_id, None)
+                self.__evict(now)
+        with self.lock:
+            return {line_id: self.results[line_id][0] for line_id in line_ids if line_id in self.results}
+
+    def update(self, line_id, func, *args):
+        """
+        修改内存中的计数结果
+        Args:
+            line_id: line_id
+            func: 修改函数，func(result, *args)
+            *args: 修改函数的参数
+        Returns: True or False
+        """
+        with self.lock:
+            item = self.results.get(line_id)
+            if item is None:
+                return False
+            func(item[0], *args)
+        return True
+
+    def invalidate(self, line_ids=None):
+        """
+        使缓存失效，下次加载时从数据库重新读取
+        Args:
+            line_ids: line_id列表，None表示全部
+        """
+        with self.lock:
+            if line_ids is None:
+                self.results.clear()
+                return
+            for line_id in line_ids:
+                self.results.pop(line_id, None)
@@ -0,0 +1,115 @@
+import cv2
+import numpy as np
+
+from .geo_utils import calc_iou_matrix
+
+# dHash的位权重，9x8灰度图相邻像素比较得到64位
+_DHASH_WEIGHTS = (1 << np.arange(64, dtype=np.uint64)).reshape(8, 8)
+
+
+def dhash(gray, xyxy):
+    """
+    矩形区域的差值哈希（dHash），区域缩放为9x8后逐行比较相邻像素，用于判断外观是否变化
+    Args:
+        gray: 灰度图
+        xyxy: 矩形的左上角和右下角坐标
+    Returns: 64位整数 or None（区域为空）
+    """
+    x1, y1 = max(int(xyxy[0]), 0), max(int(xyxy[1]), 0)
+    cropped = gray[y1:int(xyxy[3]), x1:int(xyxy[2])]
+    if not cropped.size:
+        return None
+    small = cv2.resize(cropped, (9, 8), interpolation=cv2.INTER_AREA)
+    return int(_DHASH_WEIGHTS[small[:, 1:] > small[:, :-1]].sum())
+
+
+def hamming(hash1, hash2):
+    """
+    两个哈希值的汉明距离
+    Args:
+        hash1: 整数
+        hash2: 整数
+    Returns: 不同的位数
+    """
+    return bin(hash1 ^ hash2).count('1')
+
+
+class ClassifyCache:
+    """
+    二次分类结果缓存，按目标框几何位置（IOU）匹配，目标框未移动、外观（dHash）未变化且未超过有效期时复用分类结果，
+    不再发送二次分类；有效期从分类时刻开始计算，命中不延长有效期，超过有效期的目标重新分类
+    """
+
+    def __init__(self, iou=0.85, distance=6, ttl=5, max_size=64):
+        """
+        Args:
+            iou: 目标框与缓存框的最小IOU
+            distance: 外观哈希的最大汉明距离
+            ttl: 有效期，单位：秒
+            max_size: 最大缓存数量，超过时淘汰最早分类的结果
+        """
+        self.iou = iou
+        self.distance = distance
+        self.ttl = ttl
+        self.max_size = max_size
+        # [{'xyxy', 'hash', 'time', 'result'}, ...]，按分类时间排序
+        self.entries = []
+        # 统计
+        self.hits = 0
+        self.misses = 0
+
+    def __expire(self, time):
+        self.entries = [entry for entry in self.entries if time - entry['time'] < self.ttl]
+
+    def __match(self, xyxys):
+        if not self.entries or not len(xyxys):
+            return np.full(len(xyxys), -1), np.zeros(len(xyxys))
+        iou = calc_iou_matrix(xyxys, [entry['xyxy'] for entry in self.entries])
+        index = iou.argmax(axis=1)
+        return index, iou[np.arange(len(xyxys)), index]
+
+    def lookup(self, xyxys, hashes, time):
+        """
+        查找缓存的分类结果
+        Args:
+            xyxys: 目标框列表
+            hashes: 与目标框一一对应的外观哈希，None表示不复用
+            time: 当前帧时间戳
+        Returns: 与目标框一一对应的分类结果，未命中为None
+        """
+        self.__expire(time)
+        index, iou = self.__match(xyxys)
+        results = []
+        for i, hash_ in enumerate(hashes):
+            entry = self.entries[index[i]] if iou[i] >= self.iou else None
+            if entry is None or hash_ is None or hamming(hash_, entry['hash']) > self.distance:
+                results.append(None)
+                self.misses += 1
+                continue
+            results.append(entry['result'])
+            self.hits += 1
+        return results
+
+    def update(self, xyxys, hashes, results, time):
+        """
+        写入分类结果，与已有缓存框的IOU达到阈值时替换
+        Args:
+            xyxys: 目标框列表
+            hashes: 与目标框一一对应的外观哈希，None表示不缓存
+            results: 与目标框一一对应的分类结果
+            time: 分类时的帧时间戳
+        """
+        index, iou = self.__match(xyxys)
+        replaced = set()
+        for i, (xyxy, hash_, result) in enumerate(zip(xyxys, hashes, results)):
+            if hash_ is None:
+                continue
+            entry = {'xyxy': list(xyxy), 'hash': hash_, 'time': time, 'result': result}
+            if iou[i] >= self.iou and index[i] not in replaced:
+                replaced.add(index[i])
+                self.entries[index[i]] = entry
+            else:
+                self.entries.append(entry)
+        self.entries.sort(key=lambda entry: entry['time'])
+        if len(self.entries) > self.max_size:
+            del self.entries[:len(self.entries) - self.max_size]
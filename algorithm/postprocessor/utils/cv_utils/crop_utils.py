@@ -2,6 +2,7 @@ import cv2
 import numpy as np
 
 from logger import LOGGER
+from .roi_utils import RoiMask
 
 
 def crop_rectangle(image, xyxy, bbox=True, reverse=False):
@@ -45,6 +46,9 @@ def crop_poly(image, points, bbox=True, reverse=False):
     Returns: 裁剪之后的图片
     """
     try:
+        if bbox:
+            # 只在外接矩形内生成掩码和按位与
+            return RoiMask(points, image.shape, pad=0).extract(image, reverse)
         np_points = np.array(points, dtype=np.int32)
         if not reverse:
             white_mask = np.zeros(image.shape, dtype=np.uint8)
@@ -54,10 +58,104 @@ def crop_poly(image, points, bbox=True, reverse=False):
             black_mask = np.ones(image.shape, dtype=np.uint8) * 255
             cv2.fillPoly(black_mask, [np_points], (0, 0, 0))
             image = cv2.bitwise_and(image, black_mask)
-        if bbox:
-            x, y, w, h = cv2.boundingRect(np_points)
-            image = image[y:y + h, x:x + w]
         return image
     except:
         LOGGER.exception('crop_poly')
     return None
+
+
+def crop_polys(image, polygons, reverse=False, cache=None):
+    """
+    批量裁剪多边形区域的外接矩形，只在外接矩形内计算，耗时和内存与多边形面积相关，与整帧面积无关
+    Args:
+        image: image，numpy格式
+        polygons: 多边形顶点坐标列表
+        reverse: 是否反转mask
+        cache: 掩码缓存，{多边形顶点: RoiMask}，静态多边形每帧传入同一个dict时掩码只生成一次
+    Returns: 裁剪之后的图片列表，与polygons一一对应，失败时为None
+    """
+    cropped_images = []
+    for points in polygons:
+        try:
+            key = None
+            mask = None
+            if cache is not None:
+                key = tuple(map(tuple, points))
+                mask = cache.get(key)
+            if mask is None or (mask.height, mask.width) != image.shape[:2]:
+                mask = RoiMask(points, image.shape, pad=0)
+                if cache is not None:
+                    cache[key] = mask
+            cropped_images.append(mask.extract(image, reverse))
+        except:
+            LOGGER.exception('crop_polys')
+            cropped_images.append(None)
+    return cropped_images
+
+
+class CropBuffer:
+    """
+    二次推理裁剪缓冲区，裁剪、缩放（可选letterbox）在一次仿射变换中完成，直接写入预分配的缓冲区，
+    颜色转换在缓冲区内原地进行；输出尺寸即二次推理模型的输入尺寸，引擎无需再缩放，编码和传输的数据量也随之减少
+    """
+
+    def __init__(self, size, letterbox=False, reverse=True, pad_value=114, capacity=8):
+        """
+        Args:
+            size: 输出尺寸，(width, height)
+            letterbox: 是否保持宽高比缩放并居中填充，False时直接拉伸
+            reverse: 是否反转颜色通道，与rgb_reverse一致
+            pad_value: letterbox填充值
+            capacity: 初始容量，不足时扩容
+        """
+        self.width, self.height = int(size[0]), int(size[1])
+        self.letterbox = letterbox
+        self.reverse = reverse
+        self.pad_value = pad_value
+        self.buffer = np.empty((max(capacity, 1), self.height, self.width, 3), dtype=np.uint8)
+
+    def __matrix(self, w, h):
+        scale_x, scale_y = self.width / w, self.height / h
+        offset_x = offset_y = 0
+        if self.letterbox:
+            scale_x = scale_y = min(scale_x, scale_y)
+            offset_x, offset_y = (self.width - w * scale_x) / 2, (self.height - h * scale_y) / 2
+        # 像素中心对齐，与cv2.resize的坐标映射一致
+        return np.array([[scale_x, 0, 0.5 * scale_x - 0.5 + offset_x],
+                         [0, scale_y, 0.5 * scale_y - 0.5 + offset_y]], dtype=np.float64)
+
+    def prepare(self, image, xyxys):
+        """
+        裁剪并缩放到输出尺寸
+        Args:
+            image: 整帧图像，BGR
+            xyxys: 裁剪区域列表，超出图像的部分按图像边界截断
+        Returns: 与xyxys一一对应的图像列表，区域为空时为None；图像为缓冲区的视图，下一次调用时被覆盖
+        """
+        try:
+            if len(xyxys) > len(self.buffer):
+                self.buffer = np.empty((max(len(xyxys), len(self.buffer) * 2), self.height, self.width, 3),
+                                       dtype=np.uint8)
+            height, width = image.shape[:2]
+            images = []
+            for i, xyxy in enumerate(xyxys):
+                if xyxy is None:
+                    images.append(None)
+                    continue
+                x0, y0 = max(int(xyxy[0]), 0), max(int(xyxy[1]), 0)
+                x1, y1 = min(int(xyxy[2]), width), min(int(xyxy[3]), height)
+                if x1 <= x0 or y1 <= y0:
+                    images.append(None)
+                    continue
+                # 只采样裁剪区域，边界外按复制边缘处理，与先裁剪再缩放一致
+                cv2.warpAffine(image[y0:y1, x0:x1], self.__matrix(x1 - x0, y1 - y0), (self.width, self.height),
+                               dst=self.buffer[i], flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_CONSTANT if self.letterbox else cv2.BORDER_REPLICATE,
+                               borderValue=(self.pad_value,) * 3)
+                if self.reverse:
+                    cv2.cvtColor(self.buffer[i], cv2.COLOR_BGR2RGB, dst=self.buffer[i])
+                images.append(self.buffer[i])
+            return images
+        except:
+            LOGGER.exception('CropBuffer.prepare')
+        return [None] * len(xyxys)
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def is_point_in_segment(point, segment):
     """
     判断点是否在线段上
@@ -75,6 +78,39 @@ def is_point_in_polygon(point, polygon):
     return 1 == n % 2
 
 
+def is_points_in_polygon(points, polygon):
+    """
+    批量判断点是否在多边形内，与is_point_in_polygon逐点判断的结果一致（包括边上的点）
+    Args:
+        points: 点的坐标，(N, 2)
+        polygon: 多边形的顶点
+    Returns: bool ndarray，(N,)
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
+    n = np.zeros(len(points), dtype=np.int64)
+    on_edge = np.zeros(len(points), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start, end in get_polygon_edges(polygon):
+            x1, y1 = float(start[0]), float(start[1])
+            x2, y2 = float(end[0]), float(end[1])
+            # 点在边上，同is_point_in_segment
+            in_box = (min(x1, x2) <= x) & (x <= max(x1, x2)) & (min(y1, y2) <= y) & (y <= max(y1, y2))
+            if x1 != x2 and y1 != y2:
+                in_box &= np.where(y == y1, x == x1, (x2 - x1) / (y2 - y1) == (x - x1) / (y - y1))
+            on_edge |= in_box
+            # 水平向右的射线与边相交，同is_ray_intersect_segment
+            if y1 == y2:
+                continue
+            intersect = ~((x1 < x) & (x2 < x))
+            intersect &= ~((y1 > y) & (y2 > y))
+            intersect &= ~((y1 < y) & (y2 < y))
+            intersect &= ~(((y1 == y) & (y2 > y)) | ((y2 == y) & (y1 > y)))
+            intersect &= ~(x2 - (y2 - y) * (x2 - x1) / (y2 - y1) < x)
+            n += intersect
+    return on_edge | (n % 2 == 1)
+
+
 def is_point_in_rectangle(point, xyxy):
     """
     判断点是否在矩形内
@@ -161,3 +197,83 @@ def calc_iou(xyxy1, xyxy2):
     s2 = (xyxy2[2] - xyxy2[0]) * (xyxy2[3] - xyxy2[1])
     s_cross = (down_min - up_max) * (right_min - left_max)
     return s_cross / (s1 + s2 - s_cross)
+
+
+def is_rectangle_intersect_matrix(xyxy1, xyxy2):
+    """
+    批量判断矩形是否相交，与is_rectangle_intersect逐对判断的结果一致
+    Args:
+        xyxy1: 矩形的左上角和右下角坐标，(N, 4)
+        xyxy2: 矩形的左上角和右下角坐标，(M, 4)
+    Returns: bool ndarray，(N, M)
+    """
+    xyxy1 = np.asarray(xyxy1, dtype=np.float64).reshape(-1, 1, 4)
+    xyxy2 = np.asarray(xyxy2, dtype=np.float64).reshape(1, -1, 4)
+    x_min = np.maximum(xyxy1[..., 0], xyxy2[..., 0])
+    y_min = np.maximum(xyxy1[..., 1], xyxy2[..., 1])
+    x_max = np.minimum(xyxy1[..., 2], xyxy2[..., 2])
+    y_max = np.minimum(xyxy1[..., 3], xyxy2[..., 3])
+    return (x_min <= x_max) & (y_min <= y_max)
+
+
+def _cross(x1, y1, x2, y2, x3, y3):
+    """
+    cross的批量版本，运算顺序与cross一致
+    """
+    return (x2 - x1) * (y3 - y1) - (x3 - x1) * (y2 - y1)
+
+
+def is_seg_intersect_matrix(segments1, segments2):
+    """
+    批量判断线段是否相交，与is_seg_intersect逐对判断的结果一致
+    Args:
+        segments1: 线段的两个端点，(N, 2, 2)
+        segments2: 线段的两个端点，(M, 2, 2)
+    Returns: bool ndarray，(N, M)
+    """
+    segments1 = np.asarray(segments1, dtype=np.float64).reshape(-1, 1, 4)
+    segments2 = np.asarray(segments2, dtype=np.float64).reshape(1, -1, 4)
+    x1, y1, x2, y2 = [segments1[..., i] for i in range(4)]
+    x3, y3, x4, y4 = [segments2[..., i] for i in range(4)]
+    # 跨立判断之前先做外接矩形相交判断
+    xyxy1 = np.stack([np.minimum(x1, x2), np.minimum(y1, y2), np.maximum(x1, x2), np.maximum(y1, y2)], axis=-1)
+    xyxy2 = np.stack([np.minimum(x3, x4), np.minimum(y3, y4), np.maximum(x3, x4), np.maximum(y3, y4)], axis=-1)
+    intersect = is_rectangle_intersect_matrix(xyxy1.reshape(-1, 4), xyxy2.reshape(-1, 4))
+    intersect &= _cross(x1, y1, x2, y2, x3, y3) * _cross(x1, y1, x2, y2, x4, y4) <= 0
+    intersect &= _cross(x3, y3, x4, y4, x1, y1) * _cross(x3, y3, x4, y4, x2, y2) <= 0
+    return intersect
+
+
+def calc_iou_batch(xyxy1, xyxy2):
+    """
+    批量计算矩形的IOU，按numpy广播规则逐对计算，与calc_iou的结果一致
+    Args:
+        xyxy1: 矩形的左上角和右下角坐标，(..., 4)
+        xyxy2: 矩形的左上角和右下角坐标，(..., 4)
+    Returns: IOU ndarray，形状为两者广播后去掉最后一维
+    """
+    xyxy1 = np.asarray(xyxy1, dtype=np.float64)
+    xyxy2 = np.asarray(xyxy2, dtype=np.float64)
+    left_max = np.maximum(xyxy1[..., 0], xyxy2[..., 0])
+    right_min = np.minimum(xyxy1[..., 2], xyxy2[..., 2])
+    up_max = np.maximum(xyxy1[..., 1], xyxy2[..., 1])
+    down_min = np.minimum(xyxy1[..., 3], xyxy2[..., 3])
+    s1 = (xyxy1[..., 2] - xyxy1[..., 0]) * (xyxy1[..., 3] - xyxy1[..., 1])
+    s2 = (xyxy2[..., 2] - xyxy2[..., 0]) * (xyxy2[..., 3] - xyxy2[..., 1])
+    s_cross = (down_min - up_max) * (right_min - left_max)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = s_cross / (s1 + s2 - s_cross)
+    return np.where((left_max >= right_min) | (down_min <= up_max), 0.0, iou)
+
+
+def calc_iou_matrix(xyxy1, xyxy2):
+    """
+    计算两组矩形两两之间的IOU
+    Args:
+        xyxy1: 矩形的左上角和右下角坐标，(N, 4)
+        xyxy2: 矩形的左上角和右下角坐标，(M, 4)
+    Returns: IOU ndarray，(N, M)
+    """
+    xyxy1 = np.asarray(xyxy1, dtype=np.float64).reshape(-1, 1, 4)
+    xyxy2 = np.asarray(xyxy2, dtype=np.float64).reshape(1, -1, 4)
+    return calc_iou_batch(xyxy1, xyxy2)
@@ -0,0 +1,253 @@
+import cv2
+import numpy as np
+
+# COCO 17个关键点中各身体部位的索引：鼻子、眼睛、耳朵；肩膀、胳膊肘、手腕；鼻子、肩膀、胯部；胯、膝盖、脚踝
+HEAD_INDEX = [0, 1, 2, 3, 4]
+ARM_INDEX = [5, 6, 7, 8, 9, 10]
+TORSO_INDEX = [0, 5, 6, 11, 12]
+LEG_INDEX = [11, 12, 13, 14, 15, 16]
+
+
+def stack_keypoints(key_points, xyxys):
+    """
+    一帧内所有人的关键点堆叠为数组，坐标转换为相对人体框左上角的坐标
+    Args:
+        key_points: 每个人的关键点列表，[[[x, y, conf], ...], ...]
+        xyxys: 与关键点一一对应的人体框
+    Returns: (N, 17, 3)
+    """
+    if not len(key_points):
+        return np.zeros((0, 17, 3))
+    keypoints = np.array(key_points, dtype=float)
+    keypoints[..., :2] -= np.array(xyxys, dtype=float)[:, None, :2]
+    return keypoints
+
+
+def select_points(keypoints, index, threshold):
+    """
+    选取关键点，置信度低于阈值的关键点（坐标和置信度）置为0
+    Args:
+        keypoints: (N, 17, 3)
+        index: 关键点索引列表
+        threshold: 置信度阈值
+    Returns: 关键点(N, K, 3)，低置信度掩码(N, K)
+    """
+    points = keypoints[:, index]
+    low = points[..., 2] < threshold
+    points[low] = 0
+    return points, low
+
+
+def vector_angle(vec1, vec2):
+    """
+    向量夹角，沿最后一维计算，零向量的夹角为nan
+    Args:
+        vec1: (..., D)
+        vec2: (..., D)
+    Returns: 夹角(...)，单位：度
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_angle = (vec1 * vec2).sum(-1) / (np.sqrt((vec1 * vec1).sum(-1)) * np.sqrt((vec2 * vec2).sum(-1)))
+        return np.arccos(cos_angle) * 360 / 2 / np.pi
+
+
+def _to_int(boxes, valid):
+    valid = valid & np.isfinite(boxes).all(-1)
+    return np.where(valid[..., None], boxes, 0).astype(int), valid
+
+
+def _split_sizes(sizes):
+    sizes = np.array(sizes, dtype=float).reshape(-1, 2)
+    return sizes[:, 0], sizes[:, 1]
+
+
+def head_rois(keypoints, sizes, threshold, angle_th=45, scale_w=1.4, scale_h=1.2, min_height=10):
+    """
+    头部区域，鼻子、眼睛、耳朵都必须存在且头部倾斜角度不超过阈值；纵向为鼻子到眼睛距离的2倍，横向为两耳之间（耳朵不存在时为两眼之间），
+    再按比例扩大
+    Args:
+        keypoints: (N, 17, 3)，相对人体框的坐标
+        sizes: 人体框裁剪图像的尺寸(N, 2)，[[w, h], ...]
+        threshold: 关键点置信度阈值
+        angle_th: 两眼连线与水平方向的最大夹角
+        scale_w: 横向扩大比例
+        scale_h: 纵向扩大比例
+        min_height: 最小高度
+    Returns: 头部区域(N, 4)，是否有效(N,)
+    """
+    img_w, img_h = _split_sizes(sizes)
+    points, low = select_points(keypoints, HEAD_INDEX, threshold)
+    nose, eyes, ears = points[:, 0], points[:, 1:3], points[:, 3:5]
+    valid = ~low.any(1)
+    # 两眼连线与水平方向的夹角
+    eye_x, eye_y = eyes[:, 1, 0] - eyes[:, 0, 0], eyes[:, 1, 1] - eyes[:, 0, 1]
+    angle = vector_angle(np.stack([eye_x, eye_y], -1), np.stack([eye_x, np.zeros_like(eye_x)], -1))
+    valid &= ~(angle > angle_th)
+    # 眼睛必须在鼻子上方
+    max_y = np.trunc(nose[:, 1])
+    min_eyes_y = eyes[:, :, 1].min(1)
+    valid &= (min_eyes_y < max_y) & (eyes[:, :, 1].max(1) < max_y)
+    min_y = np.trunc(np.maximum(0, max_y - (max_y - min_eyes_y) * 2))
+    max_x = np.trunc(np.where(ears[:, 0, 2] > 0, ears[:, 0, 0], eyes[:, :, 0].max(1)))
+    min_x = np.trunc(np.where(ears[:, 1, 2] > 0, ears[:, 1, 0], eyes[:, :, 0].min(1)))
+    # 按比例扩大
+    center_x, center_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+    half_w, half_h = (max_x - min_x) * scale_w / 2, (max_y - min_y) * scale_h / 2
+    new_min_x, new_max_x = np.maximum(0, center_x - half_w), np.minimum(img_w, center_x + half_w)
+    new_min_y, new_max_y = np.maximum(0, center_y - half_h), np.minimum(img_h, center_y + half_h)
+    valid &= (new_min_x <= new_max_x) & (new_min_y <= new_max_y)
+    boxes = np.trunc(np.stack([new_min_x, new_min_y, new_max_x, new_max_y], -1))
+    valid &= ~(boxes[:, 3] - boxes[:, 1] < min_height)
+    return _to_int(boxes, valid)
+
+
+def hand_rois(keypoints, sizes, threshold, angle_th=150, scale=0.8, min_scale=0.052):
+    """
+    手部区域，肩膀、胳膊肘、手腕都必须存在且手臂伸直（夹角不小于阈值）；沿小臂方向从手腕延长，边长取手臂较长一段的0.7倍与较短一段的较小值，
+    垂直于手的方向按比例缩小
+    Args:
+        keypoints: (N, 17, 3)，相对人体框的坐标
+        sizes: 人体框裁剪图像的尺寸(N, 2)，[[w, h], ...]
+        threshold: 关键点置信度阈值
+        angle_th: 手臂最小夹角
+        scale: 垂直于手的方向的缩小比例
+        min_scale: 区域边长与人体框较长边的最小比例
+    Returns: 左右手区域(N, 2, 4)，是否有效(N, 2)
+    """
+    img_w, img_h = _split_sizes(sizes)
+    img_w, img_h = img_w[:, None], img_h[:, None]
+    points, _ = select_points(keypoints, ARM_INDEX, threshold)
+    shoulder, elbow, wrist = points[:, 0:2], points[:, 2:4], points[:, 4:6]
+    valid = (shoulder[..., 2] != 0) & (elbow[..., 2] != 0) & (wrist[..., 2] != 0)
+    v1 = shoulder - elbow
+    v2 = wrist - elbow
+    valid &= ~(vector_angle(v1, v2) < angle_th)
+    length1, length2 = np.sqrt((v1 * v1).sum(-1)), np.sqrt((v2 * v2).sum(-1))
+    arm_length_min = np.minimum(length1, length2)
+    roi_length = np.minimum(np.maximum(length1, length2) * 0.7, arm_length_min)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hand = wrist + v2 / arm_length_min[..., None] * roi_length[..., None]
+    delta_x, delta_y = hand[..., 0] - wrist[..., 0], hand[..., 1] - wrist[..., 1]
+    roi_w = roi_h = np.trunc(roi_length)
+    wide = np.abs(np.trunc(delta_x)) > np.abs(np.trunc(delta_y))
+    roi_w, roi_h = np.where(wide, roi_w, roi_w * scale), np.where(wide, roi_h * scale, roi_h)
+    center_x = np.trunc(wrist[..., 0] + delta_x / 2)
+    center_y = np.trunc(wrist[..., 1] + delta_y / 2)
+    new_min_x = np.maximum(0, center_x - roi_w / 2)
+    new_min_y = np.maximum(0, center_y - roi_h / 2)
+    new_max_x = np.minimum(img_w - 1, new_min_x + roi_w - 1)
+    new_max_y = np.minimum(img_h - 1, new_min_y + roi_h - 1)
+    boxes = np.trunc(np.stack([new_min_x, new_min_y, new_max_x, new_max_y], -1))
+    # 人体框裁剪图像为空时无效
+    max_size = np.maximum(img_h, img_w)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid &= (max_size > 0) & ~(np.minimum(
+            (boxes[..., 3] - boxes[..., 1]) / max_size, (boxes[..., 2] - boxes[..., 0]) / max_size) < min_scale)
+    return _to_int(boxes, valid)
+
+
+def torso_rois(keypoints, sizes, threshold, expand_ratio=0.25):
+    """
+    躯干区域，鼻子、肩膀、胯部都必须存在且人体正面朝向；纵向为鼻子与肩膀的中点到胯部，横向为肩膀和胯部的外侧，再按比例扩大宽度
+    Args:
+        keypoints: (N, 17, 3)，相对人体框的坐标
+        sizes: 人体框裁剪图像的尺寸(N, 2)，[[w, h], ...]
+        threshold: 关键点置信度阈值
+        expand_ratio: 宽度两侧各扩大的比例
+    Returns: 躯干区域(N, 4)，是否有效(N,)
+    """
+    img_w, _ = _split_sizes(sizes)
+    points, low = select_points(keypoints, TORSO_INDEX, threshold)
+    nose, left_shoulder, right_shoulder, left_hip, right_hip = (points[:, i] for i in range(5))
+    valid = ~low.any(1) & ~(left_shoulder[:, 0] < right_shoulder[:, 0])
+    min_y = np.trunc((nose[:, 1] + np.minimum(left_shoulder[:, 1], right_shoulder[:, 1])) / 2)
+    min_x = np.trunc(np.minimum(right_shoulder[:, 0], right_hip[:, 0]))
+    max_x = np.trunc(np.maximum(left_shoulder[:, 0], left_hip[:, 0]))
+    max_y = np.trunc(np.minimum(left_hip[:, 1], right_hip[:, 1]))
+    expand_width = np.trunc((max_x - min_x) * expand_ratio)
+    boxes = np.stack([np.maximum(0, min_x - expand_width), min_y, np.minimum(img_w - 1, max_x + expand_width), max_y],
+                     -1)
+    return _to_int(boxes, valid)
+
+
+def foot_rois(keypoints, sizes, threshold, leg_angle_th=160, ground_angle_th=30, scale=0.8):
+    """
+    脚部区域，两侧胯部必须存在且人体正面朝向，胯、膝盖、脚踝都必须存在、腿伸直（夹角不小于阈值）且小腿与竖直方向的夹角不超过阈值；
+    以脚踝为中心（向下偏移1/4边长），边长为小腿长度按比例缩小
+    Args:
+        keypoints: (N, 17, 3)，相对人体框的坐标
+        sizes: 人体框裁剪图像的尺寸(N, 2)，[[w, h], ...]
+        threshold: 关键点置信度阈值
+        leg_angle_th: 腿部最小夹角
+        ground_angle_th: 小腿与竖直方向的最大夹角
+        scale: 边长与小腿长度的比例
+    Returns: 左右脚区域(N, 2, 4)，是否有效(N, 2)
+    """
+    img_w, img_h = _split_sizes(sizes)
+    img_w, img_h = img_w[:, None], img_h[:, None]
+    points, _ = select_points(keypoints, LEG_INDEX, threshold)
+    hip, knee, ankle = points[:, 0:2], points[:, 2:4], points[:, 4:6]
+    # 两侧胯部必须存在，胯部两点顺序决定人体朝向
+    person = (hip[:, 0, 2] != 0) & (hip[:, 1, 2] != 0) & ~(hip[:, 0, 0] < hip[:, 1, 0])
+    dis_hip = np.sqrt((hip[:, 1, 0] - hip[:, 0, 0]) ** 2 + (hip[:, 1, 1] - hip[:, 0, 1]) ** 2)
+    valid = person[:, None] & (hip[..., 2] != 0) & (knee[..., 2] != 0) & (ankle[..., 2] != 0)
+    v1 = hip[..., :2] - knee[..., :2]
+    v2 = ankle[..., :2] - knee[..., :2]
+    v3 = np.stack([np.zeros_like(v2[..., 0]), v2[..., 1]], -1)
+    thigh_length, calf_length = np.sqrt((v1 * v1).sum(-1)), np.sqrt((v2 * v2).sum(-1))
+    # 胯部两点距离、腿夹角、小腿与地面角度过滤
+    valid &= ~(dis_hip[:, None] < np.maximum(thigh_length, calf_length) / 3)
+    valid &= ~(vector_angle(v1, v2) < leg_angle_th) & ~(vector_angle(v2, v3) > ground_angle_th)
+    roi_length = calf_length * scale
+    center_x = np.trunc(ankle[..., 0])
+    center_y = np.minimum(img_h, np.trunc(ankle[..., 1] + roi_length / 4))
+    new_min_x = np.maximum(0, center_x - roi_length / 2)
+    new_min_y = np.maximum(0, center_y - roi_length / 2)
+    new_max_x = np.minimum(img_w - 1, new_min_x + roi_length - 1)
+    new_max_y = np.minimum(img_h - 1, new_min_y + roi_length - 1)
+    boxes = np.trunc(np.stack([new_min_x, new_min_y, new_max_x, new_max_y], -1))
+    return _to_int(boxes, valid)
+
+
+def largest_component_bbox(binary):
+    """
+    二值图像中最大的8连通区域的外接矩形
+    Args:
+        binary: 二值图像
+    Returns: [x1, y1, x2, y2]，右下角为闭区间 or None（没有前景）
+    """
+    if not binary.size:
+        return None
+    num_labels, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    if num_labels < 2:
+        return None
+    label = stats[1:, cv2.CC_STAT_AREA].argmax() + 1
+    x, y, w, h = stats[label, :4].tolist()
+    return [x, y, x + w - 1, y + h - 1]
+
+
+def seed_component_bboxes(mask, seeds, rois):
+    """
+    批量计算二值掩码中各种子点所在的4连通区域在对应ROI内的最大8连通区域的外接矩形，同一掩码只做一次连通域标记；
+    种子点在掩码外时使用整个掩码，种子点为背景时结果为None
+    Args:
+        mask: 二值掩码
+        seeds: 种子点列表，[(x, y), ...]
+        rois: 与种子点一一对应的ROI，[[x1, y1, x2, y2], ...]
+    Returns: 与种子点一一对应的外接矩形[x1, y1, x2, y2]（整个掩码中的坐标，右下角不超过ROI） or None
+    """
+    height, width = mask.shape[:2]
+    labels = None
+    bboxes = []
+    for (x, y), roi in zip(seeds, rois):
+        region = mask[roi[1]:roi[3], roi[0]:roi[2]]
+        if 0 <= x < width and 0 <= y < height:
+            if labels is None:
+                labels = cv2.connectedComponents(mask, connectivity=4)[1]
+            label = labels[y, x]
+            region = (labels[roi[1]:roi[3], roi[0]:roi[2]] == label).view(np.uint8) if label else region[:0]
+        bbox = largest_component_bbox(region)
+        if bbox is not None:
+            bbox = [bbox[0] + roi[0], bbox[1] + roi[1], min(roi[0] + bbox[2], roi[2]), min(roi[1] + bbox[3], roi[3])]
+        bboxes.append(bbox)
+    return bboxes
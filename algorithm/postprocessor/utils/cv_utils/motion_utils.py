@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+from .roi_utils import RoiMask
+
+
+class MotionGate:
+    """
+    运动门控，在缩小的灰度图上与最近一次放行的帧做帧差（与motion.py相同的模糊、差分、阈值化），
+    各ROI内变化像素的占比都低于阈值时判定为静止，本帧可跳过；距最近一次放行超过max_interval时强制放行，保证状态定期刷新
+    """
+
+    def __init__(self, width=160, diff=25, area_ratio=0.005, max_interval=10, ksize=5):
+        """
+        Args:
+            width: 缩小后的图像宽度
+            diff: 像素差分阈值
+            area_ratio: ROI内变化像素占比阈值，达到阈值即判定为变化
+            max_interval: 最大跳过时长，单位：秒
+            ksize: 高斯模糊核大小
+        """
+        self.width = width
+        self.diff = diff
+        self.area_ratio = area_ratio
+        self.max_interval = max_interval
+        self.ksize = ksize
+        self.reference = None
+        self.reference_time = None
+        # {多边形顶点: RoiMask}
+        self.masks = {}
+        # 统计
+        self.passed = 0
+        self.skipped = 0
+
+    def get_scale(self, shape):
+        """
+        缩放比例
+        Args:
+            shape: 原图尺寸
+        Returns: 缩放比例
+        """
+        return min(self.width / shape[1], 1)
+
+    def __get_mask(self, polygon, scale, shape):
+        key = tuple(map(tuple, polygon))
+        mask = self.masks.get(key)
+        if mask is None or (mask.height, mask.width) != shape[:2]:
+            points = np.round(np.asarray(polygon, dtype=np.float64) * scale).astype(np.int32)
+            mask = RoiMask(points, shape)
+            self.masks[key] = mask
+        return mask
+
+    def __is_changed(self, gray, polygons, scale):
+        binary = cv2.threshold(cv2.absdiff(self.reference, gray), self.diff, 255, cv2.THRESH_BINARY)[1]
+        if not polygons:
+            return cv2.countNonZero(binary) >= self.area_ratio * binary.size
+        for polygon in polygons:
+            mask = self.__get_mask(polygon, scale, binary.shape)
+            if cv2.countNonZero(mask.apply(binary)) >= self.area_ratio * max(mask.area, 1):
+                return True
+        return False
+
+    def check(self, gray, time, polygons=None, scale=1):
+        """
+        判断本帧是否需要处理，需要处理时更新参考帧
+        Args:
+            gray: 缩小后的灰度图
+            time: 帧时间戳
+            polygons: ROI多边形顶点列表，原图坐标，为空时按整帧判断
+            scale: gray相对原图的缩放比例
+        Returns: True：需要处理，False：静止，可跳过
+        """
+        if self.ksize:
+            gray = cv2.GaussianBlur(gray, (self.ksize, self.ksize), 0)
+        if self.reference is None or self.reference.shape != gray.shape \
+                or time - self.reference_time >= self.max_interval or self.__is_changed(gray, polygons, scale):
+            self.reference = gray
+            self.reference_time = time
+            self.passed += 1
+            return True
+        self.skipped += 1
+        return False
@@ -0,0 +1,192 @@
+import math
+
+import cv2
+import numpy as np
+
+from .geo_utils import is_point_in_polygon, is_points_in_polygon
+
+# 栅格取值：0：多边形外，1：多边形内，2：靠近边界，需精确判断
+OUTSIDE = 0
+INSIDE = 1
+AMBIGUOUS = 2
+# 顶点坐标的小数位数（cv2绘制时的shift）
+SHIFT = 4
+# 边界带宽度（格），需覆盖栅格化误差
+EDGE_THICKNESS = 4
+
+
+class PolygonRaster:
+    """
+    多边形栅格，只覆盖多边形的外接矩形，点是否在多边形内的判断变为一次数组索引，
+    靠近边界的格子回退到精确判断，结果与is_point_in_polygon一致
+    """
+
+    def __init__(self, polygon, max_size=1024):
+        """
+        Args:
+            polygon: 多边形的顶点
+            max_size: 栅格最大边长，多边形外接矩形超过该尺寸时降采样
+        """
+        self.polygon = polygon
+        points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        x_min, y_min = np.floor(points.min(axis=0))
+        x_max, y_max = np.ceil(points.max(axis=0))
+        # 每格对应的像素数
+        self.cell = max(1, math.ceil(max(x_max - x_min, y_max - y_min) / max_size))
+        # 四周各留一格，外接矩形边上的点也落在栅格内
+        self.x0 = x_min - self.cell
+        self.y0 = y_min - self.cell
+        self.width = int((x_max + self.cell - self.x0) // self.cell) + 1
+        self.height = int((y_max + self.cell - self.y0) // self.cell) + 1
+        self.raster = np.zeros((self.height, self.width), dtype=np.uint8)
+        # 格子中心对应整数坐标
+        grid = (points - [self.x0, self.y0]) / self.cell - 0.5
+        grid = np.round(grid * (1 << SHIFT)).astype(np.int32)
+        cv2.fillPoly(self.raster, [grid], INSIDE, lineType=cv2.LINE_8, shift=SHIFT)
+        cv2.polylines(self.raster, [grid], True, AMBIGUOUS, thickness=EDGE_THICKNESS, lineType=cv2.LINE_8,
+                      shift=SHIFT)
+
+    def contains(self, point):
+        """
+        判断点是否在多边形内
+        Args:
+            point: 点的坐标
+        Returns: True or False
+        """
+        x = math.floor((point[0] - self.x0) / self.cell)
+        y = math.floor((point[1] - self.y0) / self.cell)
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return False
+        value = self.raster[y, x]
+        if value == AMBIGUOUS:
+            return is_point_in_polygon(point, self.polygon)
+        return value == INSIDE
+
+    def contains_points(self, points):
+        """
+        批量判断点是否在多边形内
+        Args:
+            points: 点的坐标，(N, 2)
+        Returns: bool ndarray，(N,)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x = np.floor((points[:, 0] - self.x0) / self.cell).astype(np.int64)
+        y = np.floor((points[:, 1] - self.y0) / self.cell).astype(np.int64)
+        valid = (x >= 0) & (y >= 0) & (x < self.width) & (y < self.height)
+        value = np.full(len(points), OUTSIDE, dtype=np.uint8)
+        value[valid] = self.raster[y[valid], x[valid]]
+        result = value == INSIDE
+        ambiguous = value == AMBIGUOUS
+        if ambiguous.any():
+            result[ambiguous] = is_points_in_polygon(points[ambiguous], self.polygon)
+        return result
+
+
+class RoiMask:
+    """
+    ROI掩码，只保存外接矩形范围内的uint8掩码，
+    均值、差分和轮廓等统计只在外接矩形内计算，耗时和内存与ROI面积相关，与整帧面积无关
+    """
+
+    def __init__(self, points, shape, pad=1):
+        """
+        Args:
+            points: 多边形的顶点，整数坐标
+            shape: 图像尺寸
+            pad: 外接矩形向外扩展的像素数，保证掩码四周为0，轮廓查找结果与整帧一致
+        """
+        points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        self.height, self.width = shape[:2]
+        x, y, w, h = cv2.boundingRect(points)
+        self.x0 = min(max(x - pad, 0), self.width)
+        self.y0 = min(max(y - pad, 0), self.height)
+        self.x1 = min(max(x + w + pad, 0), self.width)
+        self.y1 = min(max(y + h + pad, 0), self.height)
+        # ROI完全在图像外时外接矩形为空，改用左上角1个像素的窗口，掩码全为0，各统计仍可正常计算
+        self.empty = self.x1 <= self.x0 or self.y1 <= self.y0
+        if self.empty:
+            self.x0, self.y0, self.x1, self.y1 = 0, 0, 1, 1
+        self.mask = np.zeros((self.y1 - self.y0, self.x1 - self.x0), dtype=np.uint8)
+        cv2.fillPoly(self.mask, [(points - [self.x0, self.y0]).astype(np.int32)], 255)
+        # 反转的掩码，首次使用时生成
+        self.inverse_mask = None
+        self.area = cv2.countNonZero(self.mask)
+        # 掩码恰好填满一个矩形时可以用积分图计算
+        self.rectangle = None
+        x, y, w, h = cv2.boundingRect(self.mask)
+        if self.area and self.area == w * h:
+            self.rectangle = (x + self.x0, y + self.y0, x + w + self.x0, y + h + self.y0)
+
+    def crop(self, image):
+        """
+        裁剪外接矩形
+        Args:
+            image: 整帧图像
+        Returns: 外接矩形范围内的图像
+        """
+        return image[self.y0:self.y1, self.x0:self.x1]
+
+    def apply(self, image):
+        """
+        裁剪外接矩形并应用掩码，等价于整帧与掩码按位与之后再裁剪
+        Args:
+            image: 整帧单通道图像
+        Returns: 外接矩形范围内的图像，ROI外为0
+        """
+        return cv2.bitwise_and(self.crop(image), self.mask)
+
+    def extract(self, image, reverse=False):
+        """
+        裁剪外接矩形并应用掩码，支持多通道图像，等价于整帧与掩码按位与之后再裁剪
+        Args:
+            image: 整帧图像
+            reverse: 是否反转掩码，True时ROI内为0
+        Returns: 外接矩形范围内的图像，ROI完全在图像外时为空图像
+        """
+        if self.empty:
+            return image[:0, :0]
+        crop = self.crop(image)
+        if not reverse:
+            return cv2.bitwise_and(crop, crop, mask=self.mask)
+        if self.inverse_mask is None:
+            self.inverse_mask = cv2.bitwise_not(self.mask)
+        return cv2.bitwise_and(crop, crop, mask=self.inverse_mask)
+
+    def sum(self, image, integral=None):
+        """
+        ROI内像素值之和，整数运算，结果精确
+        Args:
+            image: 整帧单通道图像
+            integral: 整帧积分图，cv2.integral，矩形ROI可直接查表
+        Returns: int
+        """
+        if self.rectangle is not None:
+            x0, y0, x1, y1 = self.rectangle
+            if integral is not None:
+                return int(integral[y1, x1]) - int(integral[y0, x1]) - int(integral[y1, x0]) + int(integral[y0, x0])
+            return int(image[y0:y1, x0:x1].sum(dtype=np.int64))
+        # 掩码外的像素置0后在外接矩形内求和，uint8求和以double累加，2^53以内结果精确
+        return int(cv2.sumElems(self.apply(image))[0])
+
+    def mean(self, image, integral=None):
+        """
+        ROI内像素均值，与np.mean(image[mask == 255])一致
+        Args:
+            image: 整帧单通道图像
+            integral: 整帧积分图
+        Returns: 均值，ROI为空时返回None
+        """
+        if not self.area:
+            return None
+        return self.sum(image, integral) / self.area
+
+    def find_contours(self, binary, mode=cv2.RETR_TREE, method=cv2.CHAIN_APPROX_SIMPLE):
+        """
+        在外接矩形范围内查找轮廓，坐标转换为整帧坐标
+        Args:
+            binary: apply之后得到的二值图像
+            mode: 轮廓检索模式
+            method: 轮廓近似方法
+        Returns: contours, hierarchy
+        """
+        return cv2.findContours(binary, mode, method, offset=(self.x0, self.y0))
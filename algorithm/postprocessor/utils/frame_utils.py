@@ -0,0 +1,264 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from logger import LOGGER
+from .image_utils import base64_to_opencv, bytes_to_base64, bytes_to_opencv, opencv_to_base64
+
+# 已挂载的共享内存/内存映射文件，引擎通常循环复用固定数量的帧槽，这里只保留最近使用的若干个
+MAX_ATTACHED = 64
+_attached = OrderedDict()
+
+
+def is_frame_handle(data):
+    """
+    判断是否为帧句柄（共享内存或内存映射文件描述符）
+    Args:
+        data: 图像数据
+    Returns: True or False
+    """
+    return isinstance(data, dict) and ('shm' in data or 'path' in data)
+
+
+def _attach(key, factory):
+    """
+    挂载共享内存或内存映射文件，已挂载的直接复用
+    Args:
+        key: 挂载键
+        factory: 挂载函数
+    Returns: 挂载对象
+    """
+    buffer = _attached.get(key)
+    if buffer is not None:
+        _attached.move_to_end(key)
+        return buffer
+    buffer = factory()
+    _attached[key] = buffer
+    while len(_attached) > MAX_ATTACHED:
+        # 仍被ndarray引用的缓冲区由GC回收，这里只解除缓存引用
+        _attached.popitem(last=False)
+    return buffer
+
+
+def _attach_shm(name):
+    # 按需导入，不使用共享内存帧句柄时不计入启动耗时
+    from multiprocessing import resource_tracker, shared_memory
+    shm = shared_memory.SharedMemory(name=name, create=False)
+    try:
+        # 共享内存由引擎创建和释放，避免本进程退出时被resource_tracker误删
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except:
+        pass
+    return shm
+
+
+def handle_to_opencv(handle: dict):
+    """
+    帧句柄转opencv，零拷贝，返回的ndarray直接引用共享内存
+    Args:
+        handle: 帧句柄，{'shm': 共享内存名称} 或 {'path': 内存映射文件路径}，以及 shape、dtype、offset
+    Returns: opencv ndarray or None
+    """
+    try:
+        shape = tuple(handle['shape'])
+        dtype = np.dtype(handle.get('dtype', 'uint8'))
+        offset = handle.get('offset', 0)
+        if 'shm' in handle:
+            shm = _attach(('shm', handle['shm']), lambda: _attach_shm(handle['shm']))
+            return np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        mm = _attach(('path', handle['path']), lambda: np.memmap(handle['path'], dtype=np.uint8, mode='r'))
+        count = int(np.prod(shape)) * dtype.itemsize
+        return mm[offset:offset + count].view(dtype).reshape(shape)
+    except:
+        LOGGER.exception('handle_to_opencv')
+        return None
+
+
+class Frame:
+    """
+    帧数据，统一封装base64 string、jpg字节（二进制消息中的memoryview）、帧句柄和opencv ndarray，首次访问时解码并缓存
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.__image = None
+
+    @property
+    def image(self):
+        """
+        opencv图像，BGR格式，只解码一次
+        Returns: opencv ndarray or None
+        """
+        if self.__image is None and self.data is not None:
+            if isinstance(self.data, np.ndarray):
+                self.__image = self.data
+            elif is_frame_handle(self.data):
+                self.__image = handle_to_opencv(self.data)
+            elif isinstance(self.data, (bytes, bytearray, memoryview)):
+                self.__image = bytes_to_opencv(self.data)
+            else:
+                self.__image = base64_to_opencv(self.data)
+        return self.__image
+
+    @property
+    def shape(self):
+        """
+        图像尺寸，帧句柄无需解码即可获取
+        Returns: shape or None
+        """
+        if self.__image is None and is_frame_handle(self.data):
+            return tuple(self.data['shape'])
+        image = self.image
+        return image.shape if image is not None else None
+
+    def to_base64(self):
+        """
+        转base64 string，仅在最终输出时使用
+        Returns: base64 string or None
+        """
+        if isinstance(self.data, str):
+            return self.data
+        if isinstance(self.data, (bytes, bytearray, memoryview)):
+            return bytes_to_base64(self.data)
+        image = self.image
+        return opencv_to_base64(image) if image is not None else None
+
+
+def _readonly(image):
+    """
+    返回只读视图，缓存的图像被多个算法共享，不允许原地修改
+    """
+    if image is None:
+        return None
+    image = image.view()
+    image.setflags(write=False)
+    return image
+
+
+class FrameCache:
+    """
+    帧派生图像缓存，按(source_id, time)缓存同一帧的解码图像、灰度图、模糊灰度图和缩放图，
+    同一视频源的所有算法共享，订阅该视频源的算法都处理完该帧后淘汰
+    """
+
+    def __init__(self, max_frames=8):
+        """
+        Args:
+            max_frames: 每个视频源最多缓存的帧数，兜底淘汰未被全部订阅者处理的帧
+        """
+        self.max_frames = max_frames
+        # {source_id: OrderedDict((time, {'images': {(name, variant, *params): ndarray}, 'frames': {name: Frame},
+        #                                 'pending': set})}
+        self.entries = {}
+        # {source_id: {subscriber, ...}}
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, source_id, subscriber):
+        """
+        订阅视频源，订阅之后生成的帧需要该订阅者处理完才会淘汰
+        Args:
+            source_id: 视频源id
+            subscriber: 订阅者，通常为算法名称
+        Returns: True or False
+        """
+        with self.lock:
+            self.subscribers.setdefault(source_id, set()).add(subscriber)
+        return True
+
+    def unsubscribe(self, source_id, subscriber):
+        """
+        取消订阅视频源
+        Args:
+            source_id: 视频源id
+            subscriber: 订阅者
+        Returns: True or False
+        """
+        with self.lock:
+            self.subscribers.get(source_id, set()).discard(subscriber)
+        return True
+
+    def __get_entry(self, source_id, time):
+        entries = self.entries.setdefault(source_id, OrderedDict())
+        entry = entries.get(time)
+        if entry is None:
+            entry = {
+                'images': {},
+                'frames': {},
+                'pending': set(self.subscribers.get(source_id, ()))
+            }
+            entries[time] = entry
+            while len(entries) > self.max_frames:
+                entries.popitem(last=False)
+        return entry
+
+    def __get_image(self, entry, name, data, variant, params):
+        key = (name, variant) + tuple(params)
+        if key in entry['images']:
+            return entry['images'][key]
+        if 'bgr' == variant:
+            frame = entry['frames'].get(name)
+            if frame is None:
+                frame = Frame(data)
+                entry['frames'][name] = frame
+            image = frame.image
+        elif 'gray' == variant:
+            image = self.__get_image(entry, name, data, 'bgr', ())
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image is not None else None
+        elif 'blur' == variant:
+            # params: (ksize,)
+            image = self.__get_image(entry, name, data, 'gray', ())
+            image = cv2.GaussianBlur(image, (params[0], params[0]), 0) if image is not None else None
+        elif 'resize' == variant:
+            # params: (源派生类型, 缩放比例)
+            image = self.__get_image(entry, name, data, params[0], ())
+            if image is not None:
+                image = cv2.resize(image, None, fx=params[1], fy=params[1], interpolation=cv2.INTER_AREA)
+        elif 'integral' == variant:
+            # 灰度积分图，int32，(h + 1, w + 1)
+            image = self.__get_image(entry, name, data, 'gray', ())
+            image = cv2.integral(image) if image is not None else None
+        else:
+            raise ValueError('Invalid variant: {}'.format(variant))
+        image = _readonly(image)
+        entry['images'][key] = image
+        return image
+
+    def get(self, source_id, time, name, data, variant='bgr', *params):
+        """
+        获取派生图像，同一帧的同一派生图像只计算一次
+        Args:
+            source_id: 视频源id
+            time: 帧时间戳
+            name: 图像名称，区分同一帧的不同图像，如绘制图像和推理图像
+            data: 图像数据，缓存未命中时使用，见Frame
+            variant: 派生类型，bgr：解码图像，gray：灰度图，blur：高斯模糊灰度图，params为(ksize,)，
+                resize：缩放图，params为(源派生类型, 缩放比例)，integral：灰度积分图
+            *params: 派生参数
+        Returns: 只读opencv ndarray or None
+        """
+        with self.lock:
+            entry = self.__get_entry(source_id, time)
+            return self.__get_image(entry, name, data, variant, params)
+
+    def release(self, source_id, time, subscriber):
+        """
+        订阅者处理完该帧，同时视为处理完更早的帧，全部订阅者都处理完之后淘汰
+        Args:
+            source_id: 视频源id
+            time: 帧时间戳
+            subscriber: 订阅者
+        Returns: True or False
+        """
+        with self.lock:
+            entries = self.entries.get(source_id)
+            if not entries:
+                return False
+            for time_ in [time_ for time_ in entries.keys() if time_ <= time]:
+                pending = entries[time_]['pending']
+                pending.discard(subscriber)
+                if not pending:
+                    del entries[time_]
+        return True
@@ -1,12 +1,18 @@
+from __future__ import annotations
+
 import base64
 from io import BytesIO
+from typing import TYPE_CHECKING
 
 import cv2
 import numpy as np
-from PIL import Image
 
 from logger import LOGGER
 
+if TYPE_CHECKING:
+    # PIL只在Pillow相关函数中使用，按需导入，不计入启动耗时
+    from PIL import Image
+
 
 def bytes_to_base64(data: bytes):
     """
@@ -74,29 +80,33 @@ def base64_to_opencv(image: str):
         return None
 
 
-def opencv_to_bytes(image: np.ndarray):
+def opencv_to_bytes(image: np.ndarray, quality=None):
     """
     opencv转bytes
     Args:
         image: opencv ndarray
+        quality: jpg质量，0~100，None为opencv默认值（95）
     Returns: bytes or None
     """
     try:
-        return cv2.imencode('.jpg', image)[1].tobytes()
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)] if quality is not None else []
+        return cv2.imencode('.jpg', image, params)[1].tobytes()
     except:
         LOGGER.exception('opencv_to_bytes')
         return None
 
 
-def opencv_to_base64(image: np.ndarray):
+def opencv_to_base64(image: np.ndarray, quality=None):
     """
     opencv转base64 string
     Args:
         image: opencv ndarray
+        quality: jpg质量，0~100，None为opencv默认值（95）
     Returns: base64 string or None
     """
     try:
-        return bytes_to_base64(cv2.imencode('.jpg', image)[1].tobytes())
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)] if quality is not None else []
+        return bytes_to_base64(cv2.imencode('.jpg', image, params)[1].tobytes())
     except:
         LOGGER.exception('opencv_to_base64')
         return None
@@ -111,6 +121,7 @@ def bytes_to_pil(image: bytes):
     Returns: PIL Image or None
     """
     try:
+        from PIL import Image
         return Image.open(BytesIO(image))
     except:
         LOGGER.exception('bytes_to_pil')
@@ -125,6 +136,7 @@ def opencv_to_pil(image: np.ndarray):
     Returns: PIL Image or None
     """
     try:
+        from PIL import Image
         return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
     except:
         LOGGER.exception('opencv_to_pil')
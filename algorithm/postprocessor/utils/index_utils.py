@@ -0,0 +1,220 @@
+import os
+
+import numpy as np
+
+from . import json_utils
+
+# int8量化的缩放系数，归一化后的向量各分量在[-1, 1]内
+INT8_SCALE = 127.0
+# 量化底库分块反量化的行数，控制临时内存
+CHUNK_ROWS = 4096
+
+
+class GalleryIndex:
+    """
+    特征底库，向量归一化后按行存放在连续的float32（可选int8量化）矩阵中，相似度为余弦相似度；
+    一帧内所有目标的特征一次矩阵乘法完成检索，支持top-k；增删为原地修改，删除时用最后一行填补空位，无需重建；
+    可持久化为内存映射文件，加载时不读入全部向量，持久化之后的增删同时写入向量文件和元数据文件
+    """
+
+    def __init__(self, dim, group_id=None, group_name=None, quantize=False, capacity=1024):
+        """
+        Args:
+            dim: 特征维度
+            group_id: 底库id
+            group_name: 底库名称
+            quantize: 是否int8量化，内存为float32的1/4，相似度误差约1e-2
+            capacity: 初始容量，不足时翻倍扩容
+        """
+        self.dim = dim
+        self.group_id = group_id
+        self.group_name = group_name
+        self.quantize = quantize
+        self.vectors = np.zeros((max(capacity, 1), dim), dtype=np.int8 if quantize else np.float32)
+        self.size = 0
+        # 与矩阵行对应的id
+        self.ids = []
+        # {id_: 行号}
+        self.rows = {}
+        # {id_: info}
+        self.infos = {}
+        self.path = None
+
+    def __len__(self):
+        return self.size
+
+    def __encode(self, features):
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.dim)
+        norm = np.linalg.norm(features, axis=1, keepdims=True)
+        features = features / np.maximum(norm, 1e-12)
+        if self.quantize:
+            return np.round(features * INT8_SCALE).astype(np.int8)
+        return features
+
+    def __grow(self, capacity):
+        vectors = np.zeros((capacity, self.dim), dtype=self.vectors.dtype)
+        vectors[:self.size] = self.vectors[:self.size]
+        if self.path is not None:
+            # 内存映射文件扩容需要重新创建文件
+            del self.vectors
+            self.vectors = np.lib.format.open_memmap(self.path + '.npy', mode='w+', dtype=vectors.dtype,
+                                                     shape=vectors.shape)
+            self.vectors[:] = vectors
+        else:
+            self.vectors = vectors
+        return True
+
+    def add(self, id_, feature, info=None):
+        """
+        添加或更新一个特征
+        Args:
+            id_: 特征id
+            feature: 特征向量
+            info: 特征信息，query时返回
+        Returns: True or False
+        """
+        row = self.rows.get(id_)
+        if row is None:
+            if self.size == len(self.vectors):
+                self.__grow(len(self.vectors) * 2)
+            row = self.size
+            self.size += 1
+            self.ids.append(id_)
+            self.rows[id_] = row
+        self.vectors[row] = self.__encode(feature)[0]
+        self.infos[id_] = info
+        if self.path is not None:
+            return self.__sync()
+        return True
+
+    def remove(self, id_):
+        """
+        删除一个特征，用最后一行填补空位
+        Args:
+            id_: 特征id
+        Returns: True or False
+        """
+        row = self.rows.pop(id_, None)
+        if row is None:
+            return False
+        last = self.size - 1
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.ids[row] = self.ids[last]
+            self.rows[self.ids[row]] = row
+        self.ids.pop()
+        self.size -= 1
+        self.infos.pop(id_, None)
+        if self.path is not None:
+            return self.__sync()
+        return True
+
+    def query(self, id_):
+        """
+        查询特征信息
+        Args:
+            id_: 特征id
+        Returns: info or None
+        """
+        return self.infos.get(id_)
+
+    def __scores(self, features):
+        features = self.__encode(features).astype(np.float32)
+        if not self.quantize:
+            return features @ self.vectors[:self.size].T
+        scores = np.empty((len(features), self.size), dtype=np.float32)
+        for start in range(0, self.size, CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, self.size)
+            scores[:, start:end] = features @ self.vectors[start:end].astype(np.float32).T
+        return scores / (INT8_SCALE * INT8_SCALE)
+
+    def search_batch(self, features, similarity=0, k=1):
+        """
+        批量检索
+        Args:
+            features: 特征向量，(N, dim)
+            similarity: 相似度阈值，低于阈值的结果不返回
+            k: 每个特征返回的最大结果数
+        Returns: [[(id_, score), ...], ...]，每个特征的结果按相似度从高到低排列
+        """
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.dim)
+        if not len(features) or not self.size:
+            return [[] for _ in range(len(features))]
+        scores = self.__scores(features)
+        k = min(k, self.size)
+        if k < self.size:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(self.size), (len(features), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1).tolist()
+        top_scores = np.take_along_axis(top_scores, order, axis=1).tolist()
+        return [[(self.ids[row], score) for row, score in zip(rows, scores_) if score >= similarity]
+                for rows, scores_ in zip(top, top_scores)]
+
+    def search(self, feature, similarity=0):
+        """
+        检索单个特征
+        Args:
+            feature: 特征向量
+            similarity: 相似度阈值
+        Returns: (id_, score)，未命中时为(None, None)
+        """
+        result = self.search_batch(feature, similarity)[0]
+        return result[0] if result else (None, None)
+
+    def save(self, path):
+        """
+        持久化为内存映射文件，向量保存为path.npy，id和特征信息保存为path.json，之后的增删直接写入文件
+        Args:
+            path: 文件路径，不含扩展名
+        Returns: True or False
+        """
+        if self.path != path:
+            vectors = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=self.vectors.dtype,
+                                                shape=self.vectors.shape)
+            vectors[:self.size] = self.vectors[:self.size]
+            self.vectors = vectors
+            self.path = path
+        return self.__sync()
+
+    def __sync(self):
+        """
+        将向量写入内存映射文件，并重写元数据文件，使两者一致
+        Returns: True or False
+        """
+        self.vectors.flush()
+        meta = {
+            'dim': self.dim,
+            'group_id': self.group_id,
+            'group_name': self.group_name,
+            'quantize': self.quantize,
+            'size': self.size,
+            # 与矩阵行对应，保留id的类型
+            'items': [[id_, self.infos.get(id_)] for id_ in self.ids]
+        }
+        # 先写临时文件再替换，避免写入中断导致元数据损坏
+        if not json_utils.dump(meta, self.path + '.json.tmp'):
+            return False
+        os.replace(self.path + '.json.tmp', self.path + '.json')
+        return True
+
+    @classmethod
+    def load(cls, path):
+        """
+        从内存映射文件加载，向量按需换入内存
+        Args:
+            path: 文件路径，不含扩展名
+        Returns: GalleryIndex
+        """
+        meta = json_utils.load(path + '.json')
+        index = cls(meta['dim'], meta['group_id'], meta['group_name'], meta['quantize'], capacity=1)
+        index.vectors = np.load(path + '.npy', mmap_mode='r+')
+        index.path = path
+        index.size = meta['size']
+        for row, (id_, info) in enumerate(meta['items']):
+            index.ids.append(id_)
+            index.rows[id_] = row
+            index.infos[id_] = info
+        return index
@@ -0,0 +1,102 @@
+import json
+import struct
+
+import numpy as np
+
+# 二进制消息格式：MAGIC(4) + 版本(1) + 保留(3) + 头部长度(uint32, 小端) + 头部（json） + 填充 + 二进制段...
+# 头部为消息本身，bytes和ndarray替换为对二进制段的引用，二进制段按8字节对齐，解码时直接引用消息缓冲区
+MAGIC = b'EAIM'
+VERSION = 1
+ALIGNMENT = 8
+_PREFIX = struct.Struct('<4sB3xI')
+# 二进制段引用的键
+BUFFER_KEY = '__buffer__'
+NDARRAY_KEY = '__ndarray__'
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def is_binary(data):
+    """
+    判断是否为二进制格式的消息
+    Args:
+        data: 消息，bytes、memoryview或str
+    Returns: True or False
+    """
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def dumps(message):
+    """
+    消息编码为二进制格式，bytes（如jpg字节）和ndarray不经过base64和json编码，原样写入二进制段
+    Args:
+        message: 消息，dict，可嵌套list和dict
+    Returns: bytes
+    """
+    buffers = []
+
+    def replace(value):
+        if isinstance(value, dict):
+            return {key: replace(value_) for key, value_ in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [replace(value_) for value_ in value]
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            buffers.append(memoryview(value).cast('B'))
+            return {BUFFER_KEY: len(buffers) - 1}
+        if isinstance(value, np.ndarray):
+            array = np.ascontiguousarray(value)
+            buffers.append(memoryview(array.reshape(-1).view(np.uint8)))
+            return {NDARRAY_KEY: len(buffers) - 1, 'shape': list(array.shape), 'dtype': array.dtype.str}
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    header = replace(message)
+    offsets, offset = [], 0
+    for buffer in buffers:
+        offsets.append([offset, buffer.nbytes])
+        offset += buffer.nbytes + _padding(buffer.nbytes)
+    header = json.dumps({'buffers': offsets, 'message': header}, ensure_ascii=False,
+                        separators=(',', ':')).encode('utf-8')
+    header += b' ' * _padding(_PREFIX.size + len(header))
+    parts = [_PREFIX.pack(MAGIC, VERSION, len(header)), header]
+    for buffer in buffers:
+        parts.append(buffer)
+        parts.append(b'\0' * _padding(buffer.nbytes))
+    return b''.join(parts)
+
+
+def loads(data):
+    """
+    消息解码，二进制格式的二进制段零拷贝解码为memoryview或只读ndarray，引用data的内存；
+    其余数据按json解码，兼容旧的json消息（base64图像保持为str）
+    Args:
+        data: 消息，bytes、memoryview或str
+    Returns: dict
+    """
+    if not is_binary(data):
+        return json.loads(data)
+    view = memoryview(data).cast('B')
+    magic, version, size = _PREFIX.unpack_from(view)
+    if version > VERSION:
+        raise ValueError('Unsupported message version: {}'.format(version))
+    start = _PREFIX.size + size
+    header = json.loads(bytes(view[_PREFIX.size:start]).decode('utf-8'))
+    buffers = [view[start + offset:start + offset + length] for offset, length in header['buffers']]
+
+    def restore(value):
+        if isinstance(value, dict):
+            if BUFFER_KEY in value:
+                return buffers[value[BUFFER_KEY]].toreadonly()
+            if NDARRAY_KEY in value:
+                array = np.frombuffer(buffers[value[NDARRAY_KEY]], np.dtype(value['dtype'])).reshape(value['shape'])
+                array.setflags(write=False)
+                return array
+            return {key: restore(value_) for key, value_ in value.items()}
+        if isinstance(value, list):
+            return [restore(value_) for value_ in value]
+        return value
+
+    return restore(header['message'])
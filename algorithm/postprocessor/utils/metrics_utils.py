@@ -0,0 +1,310 @@
+import atexit
+import bisect
+import os
+import threading
+import time
+
+from logger import LOGGER
+from . import json_utils
+
+# 耗时直方图的桶上界，单位：秒，50us到10s按约2倍递增
+TIME_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                5, 10)
+# 数量直方图的桶上界
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+# 当前进程在后处理进程池中的序号，None表示不是工作进程
+_worker_index = None
+
+
+def set_worker_index(index):
+    """
+    设置当前进程在后处理进程池中的序号，由工作进程在处理任何帧之前调用；
+    之后启动的定期写入和HTTP接口按序号区分文件和端口，避免多个工作进程写同一个文件、绑定同一个端口
+    Args:
+        index: 工作进程序号，从0开始
+    """
+    global _worker_index
+    _worker_index = index
+
+
+class Histogram:
+    """
+    固定桶直方图，记录一次为一次二分查找和几次加法
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        """
+        Args:
+            buckets: 桶上界，升序，最后一个桶之外另有一个溢出桶
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        """
+        记录一个值
+        Args:
+            value: 值
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        估计分位数，返回所在桶的上界，落在溢出桶时返回最大值
+        Args:
+            q: 分位，0~1
+        Returns: 分位数
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= rank and count:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+        }
+
+
+class MetricsRegistry:
+    """
+    后处理指标，按(source_id, alg_name)聚合在内存中的计数器和直方图；
+    可定期写入json文件，或通过HTTP拉取（/metrics为Prometheus文本格式，/metrics.json为json）
+    """
+
+    def __init__(self, enabled=True, dump_path=None, dump_interval=60, port=None, host='0.0.0.0'):
+        """
+        Args:
+            enabled: 是否启用，未启用时记录为空操作
+            dump_path: 定期写入的json文件路径，None表示不写入
+            dump_interval: 写入周期，单位：秒
+            port: HTTP端口，None表示不启动
+            host: HTTP监听地址
+        """
+        self.enabled = enabled
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.port = port
+        self.host = host
+        # {(source_id, alg_name): {name: Histogram}}
+        self.histograms = {}
+        # {(source_id, alg_name): {name: value}}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.started = False
+        self.server = None
+
+    def __start(self):
+        if _worker_index is not None:
+            # 工作进程：文件名加.worker序号后缀，端口为配置端口 + 序号 + 1，配置端口留给主进程
+            if self.dump_path:
+                root, ext = os.path.splitext(self.dump_path)
+                self.dump_path = '{}.worker{}{}'.format(root, _worker_index, ext)
+            if self.port is not None:
+                self.port += _worker_index + 1
+        if self.dump_path:
+            threading.Thread(target=self.__run, name='postprocess_metrics_dump', daemon=True).start()
+            atexit.register(self.close)
+            LOGGER.info('Start postprocess metrics dump thread, path={}, interval={}'.format(
+                self.dump_path, self.dump_interval))
+        if self.port is not None:
+            self.serve(self.port, self.host)
+        return True
+
+    def __run(self):
+        while not self.stop_event.wait(self.dump_interval):
+            try:
+                self.dump(self.dump_path)
+            except:
+                LOGGER.exception('__run')
+
+    def observe(self, source_id, alg_name, name, value, buckets=TIME_BUCKETS):
+        """
+        记录直方图
+        Args:
+            source_id: 视频源id
+            alg_name: 算法名称
+            name: 指标名称
+            value: 值，耗时单位：秒
+            buckets: 首次记录时使用的桶上界
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            histograms = self.histograms.get((source_id, alg_name))
+            if histograms is None:
+                histograms = self.histograms[(source_id, alg_name)] = {}
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+            start, self.started = not self.started, True
+        if start:
+            self.__start()
+
+    def inc(self, source_id, alg_name, name, value=1):
+        """
+        计数器累加
+        Args:
+            source_id: 视频源id
+            alg_name: 算法名称
+            name: 指标名称
+            value: 增量
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            counters = self.counters.get((source_id, alg_name))
+            if counters is None:
+                counters = self.counters[(source_id, alg_name)] = {}
+            counters[name] = counters.get(name, 0) + value
+
+    def remove(self, source_id, alg_name=None):
+        """
+        删除视频源（或视频源的某个算法）的指标
+        Args:
+            source_id: 视频源id
+            alg_name: 算法名称，None表示该视频源的全部算法
+        Returns: True or False
+        """
+        with self.lock:
+            for metrics in (self.histograms, self.counters):
+                for key in [key for key in metrics if key[0] == source_id and alg_name in (None, key[1])]:
+                    del metrics[key]
+        return True
+
+    def snapshot(self):
+        """
+        指标快照
+        Returns: [{'source_id', 'alg_name', 'counters': {name: value}, 'histograms': {name: {count, sum, avg, max,
+            p50, p99}}}]，按耗时总和从高到低排列
+        """
+        with self.lock:
+            keys = set(self.histograms) | set(self.counters)
+            snapshot = [{
+                'source_id': source_id,
+                'alg_name': alg_name,
+                'counters': dict(self.counters.get((source_id, alg_name), {})),
+                'histograms': {name: histogram.to_dict()
+                               for name, histogram in self.histograms.get((source_id, alg_name), {}).items()}
+            } for source_id, alg_name in keys]
+        snapshot.sort(key=lambda item: item['histograms'].get('total', {}).get('sum', 0), reverse=True)
+        return snapshot
+
+    def render(self):
+        """
+        Prometheus文本格式
+        Returns: str
+        """
+        lines = []
+        with self.lock:
+            for (source_id, alg_name), counters in self.counters.items():
+                for name, value in counters.items():
+                    lines.append('postprocess_{}_total{{source_id="{}",alg_name="{}"}} {}'.format(
+                        name, source_id, alg_name, value))
+            for (source_id, alg_name), histograms in self.histograms.items():
+                for name, histogram in histograms.items():
+                    stage, _, model = name.partition(':')
+                    labels = 'source_id="{}",alg_name="{}"'.format(source_id, alg_name)
+                    if model:
+                        labels += ',model="{}"'.format(model)
+                    total = 0
+                    for bucket, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        total += count
+                        lines.append('postprocess_{}_bucket{{{},le="{}"}} {}'.format(stage, labels, bucket, total))
+                    lines.append('postprocess_{}_sum{{{}}} {}'.format(stage, labels, histogram.sum))
+                    lines.append('postprocess_{}_count{{{}}} {}'.format(stage, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        写入json文件，先写临时文件再替换
+        Args:
+            path: 文件路径
+        Returns: True or False
+        """
+        try:
+            data = {'time': time.time(), 'metrics': self.snapshot()}
+            if not json_utils.dump(data, path + '.tmp'):
+                return False
+            os.replace(path + '.tmp', path)
+            return True
+        except:
+            LOGGER.exception('dump')
+        return False
+
+    def serve(self, port, host='0.0.0.0'):
+        """
+        启动HTTP拉取接口，/metrics为Prometheus文本格式，/metrics.json为json
+        Args:
+            port: 端口
+            host: 监听地址
+        Returns: True or False
+        """
+        if self.server is not None:
+            return True
+        # 按需导入，未启用HTTP接口时不计入启动耗时
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if '/metrics' == self.path:
+                    body, content_type = registry.render(), 'text/plain; version=0.0.4'
+                elif '/metrics.json' == self.path:
+                    body, content_type = json_utils.dumps(registry.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format_, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((host, port), Handler)
+        except:
+            LOGGER.exception('serve')
+            return False
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='postprocess_metrics_http', daemon=True).start()
+        LOGGER.info('Start postprocess metrics server, host={}, port={}'.format(host, port))
+        return True
+
+    def close(self):
+        """
+        停止定期写入和HTTP接口，写入最后一次指标
+        Returns: True or False
+        """
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.dump_path:
+            return self.dump(self.dump_path)
+        return True
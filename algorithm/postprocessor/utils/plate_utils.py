@@ -0,0 +1,93 @@
+import collections
+
+# 车牌类型对应的车牌号长度
+PLATE_LENGTHS = {
+    '蓝牌': 7,
+    '黄牌': 7,
+    '绿牌': 8
+}
+
+
+def is_valid_plate(plate_code, plate_type):
+    """
+    判断车牌号长度与车牌类型是否匹配，未知类型不做限制
+    Args:
+        plate_code: 车牌号
+        plate_type: 车牌类型
+    Returns: True or False
+    """
+    length = PLATE_LENGTHS.get(plate_type)
+    return length is None or len(plate_code) == length
+
+
+class PlateVoter:
+    """
+    同一目标多次车牌识别结果的逐字符投票，按(车牌类型, 长度)分组，每个位置按字符置信度累加权重，
+    取读数最多的分组各位置权重最高的字符；识别次数和各位置的最低得票占比都达到阈值后视为稳定，不再识别
+    """
+
+    def __init__(self, min_reads=3, min_ratio=0.6, max_requests=10):
+        """
+        Args:
+            min_reads: 稳定所需的最少识别次数
+            min_ratio: 稳定所需的各位置最低得票占比
+            max_requests: 最多请求识别的次数，达到后即使不稳定也不再识别
+        """
+        self.min_reads = min_reads
+        self.min_ratio = min_ratio
+        self.max_requests = max_requests
+        # {(plate_type, length): [读数, [Counter(字符: 权重), ...]]}
+        self.groups = {}
+        self.reads = 0
+        self.requests = 0
+        self.plate = None
+
+    def add(self, plate_code, plate_type, confs=None):
+        """
+        加入一次识别结果，车牌号为空或长度与车牌类型不匹配的结果不参与投票
+        Args:
+            plate_code: 车牌号
+            plate_type: 车牌类型
+            confs: 各字符的置信度，None表示权重均为1
+        Returns: 投票结果，见result
+        """
+        if not plate_code or not is_valid_plate(plate_code, plate_type):
+            return self.result()
+        group = self.groups.get((plate_type, len(plate_code)))
+        if group is None:
+            group = self.groups[(plate_type, len(plate_code))] = [0, [collections.Counter() for _ in plate_code]]
+        group[0] += 1
+        for i, char in enumerate(plate_code):
+            group[1][i][char] += confs[i] if confs is not None and i < len(confs) else 1
+        self.reads += 1
+        self.plate = None
+        return self.result()
+
+    def result(self):
+        """
+        投票结果
+        Returns: (车牌号, 车牌类型, 各位置最低得票占比) or None
+        """
+        if self.plate is None and self.groups:
+            (plate_type, _), (_, counters) = max(self.groups.items(), key=lambda item: item[1][0])
+            chars = []
+            ratio = 1
+            for counter in counters:
+                char, weight = counter.most_common(1)[0]
+                chars.append(char)
+                total = sum(counter.values())
+                ratio = min(ratio, weight / total if total else 0)
+            self.plate = (''.join(chars), plate_type, ratio)
+        return self.plate
+
+    @property
+    def stable(self):
+        plate = self.result()
+        return plate is not None and self.reads >= self.min_reads and plate[2] >= self.min_ratio
+
+    def need_read(self):
+        """
+        是否需要再次识别
+        Returns: True or False
+        """
+        return not self.stable and self.requests < self.max_requests
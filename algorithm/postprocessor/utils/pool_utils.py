@@ -0,0 +1,315 @@
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from logger import LOGGER
+from .metrics_utils import set_worker_index
+from .registry_utils import PostprocessorRegistry
+
+
+def _worker_main(conn, package, index):
+    """
+    工作进程入口，按(source_id, alg_name)持有后处理实例，实例状态（跟踪、时间窗口等）只在本进程内
+    Args:
+        conn: 与调度线程通信的管道
+        package: 后处理模块所在的包
+        index: 工作进程序号，用于区分各进程的指标文件和端口
+    """
+    set_worker_index(index)
+    registry = PostprocessorRegistry(package)
+    postprocessors = {}
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        if 'release' == task[0]:
+            source_id = task[1]
+            for key in [key for key in postprocessors if key[0] == source_id]:
+                del postprocessors[key]
+            conn.send(None)
+            continue
+        _, source_id, alg_name, args, draw_image = task
+        status, result = False, None
+        start = time.perf_counter()
+        try:
+            postprocessor = postprocessors.get((source_id, alg_name))
+            if postprocessor is None:
+                postprocessor = registry.create(source_id, alg_name)
+                postprocessors[(source_id, alg_name)] = postprocessor
+            status, result, draw_image = postprocessor.postprocess(args, draw_image)
+        except:
+            LOGGER.exception('_worker_main')
+            LOGGER.error('Postprocess failed in worker, source_id={}, alg_name={}'.format(source_id, alg_name))
+        conn.send((status, result, draw_image, time.perf_counter() - start))
+
+
+class PostprocessorPool:
+    """
+    后处理进程池，视频源按亲和性固定分配到工作进程，同一视频源的后处理实例始终在同一进程内，状态无需跨进程同步；
+    每个(source_id, alg_name)一个有界队列，队列满时丢弃最旧的帧；每个工作进程同一时刻只有一帧在处理，
+    积压留在调度侧的队列中，由调度线程在各队列之间轮转发送，保证同一视频源内的帧顺序
+    """
+
+    def __init__(self, workers=None, queue_size=2, callback=None, package='postprocessor', latency_window=256):
+        """
+        Args:
+            workers: 工作进程数，默认为CPU核数
+            queue_size: 每个(source_id, alg_name)队列的最大长度
+            callback: 结果回调，callback(source_id, alg_name, status, result, draw_image)，在调度线程中调用，
+                为None时结果放入结果队列，通过get获取
+            package: 后处理模块所在的包，工作进程通过package.alg_name导入后处理模块
+            latency_window: 延迟统计的滑动窗口大小
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.callback = callback
+        self.package = package
+        self.latency_window = latency_window
+        # 工作进程使用spawn启动，不继承父进程的线程和锁
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.results = queue.Queue()
+        # {source_id: worker_index}
+        self.affinity = {}
+        self.pool = []
+        self.stopped = False
+
+    def __start_process(self, worker):
+        conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=_worker_main, args=(child_conn, self.package, worker['index']),
+                                       name='postprocessor_worker_{}'.format(worker['index']), daemon=True)
+        process.start()
+        child_conn.close()
+        worker['conn'] = conn
+        worker['process'] = process
+        return True
+
+    def __stop_process(self, worker, timeout=None):
+        try:
+            worker['conn'].send(None)
+        except:
+            pass
+        worker['process'].join(timeout)
+        if worker['process'].is_alive():
+            worker['process'].terminate()
+            worker['process'].join()
+        worker['conn'].close()
+        return True
+
+    def start(self):
+        """
+        启动工作进程和调度线程
+        Returns: True or False
+        """
+        if self.pool:
+            return True
+        for index in range(self.workers):
+            worker = {
+                'index': index,
+                'cond': threading.Condition(self.lock),
+                # {(source_id, alg_name): deque((submit_time, args, draw_image))}
+                'queues': {},
+                # 有待处理帧的队列，轮转发送
+                'ready': collections.deque(),
+                # 控制消息，优先发送
+                'control': collections.deque(),
+                'sources': set(),
+                'busy': False,
+                'submitted': 0,
+                'processed': 0,
+                'dropped': 0,
+                'restarts': 0,
+                'latency': collections.deque(maxlen=self.latency_window),
+                'process_time': collections.deque(maxlen=self.latency_window)
+            }
+            self.__start_process(worker)
+            worker['thread'] = threading.Thread(target=self.__run, args=(worker,),
+                                                name='postprocessor_dispatch_{}'.format(index), daemon=True)
+            self.pool.append(worker)
+        for worker in self.pool:
+            worker['thread'].start()
+        LOGGER.info('Start postprocessor pool, workers={}, queue_size={}'.format(self.workers, self.queue_size))
+        return True
+
+    def __assign(self, source_id):
+        index = self.affinity.get(source_id)
+        if index is None:
+            # 新视频源分配给视频源最少的工作进程，之后不再迁移
+            index = min(range(len(self.pool)), key=lambda i: len(self.pool[i]['sources']))
+            self.affinity[source_id] = index
+            self.pool[index]['sources'].add(source_id)
+        return self.pool[index]
+
+    def submit(self, source_id, alg_name, args, draw_image):
+        """
+        提交一帧后处理任务
+        Args:
+            source_id: 视频源id
+            alg_name: 算法名称
+            args: 后处理参数，见Postprocessor.postprocess
+            draw_image: 用于绘制的图像数据，跨进程传递，建议使用帧句柄
+        Returns: True：已入队，False：队列已满，丢弃了该队列中最旧的帧
+        """
+        with self.lock:
+            worker = self.__assign(source_id)
+            key = (source_id, alg_name)
+            queue_ = worker['queues'].get(key)
+            if queue_ is None:
+                queue_ = collections.deque(maxlen=self.queue_size)
+                worker['queues'][key] = queue_
+            dropped = len(queue_) == queue_.maxlen
+            if dropped:
+                worker['dropped'] += 1
+            elif not queue_:
+                worker['ready'].append(key)
+            queue_.append((time.perf_counter(), args, draw_image))
+            worker['submitted'] += 1
+            worker['cond'].notify()
+        return not dropped
+
+    def remove_source(self, source_id):
+        """
+        移除视频源，丢弃其待处理的帧并释放工作进程中的后处理实例
+        Args:
+            source_id: 视频源id
+        Returns: True or False
+        """
+        with self.lock:
+            index = self.affinity.pop(source_id, None)
+            if index is None:
+                return False
+            worker = self.pool[index]
+            worker['sources'].discard(source_id)
+            for key in [key for key in worker['queues'] if key[0] == source_id]:
+                del worker['queues'][key]
+            worker['ready'] = collections.deque(key for key in worker['ready'] if key[0] != source_id)
+            worker['control'].append(('release', source_id))
+            worker['cond'].notify()
+        return True
+
+    def __next_task(self, worker):
+        if worker['control']:
+            return None, None, worker['control'].popleft()
+        key = worker['ready'].popleft()
+        queue_ = worker['queues'][key]
+        submit_time, args, draw_image = queue_.popleft()
+        if queue_:
+            worker['ready'].append(key)
+        return key, submit_time, ('process', key[0], key[1], args, draw_image)
+
+    def __deliver(self, key, status, result, draw_image):
+        if self.callback is None:
+            self.results.put((key[0], key[1], status, result, draw_image))
+            return True
+        try:
+            self.callback(key[0], key[1], status, result, draw_image)
+            return True
+        except:
+            LOGGER.exception('__deliver')
+        return False
+
+    def __run(self, worker):
+        while True:
+            with worker['cond']:
+                while not self.stopped and not worker['control'] and not worker['ready']:
+                    worker['cond'].wait()
+                if self.stopped:
+                    break
+                key, submit_time, task = self.__next_task(worker)
+                worker['busy'] = True
+            try:
+                worker['conn'].send(task)
+                reply = worker['conn'].recv()
+            except:
+                if self.stopped:
+                    break
+                LOGGER.exception('__run')
+                LOGGER.error('Postprocessor worker {} exited, restart it'.format(worker['index']))
+                # 进程内的后处理实例状态随进程丢失，重启后重新创建
+                with self.lock:
+                    worker['busy'] = False
+                    worker['restarts'] += 1
+                self.__stop_process(worker, timeout=0)
+                self.__start_process(worker)
+                if key is not None:
+                    self.__deliver(key, False, None, task[4])
+                continue
+            if key is None:
+                with self.lock:
+                    worker['busy'] = False
+                continue
+            status, result, draw_image, process_time = reply
+            with self.lock:
+                worker['busy'] = False
+                worker['processed'] += 1
+                worker['latency'].append(time.perf_counter() - submit_time)
+                worker['process_time'].append(process_time)
+            self.__deliver(key, status, result, draw_image)
+
+    def get(self, timeout=None):
+        """
+        获取后处理结果，仅在未设置callback时使用
+        Args:
+            timeout: 超时时间，单位：秒，None为一直等待
+        Returns: (source_id, alg_name, status, result, draw_image) or None
+        """
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    @staticmethod
+    def __percentile(values, q):
+        if not values:
+            return 0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    def stats(self):
+        """
+        各工作进程的统计信息
+        Returns: [{index, pid, sources, depth, busy, submitted, processed, dropped, restarts,
+            latency_avg, latency_p99, process_avg}]，延迟单位：毫秒，latency为提交到返回结果的耗时
+        """
+        stats = []
+        with self.lock:
+            for worker in self.pool:
+                latency, process_time = list(worker['latency']), list(worker['process_time'])
+                stats.append({
+                    'index': worker['index'],
+                    'pid': worker['process'].pid,
+                    'sources': len(worker['sources']),
+                    'depth': sum(len(queue_) for queue_ in worker['queues'].values()),
+                    'busy': worker['busy'],
+                    'submitted': worker['submitted'],
+                    'processed': worker['processed'],
+                    'dropped': worker['dropped'],
+                    'restarts': worker['restarts'],
+                    'latency_avg': sum(latency) / len(latency) * 1000 if latency else 0,
+                    'latency_p99': self.__percentile(latency, 0.99) * 1000,
+                    'process_avg': sum(process_time) / len(process_time) * 1000 if process_time else 0
+                })
+        return stats
+
+    def close(self, timeout=5):
+        """
+        停止调度线程和工作进程，未处理的帧直接丢弃
+        Args:
+            timeout: 等待工作进程退出的时间，单位：秒
+        Returns: True or False
+        """
+        with self.lock:
+            self.stopped = True
+            for worker in self.pool:
+                worker['cond'].notify_all()
+        for worker in self.pool:
+            worker['thread'].join(timeout)
+            self.__stop_process(worker, timeout)
+        self.pool = []
+        return True
@@ -0,0 +1,121 @@
+import base64
+import pickle
+import struct
+import threading
+import zlib
+
+import cv2
+import numpy as np
+
+# 录制文件头，包含格式版本
+MAGIC = b'EAIREC01'
+# 每条记录的长度前缀，小端uint32
+LENGTH = struct.Struct('<I')
+# ndarray帧编码为jpg的质量
+JPEG_QUALITY = 95
+
+
+class Recorder:
+    """
+    后处理输入录制，每次postprocess的(source_id, alg_name, args, draw_image)序列化为一条记录，追加写入单个文件；
+    记录为长度前缀 + zlib压缩的pickle；base64帧解码为原始jpg字节保存，jpg字节帧原样保存，ndarray帧编码为jpg保存，
+    同一视频源同一时刻的帧被多个算法共用时只保存一次，之后的记录只保存引用
+    """
+
+    def __init__(self, path, max_records=None, level=1):
+        """
+        Args:
+            path: 录制文件路径，已存在时覆盖
+            max_records: 最多录制的记录数，None表示不限制
+            level: zlib压缩级别
+        """
+        self.path = path
+        self.max_records = max_records
+        self.level = level
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.records = 0
+        self.frames = 0
+        # {source_id: (time, 帧序号)}，用于帧去重
+        self.last_frames = {}
+
+    def __encode_image(self, source_id, time, image):
+        last = self.last_frames.get(source_id)
+        if last is not None and last[0] == time:
+            return 'ref', last[1]
+        if image is None:
+            return 'none', None
+        if isinstance(image, str):
+            frame = 'b64', base64.b64decode(image.encode('utf-8'))
+        elif isinstance(image, (bytes, bytearray, memoryview)):
+            frame = 'b64', bytes(image)
+        else:
+            frame = 'jpg', cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])[1].tobytes()
+        self.last_frames[source_id] = (time, self.frames)
+        self.frames += 1
+        return frame
+
+    def record(self, source_id, alg_name, args, draw_image):
+        """
+        录制一条记录，args在调用时即序列化，后处理过程中对args的修改不影响录制结果
+        Args:
+            source_id: 视频源id
+            alg_name: 算法名称
+            args: 后处理参数
+            draw_image: 用于绘制的图像数据，base64 string、jpg字节或opencv ndarray，帧句柄需由调用方先解析为ndarray
+        Returns: True：已录制，False：达到最大记录数或已关闭
+        """
+        with self.lock:
+            if self.file is None or (self.max_records is not None and self.records >= self.max_records):
+                return False
+            image = self.__encode_image(source_id, args.get('time'), draw_image)
+            data = zlib.compress(pickle.dumps((source_id, alg_name, args, image), pickle.HIGHEST_PROTOCOL),
+                                 self.level)
+            self.file.write(LENGTH.pack(len(data)))
+            self.file.write(data)
+            self.records += 1
+        return True
+
+    def close(self):
+        """
+        关闭录制文件
+        Returns: True or False
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        return True
+
+
+def iter_records(path, decode=True):
+    """
+    按录制顺序读取记录
+    Args:
+        path: 录制文件路径
+        decode: 是否还原帧，True：base64帧还原为base64 string，jpg帧解码为ndarray，False：保留编码后的字节
+    Returns: 生成器，(source_id, alg_name, args, draw_image)
+    """
+    frames = []
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Invalid record file: {}'.format(path))
+        while True:
+            header = f.read(LENGTH.size)
+            if len(header) < LENGTH.size:
+                break
+            data = f.read(LENGTH.unpack(header)[0])
+            source_id, alg_name, args, (kind, frame) = pickle.loads(zlib.decompress(data))
+            if 'ref' == kind:
+                image = frames[frame]
+            else:
+                if not decode or frame is None:
+                    image = frame
+                elif 'b64' == kind:
+                    image = base64.b64encode(frame).decode('utf-8')
+                else:
+                    image = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if 'none' != kind:
+                    frames.append(image)
+            yield source_id, alg_name, args, image
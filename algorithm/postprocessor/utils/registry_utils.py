@@ -0,0 +1,296 @@
+import ast
+import importlib
+import importlib.util
+import json
+import os
+import threading
+
+from logger import LOGGER
+
+# 元数据缓存格式版本，解析规则变化时递增
+CACHE_VERSION = 1
+
+
+class _MetadataVisitor(ast.NodeVisitor):
+    def __init__(self):
+        self.imports = set()
+        self.bases = None
+        self.models = []
+        self.reserved_args = {}
+        self.alg_types = set()
+
+    @staticmethod
+    def __is_self_attr(node, attr):
+        return isinstance(node, ast.Attribute) and attr == node.attr and isinstance(node.value, ast.Name) \
+            and 'self' == node.value.id
+
+    @staticmethod
+    def __literal(node):
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            return None
+
+    def visit_Import(self, node):
+        self.imports.update(alias.name.split('.')[0] for alias in node.names)
+
+    def visit_ImportFrom(self, node):
+        self.imports.add('.' * node.level + (node.module or '').split('.')[0])
+
+    def visit_ClassDef(self, node):
+        if 'Postprocessor' == node.name:
+            self.bases = [ast.unparse(base) if hasattr(ast, 'unparse') else getattr(base, 'id', '')
+                          for base in node.bases]
+        self.generic_visit(node)
+
+    def visit_Assign(self, node):
+        # self.xxx_model_name = '模型名称'
+        if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            for target in node.targets:
+                if isinstance(target, ast.Attribute) and target.attr.endswith('model_name') \
+                        and node.value.value not in self.models:
+                    self.models.append(node.value.value)
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        # self.reserved_args['key']
+        if self.__is_self_attr(node.value, 'reserved_args'):
+            key = node.slice.value if 'Index' == type(node.slice).__name__ else node.slice
+            if isinstance(key, ast.Constant) and isinstance(key.value, str):
+                self.reserved_args[key.value] = {'required': True, 'default': None}
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        # self.reserved_args.get('key', default)
+        if isinstance(node.func, ast.Attribute) and 'get' == node.func.attr \
+                and self.__is_self_attr(node.func.value, 'reserved_args') and node.args \
+                and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+            key = node.args[0].value
+            if key not in self.reserved_args:
+                default = self.__literal(node.args[1]) if len(node.args) > 1 else None
+                self.reserved_args[key] = {'required': False, 'default': default}
+        self.generic_visit(node)
+
+    def visit_Compare(self, node):
+        # 'xxx' == self.alg_type
+        operands = [node.left] + node.comparators
+        if any(self.__is_self_attr(operand, 'alg_type') for operand in operands):
+            self.alg_types.update(operand.value for operand in operands
+                                  if isinstance(operand, ast.Constant) and isinstance(operand.value, str))
+        self.generic_visit(node)
+
+
+def parse_metadata(path):
+    """
+    通过语法树解析算法模块的元数据，不导入模块
+    Args:
+        path: 模块文件路径
+    Returns: {'doc': 模块说明, 'postprocessor': 是否定义了Postprocessor类, 'bases': Postprocessor的基类,
+        'imports': 导入的顶层模块（相对导入以.开头）, 'models': 使用的模型名称（self.*model_name的字符串赋值）,
+        'reserved_args': {参数名: {'required': 是否必填（以下标访问）, 'default': get的默认值}},
+        'alg_types': 比较过的alg_type取值}
+    """
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), path)
+    visitor = _MetadataVisitor()
+    visitor.visit(tree)
+    return {
+        'doc': ast.get_docstring(tree),
+        'postprocessor': visitor.bases is not None,
+        'bases': visitor.bases or [],
+        'imports': sorted(visitor.imports),
+        'models': visitor.models,
+        'reserved_args': visitor.reserved_args,
+        'alg_types': sorted(visitor.alg_types)
+    }
+
+
+class PostprocessorRegistry:
+    """
+    后处理算法注册表，按文件名发现算法模块而不导入，只在首次使用时导入配置了的算法；
+    模块元数据（模型、reserved_args、alg_type等）在首次查询时通过语法树解析，导入算法不需要解析，
+    按文件的修改时间和大小缓存，可持久化到json文件，文件未变化时重启无需重新解析
+    """
+
+    def __init__(self, package='postprocessor', path=None, cache_path=None):
+        """
+        Args:
+            package: 后处理模块所在的包，通过package.alg_name导入
+            path: 包所在目录，默认通过package查找（不导入包）
+            cache_path: 元数据缓存文件路径，None表示只缓存在内存中
+        """
+        self.package = package
+        if path is None:
+            spec = importlib.util.find_spec(package)
+            path = list(spec.submodule_search_locations)[0]
+        self.path = path
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        # {alg_name: {'mtime_ns', 'size', 'metadata'}}，尚未解析的模块没有metadata
+        self.entries = None
+        # {alg_name: Postprocessor类}
+        self.classes = {}
+        # 统计
+        self.parsed = 0
+
+    def __load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if CACHE_VERSION != cache.get('version') or self.path != cache.get('path'):
+            return {}
+        return cache.get('modules', {})
+
+    def __save_cache(self):
+        # 缓存文件不可写时只影响下次启动的解析耗时，不影响扫描结果
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_VERSION, 'path': self.path, 'modules': self.entries}, f,
+                          ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+            return True
+        except OSError:
+            LOGGER.exception('__save_cache')
+        return False
+
+    def scan(self):
+        """
+        扫描包目录，只读取文件的修改时间和大小，未变化的模块复用缓存的元数据，新增或修改的模块在首次查询元数据时解析，
+        有变化时写回缓存文件
+        Returns: 候选算法模块数量
+        """
+        with self.lock:
+            cache = self.entries if self.entries is not None else self.__load_cache()
+            entries = {}
+            changed = False
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    name, ext = os.path.splitext(entry.name)
+                    if '.py' != ext or name.startswith('_') or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    cached = cache.get(name)
+                    if cached is not None and cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+                        entries[name] = cached
+                        continue
+                    changed = True
+                    entries[name] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+            changed = changed or set(entries) != set(cache)
+            self.entries = entries
+            if changed and self.cache_path:
+                self.__save_cache()
+            return len(entries)
+
+    def __get_entries(self):
+        if self.entries is None:
+            self.scan()
+        return self.entries
+
+    def __parse(self, alg_names):
+        """
+        解析尚未解析的模块元数据，有新解析的模块时写回缓存文件
+        Args:
+            alg_names: 算法名称列表
+        """
+        entries = self.__get_entries()
+        with self.lock:
+            parsed = 0
+            for alg_name in alg_names:
+                entry = entries.get(alg_name)
+                if entry is None or 'metadata' in entry:
+                    continue
+                try:
+                    metadata = parse_metadata(os.path.join(self.path, alg_name + '.py'))
+                except (OSError, SyntaxError, ValueError):
+                    metadata = None
+                if metadata is not None and not metadata['postprocessor']:
+                    metadata = None
+                entry['metadata'] = metadata
+                parsed += 1
+            self.parsed += parsed
+            if parsed and self.cache_path:
+                self.__save_cache()
+
+    def names(self):
+        """
+        全部算法名称，需要解析全部模块的元数据
+        Returns: 按名称排序的列表
+        """
+        entries = self.__get_entries()
+        self.__parse(list(entries))
+        return sorted(name for name, entry in entries.items() if entry['metadata'] is not None)
+
+    def __contains__(self, alg_name):
+        # 未解析的模块按文件名视为算法，导入时再确认
+        entry = self.__get_entries().get(alg_name)
+        return entry is not None and entry.get('metadata', True) is not None
+
+    def get_metadata(self, alg_name):
+        """
+        获取算法元数据，见parse_metadata
+        Args:
+            alg_name: 算法名称
+        Returns: dict or None
+        """
+        self.__parse([alg_name])
+        entry = self.__get_entries().get(alg_name)
+        return entry['metadata'] if entry is not None else None
+
+    def check_args(self, alg_name, reserved_args):
+        """
+        检查reserved_args是否包含算法必填的参数
+        Args:
+            alg_name: 算法名称
+            reserved_args: 算法参数
+        Returns: 缺少的参数名列表
+        """
+        metadata = self.get_metadata(alg_name) or {}
+        return [key for key, schema in metadata.get('reserved_args', {}).items()
+                if schema['required'] and key not in reserved_args]
+
+    def load(self, alg_name):
+        """
+        导入算法模块，同一算法只导入一次
+        Args:
+            alg_name: 算法名称
+        Returns: Postprocessor类
+        """
+        cls = self.classes.get(alg_name)
+        if cls is None:
+            if alg_name not in self:
+                raise KeyError('Unknown algorithm: {}'.format(alg_name))
+            cls = getattr(importlib.import_module('{}.{}'.format(self.package, alg_name)), 'Postprocessor', None)
+            if cls is None:
+                raise KeyError('Unknown algorithm: {}'.format(alg_name))
+            self.classes[alg_name] = cls
+        return cls
+
+    def preload(self, alg_names):
+        """
+        导入配置了的算法，未配置的算法不导入
+        Args:
+            alg_names: 算法名称列表
+        Returns: {alg_name: 导入失败的异常}
+        """
+        errors = {}
+        for alg_name in dict.fromkeys(alg_names):
+            try:
+                self.load(alg_name)
+            except Exception as e:
+                errors[alg_name] = e
+        return errors
+
+    def create(self, source_id, alg_name):
+        """
+        创建后处理实例
+        Args:
+            source_id: 视频源id
+            alg_name: 算法名称
+        Returns: Postprocessor实例
+        """
+        return self.load(alg_name)(source_id, alg_name)
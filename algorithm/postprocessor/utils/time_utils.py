@@ -1,3 +1,4 @@
+import bisect
 import datetime
 import time
 from contextlib import contextmanager
@@ -9,6 +10,10 @@ DATE_FORMAT = '%Y-%m-%d'
 TIME_FORMAT = '%H:%M:%S'
 MIN_TIMESTAMP = time.mktime(datetime.datetime.min.timetuple())
 MAX_TIMESTAMP = time.mktime(datetime.datetime.max.timetuple())
+DAY_SECONDS = 86400
+WEEK_SECONDS = 7 * DAY_SECONDS
+# 1970-01-01为星期四，本地时间加3天后按周取余即为距星期一0点的秒数
+EPOCH_WEEK_OFFSET = 3 * DAY_SECONDS
 
 
 @contextmanager
@@ -102,3 +107,66 @@ def get_day_second(timestamp=None):
     except:
         LOGGER.exception('get_day_second')
     return None
+
+
+def get_week_second(timestamp):
+    """
+    本地时间距星期一0点的秒数，不构造datetime
+    Args:
+        timestamp: 时间戳
+    Returns: 秒数 or None
+    """
+    try:
+        local = timestamp + time.localtime(timestamp).tm_gmtoff
+        return (local + EPOCH_WEEK_OFFSET) % WEEK_SECONDS
+    except:
+        LOGGER.exception('get_week_second')
+    return None
+
+
+class WeeklyPlan:
+    """
+    编译后的周计划，各天的时间段合并为一周内有序的区间边界，查询为一次二分查找，并给出下一次状态切换的时间
+    """
+
+    def __init__(self, plan, recheck_interval=900):
+        """
+        Args:
+            plan: 计划时间，{weekday: [[开始秒数, 结束秒数], ...]}，weekday为1~7，秒数为一天中的秒数
+            recheck_interval: 状态最长有效时间，单位：秒，保证时区偏移（夏令时）变化后重新计算
+        """
+        self.recheck_interval = recheck_interval
+        intervals = []
+        for weekday in range(1, 8):
+            for time_slice in plan.get(weekday) or []:
+                # 时间段不跨天
+                start, end = max(time_slice[0], 0), min(time_slice[1], DAY_SECONDS)
+                if start < end:
+                    intervals.append(((weekday - 1) * DAY_SECONDS + start, (weekday - 1) * DAY_SECONDS + end))
+        intervals.sort()
+        # [开始, 结束, 开始, 结束, ...]，落在奇数个边界之后即在计划内
+        self.bounds = []
+        for start, end in intervals:
+            if self.bounds and start <= self.bounds[-1]:
+                self.bounds[-1] = max(self.bounds[-1], end)
+            else:
+                self.bounds.extend([start, end])
+
+    def state(self, timestamp):
+        """
+        查询计划状态
+        Args:
+            timestamp: 时间戳
+        Returns: (是否在计划内, 状态有效截止时间戳)
+        """
+        week_second = get_week_second(timestamp)
+        if week_second is None:
+            return False, timestamp
+        index = bisect.bisect_right(self.bounds, week_second)
+        if index < len(self.bounds):
+            next_bound = self.bounds[index]
+        else:
+            next_bound = WEEK_SECONDS + (self.bounds[0] if self.bounds else 0)
+        next_transition = timestamp + (next_bound - week_second)
+        next_recheck = (timestamp // self.recheck_interval + 1) * self.recheck_interval
+        return 1 == index % 2, min(next_transition, next_recheck)
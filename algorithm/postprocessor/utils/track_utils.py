@@ -0,0 +1,132 @@
+import collections
+import heapq
+import itertools
+
+
+class Track:
+    """
+    单个跟踪目标的状态
+    """
+    __slots__ = ('track_id', 'created', 'last_seen', 'window', 'hit', 'pre_target', 'time', 'history', 'votes')
+
+    def __init__(self, track_id, generation, history_size=None):
+        """
+        Args:
+            track_id: 跟踪id
+            generation: 创建时的帧序号
+            history_size: 历史目标的最大数量，None表示不保存历史目标
+        """
+        self.track_id = track_id
+        self.created = generation
+        # 最近一次出现的帧序号
+        self.last_seen = generation
+        self.window = None
+        self.hit = False
+        self.pre_target = None
+        self.time = None
+        # 历史目标，环形缓冲区，超过最大数量时自动丢弃最旧的
+        self.history = collections.deque(maxlen=history_size) if history_size is not None else None
+        # 识别结果的投票器，如车牌逐字符投票PlateVoter，window只用于时间窗口
+        self.votes = None
+
+    def __repr__(self):
+        return 'Track(track_id={}, last_seen={}, hit={})'.format(self.track_id, self.last_seen, self.hit)
+
+
+class TrackTable:
+    """
+    跟踪目标状态表，每帧只标记出现的目标（记录帧序号），连续丢失超过max_retain帧的目标通过按淘汰帧序号排序的最小堆
+    惰性淘汰，无需每帧遍历全部目标；淘汰时间以出堆时的最近出现帧序号为准，未到期的目标重新入堆
+    """
+
+    def __init__(self, max_retain, history_size=None, on_create=None, on_expire=None):
+        """
+        Args:
+            max_retain: 目标允许连续丢失的最大帧数
+            history_size: 每个目标历史目标的最大数量，None表示不保存历史目标
+            on_create: 目标创建时的回调，on_create(track)
+            on_expire: 目标淘汰时的回调，on_expire(track)
+        """
+        self.max_retain = max_retain
+        self.history_size = history_size
+        self.on_create = on_create
+        self.on_expire = on_expire
+        # {track_id: Track}
+        self.tracks = {}
+        # 帧序号
+        self.generation = 0
+        # [(淘汰帧序号, 序号, track_id), ...]
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __contains__(self, track_id):
+        return track_id in self.tracks
+
+    def __iter__(self):
+        return iter(self.tracks.values())
+
+    def __push(self, track):
+        heapq.heappush(self.heap, (track.last_seen + self.max_retain + 1, next(self.counter), track.track_id))
+
+    def step(self, track_ids):
+        """
+        进入新的一帧，标记本帧出现的目标，淘汰连续丢失超过max_retain帧的目标
+        Args:
+            track_ids: 本帧出现的跟踪id
+        Returns: 淘汰的目标列表
+        """
+        self.generation += 1
+        for track_id in track_ids:
+            track = self.tracks.get(track_id)
+            if track is not None:
+                track.last_seen = self.generation
+        expired = []
+        while self.heap and self.heap[0][0] <= self.generation:
+            _, _, track_id = heapq.heappop(self.heap)
+            track = self.tracks.get(track_id)
+            if track is None:
+                continue
+            if track.last_seen + self.max_retain + 1 > self.generation:
+                # 期间出现过，按最近出现的帧序号重新入堆
+                self.__push(track)
+                continue
+            del self.tracks[track_id]
+            expired.append(track)
+            if self.on_expire is not None:
+                self.on_expire(track)
+        return expired
+
+    def get(self, track_id):
+        """
+        获取目标状态
+        Args:
+            track_id: 跟踪id
+        Returns: Track or None
+        """
+        return self.tracks.get(track_id)
+
+    def create(self, track_id):
+        """
+        创建目标状态，视为在当前帧出现
+        Args:
+            track_id: 跟踪id
+        Returns: Track
+        """
+        track = Track(track_id, self.generation, self.history_size)
+        self.tracks[track_id] = track
+        self.__push(track)
+        if self.on_create is not None:
+            self.on_create(track)
+        return track
+
+    def lost(self, track):
+        """
+        目标已连续丢失的帧数
+        Args:
+            track: Track
+        Returns: 帧数
+        """
+        return self.generation - track.last_seen
@@ -1,12 +1,6 @@
-import numpy as np
-
 import gv
 from logger import LOGGER
 from postprocessor import Postprocessor as BasePostprocessor
-from .utils import json_utils
-from .utils.cv_utils.color_utils import rgb_reverse
-from .utils.cv_utils.crop_utils import crop_rectangle
-from .utils.image_utils import base64_to_opencv, opencv_to_base64
 
 
 class Postprocessor(BasePostprocessor):
@@ -18,8 +12,6 @@ class Postprocessor(BasePostprocessor):
         self.group_type = None
         self.similarity = None
         self.limit = None
-        self.timeout = None
-        self.reinfer_result = {}
         self.distance_th = 10
 
     def __reinfer(self, filter_result):
@@ -28,62 +20,31 @@ class Postprocessor(BasePostprocessor):
             LOGGER.error('Person model result is None!')
             return False
         person_rectangles = sorted(person_rectangles, key=lambda x: x['conf'], reverse=True)
-        draw_image = base64_to_opencv(self.draw_image)
+        draw_image = self._get_image()
         image_height, image_width, _ = draw_image.shape
-        count = 0
+        batch = []
         for person_rectangle in person_rectangles:
-            if count >= self.limit:
+            if len(batch) >= self.limit:
                 break
             xyxy = person_rectangle['xyxy']
             if xyxy[0] < self.distance_th or \
                     xyxy[2] > image_width - self.distance_th or \
                     xyxy[3] > image_height - self.distance_th:
                 continue
-            cropped_image = crop_rectangle(draw_image, xyxy)
-            cropped_image = rgb_reverse(cropped_image)
-            source_data = {
-                'source_id': self.source_id,
-                'time': self.time * 1000000,
-                'infer_image': opencv_to_base64(cropped_image),
-                'draw_image': None,
-                'reserved_data': {
-                    'specified_model': [self.workclothes_model_name],
-                    'xyxy': xyxy,
-                    'unsort': True
-                }
-            }
-            self.rq_source.put(json_utils.dumps(source_data))
-            count += 1
-        if count > 0:
-            self.reinfer_result[self.time] = {
-                'count': count,
-                'draw_image': self.draw_image,
-                'result': []
-            }
-        return count
-
-    def __check_expire(self):
-        for time in list(self.reinfer_result.keys()):
-            if time < self.time - self.timeout:
-                LOGGER.warning('Reinfer result expired, source_id={}, alg_name={}, time={}, timeout={}'.format(
-                    self.source_id, self.alg_name, time, self.timeout))
-                del self.reinfer_result[time]
-        return True
+            batch.append(xyxy)
+        cropped_images = self._crop_reinfer_images(self.workclothes_model_name, draw_image, batch)
+        return self._reinfer_batch(self.workclothes_model_name, cropped_images, batch)
 
-    def __process_blacklist(self, feature):
-        id_, score = self.index.search(feature, self.similarity) if self.index is not None else (None, None)
-        if id_ is not None:
-            work_clothes_info = self.index.query(id_)
-            if work_clothes_info:
-                return True, work_clothes_info['name']
+    @staticmethod
+    def __process_blacklist(work_clothes_info):
+        if work_clothes_info:
+            return True, work_clothes_info['name']
         return False, '人'
 
-    def __process_whitelist(self, feature):
-        id_, score = self.index.search(feature, self.similarity) if self.index is not None else (None, None)
-        if id_ is not None:
-            work_clothes_info = self.index.query(id_)
-            if work_clothes_info:
-                return False, work_clothes_info['name']
+    @staticmethod
+    def __process_whitelist(work_clothes_info):
+        if work_clothes_info:
+            return False, work_clothes_info['name']
         return True, '未穿工服'
 
     def _process(self, result, filter_result):
@@ -96,51 +57,46 @@ class Postprocessor(BasePostprocessor):
             self.similarity = max(self.reserved_args['similarity'] - 0.3, 0)
         if self.limit is None:
             self.limit = self.reserved_args['extra_model'][self.workclothes_model_name]
-        if self.timeout is None:
-            self.timeout = (self.frame_interval / 1000) * 2
-            LOGGER.info('source_id={}, alg_name={}, timeout={}'.format(self.source_id, self.alg_name, self.timeout))
         polygons = self._gen_polygons()
         if not self.reserved_data:
             count = self.__reinfer(filter_result)
             if not count:
-                self.__check_expire()
                 result['hit'] = False
                 result['data']['bbox']['polygons'].update(polygons)
                 return True
             return False
-        self.__check_expire()
         model_name, targets = next(iter(filter_result.items()))
         if model_name != self.workclothes_model_name:
             LOGGER.error('Get wrong model result, expect {}, but get {}'.format(
                 self.workclothes_model_name, model_name))
             return False
-        if self.reinfer_result.get(self.time) is None:
-            LOGGER.warning('Not found reinfer result, time={}'.format(self.time))
+        reinfer_result_ = self._reinfer_complete(self._get_batch_result(targets))
+        if reinfer_result_ is None:
             return False
-        self.reinfer_result[self.time]['result'].append((targets, self.reserved_data['xyxy']))
-        if len(self.reinfer_result[self.time]['result']) < self.reinfer_result[self.time]['count']:
-            return False
-        reinfer_result_ = self.reinfer_result.pop(self.time)
         self.draw_image = reinfer_result_['draw_image']
+        # 一帧内的特征批量检索
+        features, xyxys = [], []
         for targets, xyxy in reinfer_result_['result']:
             for target in targets:
                 feature = target.pop('feature', None)
                 if feature is not None:
-                    np_feature = np.array(feature, dtype=np.float32)
-                    if 'blacklist' == self.group_type:
-                        hit_, label = self.__process_blacklist(np_feature)
-                    elif 'whitelist' == self.group_type:
-                        hit_, label = self.__process_whitelist(np_feature)
-                    else:
-                        LOGGER.error('Unknown group_type: {}'.format(self.group_type))
-                        continue
-                    if hit_:
-                        hit = hit_
-                        result['data']['bbox']['rectangles'].append(self._gen_rectangle(
-                            xyxy, self.alert_color, label, None))
-                    else:
-                        result['data']['bbox']['rectangles'].append(self._gen_rectangle(
-                            xyxy, self.non_alert_color, label, None))
+                    features.append(feature)
+                    xyxys.append(xyxy)
+        for (info, _), xyxy in zip(self._search_index(features, self.similarity), xyxys):
+            if 'blacklist' == self.group_type:
+                hit_, label = self.__process_blacklist(info)
+            elif 'whitelist' == self.group_type:
+                hit_, label = self.__process_whitelist(info)
+            else:
+                LOGGER.error('Unknown group_type: {}'.format(self.group_type))
+                continue
+            if hit_:
+                hit = hit_
+                result['data']['bbox']['rectangles'].append(self._gen_rectangle(
+                    xyxy, self.alert_color, label, None))
+            else:
+                result['data']['bbox']['rectangles'].append(self._gen_rectangle(
+                    xyxy, self.non_alert_color, label, None))
         result['hit'] = hit
         result['data']['group'] = {
             'id': self.index.group_id if self.index is not None else None,
@@ -172,7 +128,8 @@ class Postprocessor(BasePostprocessor):
                 # 生成矩形框
                 targets.append(self._gen_rectangle(xyxy, self.non_alert_color, label, engine_result_['conf']))
         elif model_name == self.workclothes_model_name:
-            targets.append({
-                'feature': engine_result
-            })
+            for engine_result_ in engine_result:
+                targets.append([{
+                    'feature': engine_result_
+                }])
         return targets